@@ -0,0 +1,60 @@
+"""
+Production server settings: gunicorn -c gunicorn.conf.py
+
+The application is imported once in the master and forked into the workers,
+each worker opens its database connection and runs a first query before it
+accepts requests. Every setting can be overridden from the environment.
+"""
+import os
+
+
+def cpu_count():
+    """CPUs this process may run on, cgroup/affinity limits included"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# GUNICORN_ASGI=1 serves technical_test.asgi with uvicorn workers (optional
+# asgi group), sync workers serve technical_test.wsgi otherwise
+asgi = os.environ.get("GUNICORN_ASGI", "0") == "1"
+wsgi_app = f"technical_test.{'asgi' if asgi else 'wsgi'}:application"
+worker_class = "uvicorn.workers.UvicornWorker" if asgi else "sync"
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", cpu_count() * 2 + 1))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# Recycle the workers periodically, jittered so they don't restart together
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+accesslog = os.environ.get("GUNICORN_ACCESSLOG")
+errorlog = "-"
+
+
+def when_ready(server):
+    if preload_app:
+        # Imported code is shared with the workers, sockets must not be
+        from technical_test.warmup import close_connections, load_urls, log_cache_checks
+
+        log_cache_checks()
+        load_urls()
+        close_connections()
+
+
+def post_worker_init(worker):
+    from session_system.sweeper import start_sweeper
+    from technical_test.warmup import log_cache_checks, warm_up
+
+    if not preload_app:
+        # Django isn't loaded in the master
+        log_cache_checks()
+    warm_up()
+    # In the workers, a thread started in the master wouldn't survive the fork
+    worker.sweeper = start_sweeper()
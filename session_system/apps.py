@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class SessionSystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'session_system'
+
+    def ready(self):
+        # Hook the SQL instrumentation before any database connection opens
+        from . import metrics  # noqa: F401
+        # Keep the session store and the replica routing in sync with
+        # Session.save
+        from . import db_router, session_store  # noqa: F401
+        from . import checks  # noqa: F401
+        from .structured_logging import start_queue_listeners
+
+        # The sweeper is started by the gunicorn workers (gunicorn.conf.py),
+        # not by every manage.py command
+        start_queue_listeners()
@@ -0,0 +1,180 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.http import JsonResponse
+from django.db.models import Q
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods
+import json
+
+from session_system.token_authentication_middleware import token_auth
+from . import upsert
+from .confirmation import confirm_session
+from .idempotency import idempotent
+from .metrics import with_outcome
+from .models import (
+    User,
+    Device,
+    Session,
+    CONFIRMED_SESSION_LIFETIME,
+    deconstruct_uuid,
+)
+from .session_store import expire_stale_sessions
+from .sharding import route_to_shard, shard_for_email
+from .views import (
+    session_response,
+    parse_session_data,
+    is_created_after,
+    log_otp_code,
+    store_session,
+    update_stored_session,
+)
+
+
+async def aget_alive_session(user, device):
+    now = timezone.now()
+    sessions = Session.objects.filter(user=user, device=device).exclude(
+        status="expired"
+    )
+    alive_sessions = sessions.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        generation=user.session_generation + device.session_generation,
+    )
+    if device.type != "mobi":
+        # Lets Postgres prune the partitions that can't hold an alive session
+        alive_sessions = alive_sessions.filter(
+            created_at__gt=now - CONFIRMED_SESSION_LIFETIME
+        )
+    try:
+        session = await alive_sessions.alatest("created_at")
+    except Session.DoesNotExist:
+        # Flag the stale sessions left behind in a single statement
+        await sync_to_async(expire_stale_sessions)([device.uuid], now)
+        raise
+    # Related objects are already loaded, the serializer can't lazy load here
+    session.user = user
+    session.device = device
+    return session
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@idempotent
+async def create_session(request, *args, **kwargs):
+    try:
+        data = json.loads(request.body)
+        try:
+            user_email, device_type, device_vendor = parse_session_data(data)
+        except ValueError:
+            return JsonResponse({"error": "Invalid data"}, status=400)
+        route_to_shard(shard_for_email(user_email))
+        if settings.SESSION_UPSERT_FAST_PATH:
+            result = await sync_to_async(upsert.get_or_create_session)(
+                user_email, device_type, device_vendor
+            )
+            if result is not None:
+                session, created = result
+                await sync_to_async(store_session)(session)
+                log_otp_code(session)
+                return with_outcome(
+                    session_response(session, status=201 if created else 200),
+                    "created" if created else "reused",
+                )
+
+        user, user_created = await User.objects.aget_or_create(email=user_email)
+        device, device_created = await Device.objects.aget_or_create(
+            user=user, type=device_type, vendor_uuid=device_vendor
+        )
+
+        # Create a new Session, a brand new device has no session to reuse
+        try:
+            if device_created:
+                raise Session.DoesNotExist
+            session = await aget_alive_session(user, device)
+            # Only the digest of the current token is known, issue a new one
+            session.set_token()
+            await session.asave(update_fields=["token_hash"])
+            await sync_to_async(store_session)(session)
+            log_otp_code(session)
+            return with_outcome(
+                session_response(session, status=200), "reused"
+            )
+        except Session.DoesNotExist:
+            session = Session(
+                user=user,
+                device=device,
+                is_new_user=user_created,
+                is_new_device=device_created,
+            )
+            await session.asave(force_insert=True)
+            await sync_to_async(store_session)(session)
+            log_otp_code(session)
+            return with_outcome(
+                session_response(session, status=201), "created"
+            )
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+
+@csrf_exempt
+@require_http_methods(["PATCH", "PUT"])
+@token_auth
+async def update_session(request, prefixed_uuid):
+    try:
+        data = json.loads(request.body)
+        otp_code = data.get("otp_code")
+        _, uuid = deconstruct_uuid(prefixed_uuid)
+
+        # The authenticated session is the only one the token can update
+        if str(request.session.uuid) != uuid:
+            raise Session.DoesNotExist
+
+        response = await sync_to_async(update_stored_session)(
+            request.session_token, uuid, otp_code
+        )
+        if response is not None:
+            return response
+
+        if isinstance(otp_code, str):
+            session = await sync_to_async(confirm_session)(
+                uuid, request.session_token, otp_code
+            )
+            if session is not None:
+                return with_outcome(
+                    session_response(session, status=200), "confirmed"
+                )
+
+        # Nothing confirmed, find out why
+        session = await Session.objects.select_related("user", "device").aget(
+            uuid=uuid
+        )
+        session.token = request.session_token
+
+        # Check if the request is made within 5 minutes of session creation
+        if session.status == "expired" or is_created_after(
+            session.created_at, minutes=5
+        ):
+            if session.status != "expired":
+                session.status = "expired"
+                await session.asave(update_fields=["status", "expires_at"])
+            return with_outcome(
+                JsonResponse({"error": "Session expired"}, status=401), "expired"
+            )
+
+        # Verify OTP code
+        if session.otp_code == otp_code:
+            # Already confirmed by a previous request
+            return with_outcome(
+                session_response(session, status=200), "confirmed"
+            )
+        else:
+            return with_outcome(
+                JsonResponse({"error": "Invalid OTP code"}, status=400), "otp_mismatch"
+            )
+
+    except Session.DoesNotExist:
+        return with_outcome(
+            JsonResponse({"error": "Session not found"}, status=404), "not_found"
+        )
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
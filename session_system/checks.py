@@ -0,0 +1,49 @@
+"""
+System checks of the session_system settings, run by manage.py commands. The
+deployment ones only run with check --deploy, and when gunicorn starts (see
+gunicorn.conf.py): a per-process cache is fine for runserver and the tests.
+"""
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+
+from .db_router import replica_aliases, sticky_cache
+from .revocation import generations_cache
+
+
+def is_shared(cache):
+    """Whether the entries of `cache` are seen by every web process"""
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+@register(Tags.caches)
+def check_replica_cache(app_configs=None, **kwargs):
+    cache, _ = sticky_cache()
+    if not replica_aliases() or is_shared(cache):
+        return []
+    return [
+        Warning(
+            "SESSION_REPLICAS['CACHE'] is local to each process: a session "
+            "written by one process may be read from a lagging replica by the "
+            "others.",
+            hint="Point it at a shared cache, e.g. set SESSION_STORE_CACHE_URL "
+            "for the 'sessions' cache.",
+            id="session_system.W001",
+        )
+    ]
+
+
+@register(Tags.caches, deploy=True)
+def check_revocation_cache(app_configs=None, **kwargs):
+    if is_shared(generations_cache()):
+        return []
+    return [
+        Warning(
+            "SESSION_REVOCATION['CACHE'] is local to each process: a revoked "
+            "session keeps working in the other processes until their token "
+            "cache expires (SESSION_TOKEN_CACHE['TTL']).",
+            hint="Point it at a shared cache, e.g. set SESSION_STORE_CACHE_URL "
+            "for the 'sessions' cache.",
+            id="session_system.W002",
+        )
+    ]
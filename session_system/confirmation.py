@@ -0,0 +1,91 @@
+"""
+OTP confirmation of update_session as one conditional UPDATE: concurrent
+confirmations can't overwrite each other and a successful one costs a single
+round-trip.
+"""
+from django.db import connections, router
+from django.utils import timezone
+import re
+
+from .db_router import pin_session
+from .models import (
+    User,
+    Device,
+    Session,
+    CONFIRMED_SESSION_LIFETIME,
+    PENDING_SESSION_LIFETIME,
+    DEVICE_TYPE_CODES,
+    STATUS_CODES,
+    from_db_row,
+    hash_token,
+)
+from .token_cache import token_cache
+from .upsert import SESSION_FIELDS
+
+
+OTP_CODE_RE = re.compile(r"[0-9]{6}")
+
+CONFIRM_SESSION_SQL = """
+UPDATE {session} session SET
+    status = {confirmed},
+    expires_at = CASE WHEN device.type = {mobi} THEN NULL
+                 ELSE session.created_at + %(confirmed_lifetime)s END
+FROM {device} device, {user} usr
+WHERE session.uuid = %(uuid)s
+AND session.token_hash = %(token_hash)s
+AND session.otp_code = %(otp_code)s
+AND session.status = {pending}
+AND session.created_at > %(window_start)s
+AND device.uuid = session.device_id
+AND usr.uuid = session.user_id
+RETURNING {session_fields}, usr.email, device.vendor_uuid, device.type
+"""
+
+
+def confirm_session(session_uuid, token, otp_code):
+    """
+    Confirm the pending session matching the uuid, token and OTP code if it
+    was created less than PENDING_SESSION_LIFETIME ago. Return the confirmed
+    session with its user and device loaded, None when no session matched.
+    """
+    using = router.db_for_write(Session)
+    token_hash = hash_token(token)
+    # The column is an integer, a code that isn't 6 digits matches nothing
+    otp_value = int(otp_code) if OTP_CODE_RE.fullmatch(otp_code) else None
+    sql = CONFIRM_SESSION_SQL.format(
+        session=Session._meta.db_table,
+        device=Device._meta.db_table,
+        user=User._meta.db_table,
+        session_fields=", ".join(f"session.{field}" for field in SESSION_FIELDS),
+        pending=STATUS_CODES["pending"],
+        confirmed=STATUS_CODES["confirmed"],
+        mobi=DEVICE_TYPE_CODES["mobi"],
+    )
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            sql,
+            {
+                "uuid": session_uuid,
+                "token_hash": token_hash,
+                "otp_code": otp_value,
+                "confirmed_lifetime": CONFIRMED_SESSION_LIFETIME,
+                "window_start": timezone.now() - PENDING_SESSION_LIFETIME,
+            },
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    token_cache.invalidate(token_hash)
+
+    *session_values, email, device_vendor, device_type = row
+    session = from_db_row(Session, using, SESSION_FIELDS, session_values)
+    session.token = token
+    pin_session(token_hash, session.user_id)
+    session.user = User.from_db(using, ["uuid", "email"], [session.user_id, email])
+    session.device = from_db_row(
+        Device,
+        using,
+        ["uuid", "user_id", "vendor_uuid", "type"],
+        [session.device_id, session.user_id, device_vendor, device_type],
+    )
+    return session
@@ -0,0 +1,167 @@
+"""
+Reads go to the replicas (DATABASES aliases starting with "replica") whose
+lag is under SESSION_REPLICAS["MAX_LAG"], writes to the primary.
+
+A request reads from the primary once it wrote, and for STICKY_SECONDS after
+a session was created or confirmed when it comes with its token or is made
+by its user, so clients read their own writes. These pins are kept in the
+SESSION_REPLICAS["CACHE"] cache, which the web processes must share.
+"""
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingState:
+    """Routing of the request being handled, shared with the ORM threads"""
+
+    def __init__(self, pinned=False, shard=None):
+        self.pinned = pinned
+        # Set by session_system.sharding
+        self.shard = shard
+
+
+current_routing = ContextVar("current_routing", default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith("replica")]
+
+
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReplicaMonitor:
+    """
+    Lag of the replicas in seconds, measured at most every `interval` seconds
+    by the thread routing a query. An unreachable replica has no lag (None).
+    """
+
+    def __init__(self, aliases, interval=1, clock=time.monotonic):
+        self.aliases = aliases
+        self.interval = interval
+        self.clock = clock
+        self.lags = {}
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def measure(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                # A primary standing in for a replica isn't in recovery
+                (lag,) = cursor.fetchone()
+                return float(lag or 0)
+        except DatabaseError:
+            logger.warning("Replica %s is unreachable", alias, exc_info=True)
+            return None
+
+    def get_lags(self):
+        now = self.clock()
+        if self.checked_at is None or now - self.checked_at >= self.interval:
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.lags = {alias: self.measure(alias) for alias in self.aliases}
+                    self.checked_at = self.clock()
+                finally:
+                    self._lock.release()
+        return self.lags
+
+    def healthy(self, max_lag):
+        return [
+            alias
+            for alias, lag in self.get_lags().items()
+            if lag is not None and lag <= max_lag
+        ]
+
+
+class PrimaryReplicaRouter:
+    def __init__(self, replicas=None, monitor=None):
+        self.replicas = replica_aliases() if replicas is None else replicas
+        options = getattr(settings, "SESSION_REPLICAS", {})
+        self.max_lag = options.get("MAX_LAG", 2)
+        self.monitor = monitor or ReplicaMonitor(
+            self.replicas, interval=options.get("LAG_CHECK_INTERVAL", 1)
+        )
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or is_pinned():
+            return DEFAULT_DB_ALIAS
+        replicas = self.monitor.healthy(self.max_lag)
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # The rest of the request reads what it wrote
+        use_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def use_primary():
+    """Read from the primary for the rest of the current request"""
+    routing = current_routing.get()
+    if routing is not None:
+        routing.pinned = True
+
+
+def is_pinned():
+    routing = current_routing.get()
+    return routing is not None and routing.pinned
+
+
+def start_routing():
+    """Route the current request from scratch, return the token to reset"""
+    return current_routing.set(RoutingState())
+
+
+def sticky_cache():
+    options = getattr(settings, "SESSION_REPLICAS", {})
+    return caches[options.get("CACHE", "sessions")], options.get("STICKY_SECONDS", 5)
+
+
+def pin_session(token_hash, user_id):
+    """Send the reads of this session token and user to the primary for a while"""
+    if not replica_aliases():
+        return
+    cache, timeout = sticky_cache()
+    if timeout:
+        cache.set_many(
+            {f"pin:token:{token_hash.hex()}": 1, f"pin:user:{user_id}": 1}, timeout
+        )
+
+
+def is_token_pinned(token_hash):
+    cache, timeout = sticky_cache()
+    return (
+        bool(timeout) and cache.get(f"pin:token:{token_hash.hex()}") is not None
+    )
+
+
+def is_user_pinned(user_id):
+    cache, timeout = sticky_cache()
+    return bool(timeout) and cache.get(f"pin:user:{user_id}") is not None
+
+
+@receiver(post_save, sender="session_system.Session")
+def pin_saved_session(sender, instance, **kwargs):
+    pin_session(bytes(instance.token_hash), instance.user_id)
@@ -0,0 +1,70 @@
+"""
+Compact column types keeping the Python values of the fields they replace:
+the ORM, the views and the JSON responses still deal in strings.
+"""
+from django.core import exceptions
+from django.db import models
+
+
+class EnumField(models.PositiveSmallIntegerField):
+    """
+    A string among `codes` stored as its smallint code. Raw SQL must use the
+    codes, e.g. `status <> {STATUS_CODES["expired"]}`.
+    """
+
+    def __init__(self, *args, codes, **kwargs):
+        self.codes = dict(codes)
+        self.names = {code: name for name, code in self.codes.items()}
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["codes"] = self.codes
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else self.names[value]
+
+    def to_python(self, value):
+        if value is None or value in self.codes:
+            return value
+        if value in self.names:
+            return self.names[value]
+        raise exceptions.ValidationError(
+            self.error_messages["invalid_choice"],
+            code="invalid_choice",
+            params={"value": value},
+        )
+
+    def get_prep_value(self, value):
+        if isinstance(value, str):
+            try:
+                value = self.codes[value]
+            except KeyError:
+                raise ValueError(f"{self.name} has no code for {value!r}")
+        return super().get_prep_value(value)
+
+
+class OtpCodeField(models.PositiveIntegerField):
+    """A code of `digits` digits stored as an integer, zero-padded in Python"""
+
+    def __init__(self, *args, digits=6, **kwargs):
+        self.digits = digits
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.digits != 6:
+            kwargs["digits"] = self.digits
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else f"{value:0{self.digits}d}"
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return f"{value:0{self.digits}d}"
+
+    def get_prep_value(self, value):
+        return super().get_prep_value(None if value == "" else value)
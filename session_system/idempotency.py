@@ -0,0 +1,298 @@
+"""
+Replay of the retries of POST /session/: a request carrying an
+Idempotency-Key header gets the response of the first request with the same
+key, byte for byte, for SESSION_IDEMPOTENCY["TTL"] seconds. Responses are
+kept in a cache (Redis in production) and in the IdempotencyRecord table,
+read when the cache lost them. A retry arriving while the first request is
+still handled waits for its response instead of doing the work again.
+
+Replayed responses carry the session token. The records only hold it sealed
+with a key derived from SECRET_KEY, so a dump of the table gives no token,
+and are only kept TTL seconds (purged by the sweeper).
+"""
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from datetime import timedelta
+from functools import wraps
+import asyncio
+import hashlib
+import json
+import time
+
+from .metrics import with_outcome
+from .models import IdempotencyRecord
+
+
+IdempotentResponse = namedtuple(
+    "IdempotentResponse", ["fingerprint", "status", "content_type", "body"]
+)
+
+
+# Stands for the token in the bodies of the records, JSON can't contain it
+TOKEN_PLACEHOLDER = b"\x00"
+
+
+def token_keystream(key, length):
+    """Keystream sealing the token of the record `key`, from SECRET_KEY"""
+    blocks = (
+        salted_hmac(__name__, f"{key}:{counter}", algorithm="sha256").digest()
+        for counter in range(0, length // 32 + 1)
+    )
+    return b"".join(blocks)[:length]
+
+
+def seal_token(key, token):
+    token = token.encode()
+    return bytes(a ^ b for a, b in zip(token, token_keystream(key, len(token))))
+
+
+def unseal_token(key, sealed):
+    return bytes(a ^ b for a, b in zip(sealed, token_keystream(key, len(sealed))))
+
+
+def response_token(response):
+    """The session token of a JSON response, None when there is none"""
+    if not response.content_type.startswith("application/json"):
+        return None
+    try:
+        data = json.loads(response.body)
+    except ValueError:
+        return None
+    token = data.get("token") if isinstance(data, dict) else None
+    return token if isinstance(token, str) and token else None
+
+
+class IdempotencyStore:
+    """
+    Responses keyed by request in the SESSION_IDEMPOTENCY["CACHE"] cache, with
+    the database as fallback. The settings are read on every call so they can
+    be overridden in tests.
+    """
+
+    key_prefix = "idempotency:"
+    lock_prefix = "idempotency-lock:"
+
+    @property
+    def options(self):
+        return settings.SESSION_IDEMPOTENCY
+
+    @property
+    def enabled(self):
+        return self.options.get("ENABLED", False)
+
+    @property
+    def cache(self):
+        return caches[self.options.get("CACHE", "default")]
+
+    def get(self, key, fallback=True):
+        response = self.cache.get(f"{self.key_prefix}{key}")
+        if response is None and fallback:
+            record = (
+                IdempotencyRecord.objects.using(DEFAULT_DB_ALIAS)
+                .filter(key=key, expires_at__gt=timezone.now())
+                .first()
+            )
+            if record is not None:
+                body = bytes(record.body)
+                if record.sealed_token is not None:
+                    token = unseal_token(key, bytes(record.sealed_token))
+                    body = body.replace(TOKEN_PLACEHOLDER, token, 1)
+                response = IdempotentResponse(
+                    record.fingerprint, record.status, record.content_type, body
+                )
+                timeout = (record.expires_at - timezone.now()).total_seconds()
+                self.cache.set(f"{self.key_prefix}{key}", response, max(1, timeout))
+        return response
+
+    def put(self, key, response):
+        ttl = self.options.get("TTL", 3600)
+        self.cache.set(f"{self.key_prefix}{key}", response, ttl)
+        body, sealed_token = response.body, None
+        token = response_token(response)
+        if token is not None:
+            body = body.replace(token.encode(), TOKEN_PLACEHOLDER, 1)
+            sealed_token = seal_token(key, token)
+        # A retry may have stored it first, the first response wins
+        IdempotencyRecord.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            [
+                IdempotencyRecord(
+                    key=key,
+                    fingerprint=response.fingerprint,
+                    status=response.status,
+                    content_type=response.content_type,
+                    body=body,
+                    sealed_token=sealed_token,
+                    expires_at=timezone.now() + timedelta(seconds=ttl),
+                )
+            ],
+            ignore_conflicts=True,
+        )
+
+    def acquire(self, key):
+        """Claim the handling of a request, False when it is already claimed"""
+        return self.cache.add(
+            f"{self.lock_prefix}{key}", 1, self.options.get("LOCK_TIMEOUT", 30)
+        )
+
+    def release(self, key):
+        self.cache.delete(f"{self.lock_prefix}{key}")
+
+    def wait(self, key):
+        """
+        Wait up to WAIT seconds for the response of a request handled
+        elsewhere, None when it didn't come.
+        """
+        deadline = time.monotonic() + self.options.get("WAIT", 5)
+        while time.monotonic() < deadline:
+            response = self.get(key, fallback=False)
+            if response is not None:
+                return response
+            time.sleep(self.options.get("POLL_INTERVAL", 0.05))
+        return self.get(key)
+
+    async def await_response(self, key):
+        """wait() for the async views"""
+        deadline = time.monotonic() + self.options.get("WAIT", 5)
+        while time.monotonic() < deadline:
+            response = await sync_to_async(self.get)(key, fallback=False)
+            if response is not None:
+                return response
+            await asyncio.sleep(self.options.get("POLL_INTERVAL", 0.05))
+        return await sync_to_async(self.get)(key)
+
+
+idempotency_store = IdempotencyStore()
+
+
+def purge_idempotency_records(now=None):
+    """Delete the expired records, return how many there were"""
+    deleted, _ = (
+        IdempotencyRecord.objects.using(DEFAULT_DB_ALIAS)
+        .filter(expires_at__lte=now or timezone.now())
+        .delete()
+    )
+    return deleted
+
+
+def request_keys(request):
+    """
+    Return the (key, fingerprint) of a request carrying a valid
+    Idempotency-Key header, None without header. Raise ValueError for an
+    invalid header.
+    """
+    header = request.headers.get("Idempotency-Key")
+    if header is None:
+        return None
+    if not header or len(header) > 255:
+        raise ValueError("Invalid Idempotency-Key")
+    key = hashlib.sha256(f"{request.path}\n{header}".encode()).hexdigest()
+    return key, hashlib.sha256(request.body).hexdigest()
+
+
+def replay(response, fingerprint):
+    if response.fingerprint != fingerprint:
+        return with_outcome(
+            JsonResponse(
+                {"error": "Idempotency-Key already used with another payload"},
+                status=422,
+            ),
+            "idempotency_mismatch",
+        )
+    replayed = HttpResponse(
+        response.body, status=response.status, content_type=response.content_type
+    )
+    replayed["Idempotent-Replayed"] = "true"
+    return with_outcome(replayed, "replayed")
+
+
+def in_progress():
+    return with_outcome(
+        JsonResponse(
+            {"error": "A request with this Idempotency-Key is in progress"},
+            status=409,
+        ),
+        "idempotency_conflict",
+    )
+
+
+def to_idempotent_response(response, fingerprint):
+    """The response to replay, None for server errors which can be retried"""
+    if response.status_code >= 500 or response.streaming:
+        return None
+    return IdempotentResponse(
+        fingerprint, response.status_code, response["Content-Type"], response.content
+    )
+
+
+def idempotent(view_func):
+    """Replay the response of the first request to the retries, see above"""
+
+    if iscoroutinefunction(view_func):
+
+        @wraps(view_func)
+        async def async_view(request, *args, **kwargs):
+            try:
+                keys = idempotency_store.enabled and request_keys(request)
+            except ValueError as error:
+                return JsonResponse({"error": str(error)}, status=400)
+            if not keys:
+                return await view_func(request, *args, **kwargs)
+            key, fingerprint = keys
+
+            stored = await sync_to_async(idempotency_store.get)(key)
+            if stored is None:
+                if not await sync_to_async(idempotency_store.acquire)(key):
+                    stored = await idempotency_store.await_response(key)
+                    return replay(stored, fingerprint) if stored else in_progress()
+                try:
+                    stored = await sync_to_async(idempotency_store.get)(
+                        key, fallback=False
+                    )
+                    if stored is None:
+                        response = await view_func(request, *args, **kwargs)
+                        stored = to_idempotent_response(response, fingerprint)
+                        if stored is not None:
+                            await sync_to_async(idempotency_store.put)(key, stored)
+                        return response
+                finally:
+                    await sync_to_async(idempotency_store.release)(key)
+            return replay(stored, fingerprint)
+
+        return async_view
+
+    @wraps(view_func)
+    def view(request, *args, **kwargs):
+        try:
+            keys = idempotency_store.enabled and request_keys(request)
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+        if not keys:
+            return view_func(request, *args, **kwargs)
+        key, fingerprint = keys
+
+        stored = idempotency_store.get(key)
+        if stored is None:
+            if not idempotency_store.acquire(key):
+                # Another request with the same key is being handled
+                stored = idempotency_store.wait(key)
+                return replay(stored, fingerprint) if stored else in_progress()
+            try:
+                # The first request may have completed since the lookup
+                stored = idempotency_store.get(key, fallback=False)
+                if stored is None:
+                    response = view_func(request, *args, **kwargs)
+                    stored = to_idempotent_response(response, fingerprint)
+                    if stored is not None:
+                        idempotency_store.put(key, stored)
+                    return response
+            finally:
+                idempotency_store.release(key)
+        return replay(stored, fingerprint)
+
+    return view
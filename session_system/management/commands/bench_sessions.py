@@ -0,0 +1,224 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from session_system.models import Session
+from session_system.sharding import shard_for_token
+
+
+ENDPOINTS = ["session-create", "update-session"]
+
+
+class QueryCounter:
+    """execute_wrapper counting the queries run by the current thread"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class InProcessClient:
+    """Drive the views through the Django test client, counting queries"""
+
+    def __init__(self):
+        self.local = threading.local()
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != "*"]
+        self.host = hosts[0].lstrip(".") if hosts else "localhost"
+
+    def request(self, method, path, data, token=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client(HTTP_HOST=self.host)
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            # The routers may send the queries to the replicas or shards
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = client.generic(
+                method,
+                path,
+                json.dumps(data),
+                content_type="application/json",
+                headers=headers,
+            )
+        return response.status_code, response.content, counter.count
+
+
+class HttpClient:
+    """Drive a running server, queries aren't visible from here"""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def request(self, method, path, data, token=None):
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(data).encode(), method=method
+        )
+        request.add_header("Content-Type", "application/json")
+        if token:
+            request.add_header("Authorization", f"Bearer {token}")
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read(), None
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), None
+
+
+def percentile(values, rank):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * rank / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the OTP login flow (POST /session/ then PATCH "
+        "/session/<ses-uuid>/) in-process or against a running server"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000, help="Number of logins")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--users", type=int, default=100, help="Distinct emails")
+        parser.add_argument("--devices", type=int, default=2, help="Devices per user")
+        parser.add_argument(
+            "--mobi-ratio", type=float, default=0.5, help="Share of mobile devices"
+        )
+        parser.add_argument(
+            "--repeat-ratio",
+            type=float,
+            default=0.5,
+            help="Share of logins repeated right after the first one",
+        )
+        parser.add_argument(
+            "--url",
+            help="Benchmark the server at this URL instead of running in-process",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", action="store_true", help="Output JSON only")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        # Stable devices per user so repeated logins reuse sessions
+        run_id = uuid.UUID(int=rng.getrandbits(128)).hex[:8]
+        devices = [
+            [
+                {"type": "mobi", "vendor_uuid": str(uuid.UUID(int=rng.getrandbits(128)))}
+                if rng.random() < options["mobi_ratio"]
+                else {"type": "othr"}
+                for _ in range(options["devices"])
+            ]
+            for _ in range(options["users"])
+        ]
+        logins = []
+        for _ in range(options["requests"]):
+            user = rng.randrange(options["users"])
+            payload = {
+                "user": {"email": f"bench-{run_id}-{user}@example.com"},
+                "device": rng.choice(devices[user]),
+            }
+            logins.append((payload, rng.random() < options["repeat_ratio"]))
+
+        client = HttpClient(options["url"]) if options["url"] else InProcessClient()
+        samples = {endpoint: [] for endpoint in ENDPOINTS}
+        lock = threading.Lock()
+
+        def record(endpoint, started_at, status, queries):
+            with lock:
+                samples[endpoint].append((time.perf_counter() - started_at, status, queries))
+
+        def login(payload, repeat):
+            for _ in range(2 if repeat else 1):
+                started_at = time.perf_counter()
+                status, content, queries = client.request("POST", "/session/", payload)
+                record("session-create", started_at, status, queries)
+            if status not in (200, 201):
+                return
+            session = json.loads(content)
+            # Read from the primary of the session's shard
+            otp_code = (
+                Session.objects.using(shard_for_token(session["token"]))
+                .filter(uuid=session["uuid"].split("-", 1)[1])
+                .values_list("otp_code", flat=True)
+                .first()
+            )
+            started_at = time.perf_counter()
+            status, _, queries = client.request(
+                "PATCH",
+                f"/session/{session['uuid']}/",
+                {"otp_code": otp_code},
+                token=session["token"],
+            )
+            record("update-session", started_at, status, queries)
+
+        started_at = time.perf_counter()
+        if options["concurrency"] > 1:
+            with ThreadPoolExecutor(options["concurrency"]) as executor:
+                list(executor.map(lambda args: login(*args), logins))
+        else:
+            for args in logins:
+                login(*args)
+        elapsed = time.perf_counter() - started_at
+
+        report = {
+            "options": {
+                key: options[key]
+                for key in (
+                    "requests",
+                    "concurrency",
+                    "users",
+                    "devices",
+                    "mobi_ratio",
+                    "repeat_ratio",
+                    "url",
+                    "seed",
+                )
+            },
+            "elapsed": round(elapsed, 3),
+            "endpoints": {},
+        }
+        for endpoint, endpoint_samples in samples.items():
+            latencies = [latency * 1000 for latency, _, _ in endpoint_samples]
+            queries = [count for _, _, count in endpoint_samples if count is not None]
+            statuses = {}
+            for _, status, _ in endpoint_samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            report["endpoints"][endpoint] = {
+                "requests": len(endpoint_samples),
+                "rps": round(len(endpoint_samples) / elapsed, 1) if elapsed else None,
+                "p50_ms": round(percentile(latencies, 50) or 0, 3),
+                "p95_ms": round(percentile(latencies, 95) or 0, 3),
+                "p99_ms": round(percentile(latencies, 99) or 0, 3),
+                "queries_per_request": (
+                    round(sum(queries) / len(queries), 2) if queries else None
+                ),
+                "statuses": statuses,
+            }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{options['requests']} logins in {elapsed:.2f}s")
+        for endpoint, stats in report["endpoints"].items():
+            self.stdout.write(
+                f"{endpoint}: {stats['requests']} requests, {stats['rps']} req/s, "
+                f"p50 {stats['p50_ms']}ms p95 {stats['p95_ms']}ms "
+                f"p99 {stats['p99_ms']}ms, "
+                f"{stats['queries_per_request']} queries/request, "
+                f"statuses {stats['statuses']}"
+            )
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from session_system.export import (
+    EXPORT_FORMATS,
+    export_sessions,
+    parse_bound,
+    parse_statuses,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the sessions joined with their user and device as NDJSON or "
+        "CSV, streamed from server-side cursors"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+        parser.add_argument(
+            "--created-after", help="Inclusive date or datetime, e.g. 2026-10-01"
+        )
+        parser.add_argument("--created-before", help="Exclusive date or datetime")
+        parser.add_argument(
+            "--status", help="Comma separated statuses, e.g. confirmed,expired"
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument(
+            "--output", default="-", help="File to write, standard output by default"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            filters = {
+                "created_after": parse_bound(options["created_after"]),
+                "created_before": parse_bound(options["created_before"]),
+                "statuses": parse_statuses(options["status"]),
+                "chunk_size": options["chunk_size"],
+            }
+        except ValueError as error:
+            raise CommandError(error)
+
+        started_at = time.monotonic()
+        lines = export_sessions(options["format"], **filters)
+        if options["output"] == "-":
+            count = self.write_lines(lines, self.stdout)
+        else:
+            with open(options["output"], "w", newline="") as output:
+                count = self.write_lines(lines, output)
+        # The export itself may go to the standard output
+        self.stderr.write(
+            f"Exported {count} lines in {time.monotonic() - started_at:.2f}s"
+        )
+
+    def write_lines(self, lines, output):
+        count = 0
+        for line in lines:
+            output.write(line.decode())
+            count += 1
+        return count
@@ -0,0 +1,74 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from session_system import partitioning
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage the range partitions of the Session table: convert the table, "
+        "create the upcoming partitions and drop the ones past the retention"
+    )
+
+    def add_arguments(self, parser):
+        options = settings.SESSION_PARTITIONING
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="Convert the Session table to a partitioned table first",
+        )
+        parser.add_argument(
+            "--interval",
+            choices=partitioning.PARTITION_INTERVALS,
+            default=options["INTERVAL"],
+        )
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=options["AHEAD"],
+            help="Number of partitions to create after the current one",
+        )
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=options["RETENTION_DAYS"],
+            help="Drop the partitions older than this, 0 keeps them all",
+        )
+        parser.add_argument(
+            "--archive-dir",
+            default=options["ARCHIVE_DIR"],
+            help="Export the partitions as CSV here before dropping them",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Drop old partitions even when they hold alive sessions",
+        )
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        if options["convert"]:
+            if partitioning.is_partitioned():
+                raise CommandError("The Session table is already partitioned")
+            boundary = partitioning.convert_to_partitioned(interval)
+            self.stdout.write(f"Converted the Session table, partitioned from {boundary}")
+        elif not partitioning.is_partitioned():
+            raise CommandError("The Session table is not partitioned, run with --convert")
+
+        for partition in partitioning.create_partitions(interval, options["ahead"]):
+            self.stdout.write(f"Partition {partition} ready")
+
+        if options["retention_days"]:
+            results = partitioning.drop_partitions(
+                timedelta(days=options["retention_days"]),
+                archive_dir=options["archive_dir"],
+                force=options["force"],
+            )
+            for partition, path, dropped in results:
+                if not dropped:
+                    self.stdout.write(f"Kept {partition}, it holds alive sessions")
+                elif path:
+                    self.stdout.write(f"Dropped {partition}, archived to {path}")
+                else:
+                    self.stdout.write(f"Dropped {partition}")
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from itertools import islice
+import time
+
+from session_system.models import Session
+from session_system.session_store import session_store, session_state
+from session_system.sharding import for_each_shard
+from session_system.views import session_serializer
+
+
+class Command(BaseCommand):
+    help = "Fill the session store with the alive sessions of the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Clear the cache of the session store first",
+        )
+
+    def handle(self, *args, **options):
+        if not session_store.enabled:
+            raise CommandError("The session store is disabled (SESSION_STORE)")
+        if options["clear"]:
+            session_store.cache.clear()
+
+        started_at = time.monotonic()
+        now = timezone.now()
+        count = 0
+        for _ in for_each_shard():
+            sessions = (
+                Session.objects.exclude(status="expired")
+                .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+                .select_related("user", "device")
+                .iterator(chunk_size=options["batch_size"])
+            )
+            while batch := list(islice(sessions, options["batch_size"])):
+                session_store.put_many(
+                    {
+                        bytes(session.token_hash): session_state(
+                            session, session_serializer(session)
+                        )
+                        for session in batch
+                    }
+                )
+                count += len(batch)
+        self.stdout.write(
+            f"Stored {count} sessions in {time.monotonic() - started_at:.2f}s"
+        )
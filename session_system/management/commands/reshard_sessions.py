@@ -0,0 +1,110 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.expressions import RawSQL
+import time
+
+from session_system.models import User, Device, Session
+from session_system.session_store import session_state, write_states
+from session_system.sharding import (
+    EMAIL_BUCKET_SQL,
+    bucket_count,
+    shard_aliases,
+    shard_map,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the users of a range of buckets with their devices and sessions "
+        "from a shard to another. Copy, switch the buckets to the target in "
+        "SESSION_SHARD_MAP, then run again with --delete to copy what was "
+        "written in between and delete the rows from the source."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", required=True)
+        parser.add_argument("--target", required=True)
+        parser.add_argument(
+            "--buckets", required=True, help="Inclusive bucket range, e.g. 0-255"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Delete the copied rows from the source",
+        )
+
+    def handle(self, *args, **options):
+        source, target = options["source"], options["target"]
+        for alias in (source, target):
+            if alias not in shard_aliases():
+                raise CommandError(f"{alias} isn't a shard")
+        try:
+            first, last = (int(bucket) for bucket in options["buckets"].split("-"))
+        except ValueError:
+            raise CommandError("--buckets must look like 0-255")
+        if not 0 <= first <= last < bucket_count():
+            raise CommandError(f"Buckets go from 0 to {bucket_count() - 1}")
+        if options["delete"] and any(
+            shard_map()[bucket] == source for bucket in range(first, last + 1)
+        ):
+            raise CommandError(
+                f"The shard map still sends these buckets to {source}, switch "
+                "them to the target before deleting"
+            )
+
+        started_at = time.monotonic()
+        users = (
+            User.objects.using(source)
+            .annotate(
+                bucket=RawSQL(EMAIL_BUCKET_SQL.format(email="email"), (bucket_count(),))
+            )
+            .filter(bucket__range=(first, last))
+            .order_by("uuid")
+        )
+        counts = {"users": 0, "devices": 0, "sessions": 0}
+        last_uuid = None
+        while True:
+            batch = users if last_uuid is None else users.filter(uuid__gt=last_uuid)
+            batch = list(batch[: options["batch_size"]])
+            if not batch:
+                break
+            self.copy_users(batch, source, target, counts)
+            if options["delete"]:
+                self.delete_users(batch, source)
+            last_uuid = batch[-1].uuid
+
+        self.stdout.write(
+            f"{'Moved' if options['delete'] else 'Copied'} {counts['users']} users, "
+            f"{counts['devices']} devices and {counts['sessions']} sessions from "
+            f"{source} to {target} in {time.monotonic() - started_at:.2f}s"
+        )
+
+    def copy_users(self, users, source, target, counts):
+        """Copy users with their devices and sessions, keep the rows already there"""
+        devices = list(Device.objects.using(source).filter(user__in=users))
+        sessions = list(Session.objects.using(source).filter(user__in=users))
+        with transaction.atomic(using=target):
+            User.objects.using(target).bulk_create(users, ignore_conflicts=True)
+            Device.objects.using(target).bulk_create(devices, ignore_conflicts=True)
+            Session.objects.using(target).bulk_create(sessions, ignore_conflicts=True)
+            # Sessions confirmed or expired since they were first copied
+            write_states(
+                [
+                    session_state(session, None)
+                    for session in sessions
+                    if session.status != "pending"
+                ],
+                using=target,
+            )
+        counts["users"] += len(users)
+        counts["devices"] += len(devices)
+        counts["sessions"] += len(sessions)
+
+    def delete_users(self, users, source):
+        with transaction.atomic(using=source):
+            Session.objects.using(source).filter(user__in=users).delete()
+            Device.objects.using(source).filter(user__in=users).delete()
+            User.objects.using(source).filter(
+                uuid__in=[user.uuid for user in users]
+            ).delete()
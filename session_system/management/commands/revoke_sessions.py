@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from uuid import UUID
+
+from session_system.models import User, Device, deconstruct_uuid
+from session_system.revocation import revoke_sessions
+from session_system.sharding import shard_aliases, shard_for_email, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Revoke every session of a user or a device: expire them and reject "
+        "their tokens, cached or not"
+    )
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument("--user", help="usr-<uuid>")
+        target.add_argument("--email")
+        target.add_argument("--device", help="dev-<uuid>")
+
+    def handle(self, *args, **options):
+        if options["email"]:
+            with use_shard(shard_for_email(options["email"])) as alias:
+                user = User.objects.using(alias).filter(email=options["email"])
+                uuid = user.values_list("uuid", flat=True).first()
+                revoked = uuid and revoke_sessions(User, uuid, using=alias)
+            label = options["email"]
+        else:
+            model, prefix = (User, "usr") if options["user"] else (Device, "dev")
+            label = options["user"] or options["device"]
+            try:
+                label_prefix, value = deconstruct_uuid(label)
+                uuid = UUID(value)
+            except ValueError:
+                label_prefix = None
+            if label_prefix != prefix:
+                raise CommandError(f"Invalid uuid: {label}")
+            # The uuid doesn't tell the shard, try them in turn
+            revoked = None
+            for alias in shard_aliases():
+                revoked = revoke_sessions(model, uuid, using=alias)
+                if revoked is not None:
+                    break
+        if revoked is None:
+            raise CommandError(f"{label} not found")
+        self.stdout.write(f"Revoked {revoked} sessions of {label}")
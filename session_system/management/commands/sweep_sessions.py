@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+import time
+
+from session_system.idempotency import purge_idempotency_records
+from session_system.sweeper import sweep_expired_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "Flag as expired the sessions past their expires_at and delete the "
+        "expired idempotency records"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--throttle",
+            type=float,
+            default=0,
+            help="Seconds to sleep between two batches",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep sweeping every --interval seconds",
+        )
+        parser.add_argument("--interval", type=float, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            result = sweep_expired_sessions(
+                batch_size=options["batch_size"], throttle=options["throttle"]
+            )
+            self.stdout.write(
+                f"Expired {result.rows} sessions in {result.batches} batches, "
+                f"{result.elapsed:.2f}s ({result.rows_per_second:.0f} rows/s)"
+            )
+            purged = purge_idempotency_records()
+            self.stdout.write(f"Deleted {purged} idempotency records")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
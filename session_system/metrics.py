@@ -0,0 +1,273 @@
+"""
+Per-request timing and SQL instrumentation exported in the Prometheus text
+format by the /metrics endpoint and as a Server-Timing response header.
+
+Metrics live in the memory of each process, scrape every worker (or run a
+single worker per container) to get the whole picture. /metrics only answers
+the clients of SESSION_METRICS["ALLOWED_NETWORKS"].
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextvars import ContextVar
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import Resolver404, resolve
+import bisect
+import ipaddress
+import logging
+import threading
+import time
+import uuid
+
+from .response_cache import response_cache
+from .structured_logging import current_request_id
+from .token_cache import token_cache
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{%s}" % ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket..., count in +Inf, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            values = self.values.get(labels)
+            if values is None:
+                values = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            values[bisect.bisect_left(self.buckets, value)] += 1
+            values[-1] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ("le",)
+        with self.lock:
+            for labels, values in sorted(self.values.items()):
+                cumulative = 0
+                for bucket, count in zip(self.buckets + ("+Inf",), values):
+                    cumulative += count
+                    yield (
+                        f"{self.name}_bucket"
+                        f"{format_labels(names, labels + (bucket,))} {cumulative}"
+                    )
+                yield f"{self.name}_sum{format_labels(self.labels, labels)} {values[-1]}"
+                yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+
+REQUESTS = Counter(
+    "session_http_requests_total",
+    "HTTP requests by view and outcome.",
+    ("view", "method", "status", "outcome"),
+)
+REQUEST_DURATION = Histogram(
+    "session_http_request_duration_seconds",
+    "Wall time spent handling a request.",
+    ("view", "outcome"),
+)
+REQUEST_DB_DURATION = Histogram(
+    "session_http_request_db_duration_seconds",
+    "Time spent in SQL queries while handling a request.",
+    ("view",),
+)
+REQUEST_QUERIES = Histogram(
+    "session_http_request_queries",
+    "Number of SQL queries run while handling a request.",
+    ("view",),
+    buckets=QUERY_BUCKETS,
+)
+METRICS = [REQUESTS, REQUEST_DURATION, REQUEST_DB_DURATION, REQUEST_QUERIES]
+
+access_logger = logging.getLogger("session_system.access")
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+# Stats of the request being handled, contextvars follow the ORM calls of
+# async views into the threads running them
+current_query_stats = ContextVar("current_query_stats", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - started_at
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def with_outcome(response, outcome):
+    """Tag a response with the outcome label of its request"""
+    response.outcome = outcome
+    return response
+
+
+def get_outcome(response):
+    """Views tag their responses with an outcome, fallback on the status code"""
+    return getattr(response, "outcome", None) or f"http_{response.status_code}"
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        reset_token = current_query_stats.set(stats)
+        request_id_token = current_request_id.set(self.get_request_id(request))
+        started_at = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            return self.record(
+                request, response, stats, time.perf_counter() - started_at
+            )
+        finally:
+            current_query_stats.reset(reset_token)
+            current_request_id.reset(request_id_token)
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        reset_token = current_query_stats.set(stats)
+        request_id_token = current_request_id.set(self.get_request_id(request))
+        started_at = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            return self.record(
+                request, response, stats, time.perf_counter() - started_at
+            )
+        finally:
+            current_query_stats.reset(reset_token)
+            current_request_id.reset(request_id_token)
+
+    def get_request_id(self, request):
+        """Reuse the id given by the load balancer, if any"""
+        return request.headers.get("X-Request-ID") or uuid.uuid4().hex
+
+    def record(self, request, response, stats, duration):
+        resolver_match = getattr(request, "resolver_match", None)
+        if resolver_match is None:
+            # The response was returned by a middleware before the view ran
+            try:
+                resolver_match = resolve(request.path_info)
+            except Resolver404:
+                pass
+        view = (resolver_match and resolver_match.url_name) or "unknown"
+        outcome = get_outcome(response)
+        REQUESTS.inc(view, request.method, response.status_code, outcome)
+        REQUEST_DURATION.observe(duration, view, outcome)
+        REQUEST_DB_DURATION.observe(stats.duration, view)
+        REQUEST_QUERIES.observe(stats.count, view)
+        response["Server-Timing"] = (
+            f"app;dur={duration * 1000:.2f}, "
+            f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries"'
+        )
+        response["X-Request-ID"] = current_request_id.get()
+        access_logger.info(
+            "%s %s %s",
+            request.method,
+            request.path,
+            response.status_code,
+            extra={
+                "event": "request",
+                "view": view,
+                "outcome": outcome,
+                "duration_ms": round(duration * 1000, 2),
+                "db_duration_ms": round(stats.duration * 1000, 2),
+                "queries": stats.count,
+            },
+        )
+        return response
+
+
+def collect_cache(prefix, cache):
+    stats = cache.stats()
+    for name, kind in (("hits", "counter"), ("misses", "counter"), ("size", "gauge")):
+        metric = f"{prefix}_{name}" + ("_total" if kind == "counter" else "")
+        yield f"# TYPE {metric} {kind}"
+        yield f"{metric} {stats[name]}"
+
+
+def is_metrics_client(request):
+    options = getattr(settings, "SESSION_METRICS", {})
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network)
+        for network in options.get("ALLOWED_NETWORKS", ())
+    )
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, served only when SESSION_METRICS["ENDPOINT"]
+    is set and to the clients of SESSION_METRICS["ALLOWED_NETWORKS"].
+    """
+    if not getattr(settings, "SESSION_METRICS", {}).get("ENDPOINT", False):
+        raise Http404
+    if not is_metrics_client(request):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    lines = [line for metric in METRICS for line in metric.collect()]
+    lines.extend(collect_cache("session_token_cache", token_cache))
+    lines.extend(collect_cache("session_response_cache", response_cache))
+    return HttpResponse(
+        "\n".join(lines) + "\n", content_type="text/plain; version=0.0.4"
+    )
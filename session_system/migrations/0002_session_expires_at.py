@@ -0,0 +1,73 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:47
+
+import django.utils.timezone
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import uuid
+
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Walks the table by uuid, each batch starting after the last uuid of the
+# previous one. Mobile sessions don't expire
+BACKFILL_EXPIRES_AT_SQL = """
+WITH batch AS (
+    SELECT uuid FROM {session} WHERE uuid > %s ORDER BY uuid LIMIT %s
+), backfilled AS (
+    UPDATE {session} AS session SET expires_at = session.created_at + CASE
+        WHEN session.status = 'confirmed' THEN interval '2 hours'
+        ELSE interval '5 minutes'
+    END
+    FROM {device} AS device
+    WHERE session.uuid IN (SELECT uuid FROM batch)
+    AND device.uuid = session.device_id AND device.type <> 'mobi'
+    AND session.expires_at IS NULL
+)
+SELECT uuid FROM batch ORDER BY uuid DESC LIMIT 1
+"""
+
+
+def backfill_expires_at(apps, schema_editor):
+    """
+    Fill expires_at in batches, each committed on its own (the migration isn't
+    atomic) so rows are only locked for the time of a batch.
+    """
+    Session = apps.get_model("session_system", "Session")
+    Device = apps.get_model("session_system", "Device")
+    sql = BACKFILL_EXPIRES_AT_SQL.format(
+        session=schema_editor.quote_name(Session._meta.db_table),
+        device=schema_editor.quote_name(Device._meta.db_table),
+    )
+    last_uuid = uuid.UUID(int=0)
+    with schema_editor.connection.cursor() as cursor:
+        while last_uuid is not None:
+            cursor.execute(sql, [last_uuid, BACKFILL_BATCH_SIZE])
+            row = cursor.fetchone()
+            last_uuid = row and row[0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('session_system', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(condition=models.Q(('status', 'expired'), _negated=True), fields=['user', 'device', '-created_at'], name='session_alive_idx'),
+        ),
+    ]
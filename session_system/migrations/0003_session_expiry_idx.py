@@ -0,0 +1,20 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:52
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('session_system', '0002_session_expires_at'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='session',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False), models.Q(('status', 'expired'), _negated=True)), fields=['expires_at', 'uuid'], name='session_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+def merge_duplicate_devices(apps, schema_editor):
+    Device = apps.get_model("session_system", "Device")
+    Session = apps.get_model("session_system", "Session")
+    devices = Device.objects.using(schema_editor.connection.alias)
+    sessions = Session.objects.using(schema_editor.connection.alias)
+    duplicates = (
+        devices.values("user", "type", "vendor_uuid")
+        .annotate(count=models.Count("uuid"))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        kept, *merged = devices.filter(
+            user=duplicate["user"],
+            type=duplicate["type"],
+            vendor_uuid=duplicate["vendor_uuid"],
+        ).order_by("uuid")
+        sessions.filter(device__in=merged).update(device=kept)
+        devices.filter(uuid__in=[device.uuid for device in merged]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('session_system', '0003_session_expiry_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_devices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='device',
+            constraint=models.UniqueConstraint(fields=('user', 'type', 'vendor_uuid'), name='device_user_type_vendor_uniq', nulls_distinct=False),
+        ),
+    ]
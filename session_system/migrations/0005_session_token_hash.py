@@ -0,0 +1,63 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:19
+
+from django.contrib.postgres.indexes import HashIndex
+from django.db import migrations, models
+import uuid
+
+from session_system.operations import AddIndexOnline
+
+
+BACKFILL_BATCH_SIZE = 5000
+
+# Walks the table by uuid, each batch starting after the last uuid of the
+# previous one, so the rows already hashed aren't scanned again
+BACKFILL_TOKEN_HASHES_SQL = """
+WITH batch AS (
+    SELECT uuid FROM {session} WHERE uuid > %s ORDER BY uuid LIMIT %s
+), hashed AS (
+    UPDATE {session} SET token_hash = sha256(convert_to(token, 'UTF8'))
+    WHERE uuid IN (SELECT uuid FROM batch)
+    AND token_hash IS NULL AND token IS NOT NULL
+)
+SELECT uuid FROM batch ORDER BY uuid DESC LIMIT 1
+"""
+
+
+def backfill_token_hashes(apps, schema_editor):
+    """
+    Hash the tokens in batches, each committed on its own (the migration isn't
+    atomic) so rows are only locked for the time of a batch.
+    """
+    Session = apps.get_model("session_system", "Session")
+    sql = BACKFILL_TOKEN_HASHES_SQL.format(
+        session=schema_editor.quote_name(Session._meta.db_table)
+    )
+    last_uuid = uuid.UUID(int=0)
+    with schema_editor.connection.cursor() as cursor:
+        while last_uuid is not None:
+            cursor.execute(sql, [last_uuid, BACKFILL_BATCH_SIZE])
+            row = cursor.fetchone()
+            last_uuid = row and row[0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('session_system', '0004_device_user_type_vendor_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='token_hash',
+            field=models.BinaryField(max_length=32, null=True),
+        ),
+        migrations.RunPython(backfill_token_hashes, migrations.RunPython.noop),
+        # Also built on a table partitioned by partition_sessions --convert
+        AddIndexOnline(
+            model_name='session',
+            index=HashIndex(fields=['token_hash'], name='session_token_hash_idx'),
+        ),
+    ]
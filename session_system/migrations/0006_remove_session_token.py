@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:19
+
+from django.db import migrations
+from importlib import import_module
+
+
+# Hash the tokens of the sessions created by the previous release since 0005
+backfill_token_hashes = import_module(
+    "session_system.migrations.0005_session_token_hash"
+).backfill_token_hashes
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('session_system', '0005_session_token_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_token_hashes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='session',
+            name='token',
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('session_system', '0006_remove_session_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyRecord',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('content_type', models.CharField(max_length=100)),
+                ('body', models.BinaryField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,162 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:40
+
+from django.db import migrations
+import uuid
+
+
+# Compact columns of Session and Device, filled by triggers from the columns
+# the previous release writes. 0009 swaps them with the old ones.
+EXPAND_SQL = [
+    """
+    ALTER TABLE session_system_device
+        ADD COLUMN type_code smallint,
+        ADD CONSTRAINT device_type_code_not_null
+            CHECK (type_code IS NOT NULL) NOT VALID
+    """,
+    """
+    CREATE FUNCTION session_system_device_compact() RETURNS trigger AS $$
+    BEGIN
+        -- Types the API used to let through are "othr"
+        NEW.type_code := CASE NEW.type WHEN 'mobi' THEN 1 ELSE 2 END;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER session_system_device_compact
+    BEFORE INSERT OR UPDATE ON session_system_device
+    FOR EACH ROW EXECUTE FUNCTION session_system_device_compact()
+    """,
+    """
+    ALTER TABLE session_system_session
+        ADD COLUMN status_code smallint,
+        ADD COLUMN flags smallint NOT NULL DEFAULT 0,
+        ADD COLUMN otp_code_int integer,
+        ADD CONSTRAINT session_status_code_not_null
+            CHECK (status_code IS NOT NULL) NOT VALID
+    """,
+    """
+    CREATE FUNCTION session_system_session_compact() RETURNS trigger AS $$
+    BEGIN
+        NEW.status_code := CASE NEW.status
+            WHEN 'pending' THEN 1 WHEN 'confirmed' THEN 2 ELSE 3 END;
+        NEW.flags := NEW.is_new_user::integer | NEW.is_new_device::integer << 1;
+        NEW.otp_code_int := NULLIF(NEW.otp_code, '')::integer;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER session_system_session_compact
+    BEFORE INSERT OR UPDATE ON session_system_session
+    FOR EACH ROW EXECUTE FUNCTION session_system_session_compact()
+    """,
+]
+
+SHRINK_SQL = [
+    "DROP TRIGGER session_system_session_compact ON session_system_session",
+    "DROP FUNCTION session_system_session_compact()",
+    """
+    ALTER TABLE session_system_session
+        DROP COLUMN status_code, DROP COLUMN flags, DROP COLUMN otp_code_int
+    """,
+    "DROP TRIGGER session_system_device_compact ON session_system_device",
+    "DROP FUNCTION session_system_device_compact()",
+    "ALTER TABLE session_system_device DROP COLUMN type_code",
+]
+
+BACKFILL_BATCH_SIZE = 5000
+
+# A no-op UPDATE has the trigger fill the compact columns. Batches walk the
+# table by uuid, starting after the last uuid of the previous one, so the
+# rows already filled aren't scanned again
+BACKFILL_SQL = """
+WITH batch AS (
+    SELECT uuid FROM {table} WHERE uuid > %s ORDER BY uuid LIMIT %s
+), filled AS (
+    UPDATE {table} SET {column} = {column}
+    WHERE uuid IN (SELECT uuid FROM batch) AND {compact} IS NULL
+)
+SELECT uuid FROM batch ORDER BY uuid DESC LIMIT 1
+"""
+
+INDEXES_SQL = [
+    """
+    CREATE UNIQUE INDEX {concurrently} device_user_type_vendor_uniq_compact
+    ON session_system_device (user_id, type_code, vendor_uuid) NULLS NOT DISTINCT
+    """,
+    """
+    CREATE INDEX {concurrently} session_alive_idx_compact
+    ON session_system_session (user_id, device_id, created_at DESC)
+    WHERE NOT (status_code = 3)
+    """,
+    """
+    CREATE INDEX {concurrently} session_expiry_idx_compact
+    ON session_system_session (expires_at, uuid)
+    WHERE expires_at IS NOT NULL AND NOT (status_code = 3)
+    """,
+]
+
+
+def backfill(apps, schema_editor):
+    """
+    Fill the compact columns of the existing rows in batches, each committed
+    on its own (the migration isn't atomic), then validate the NOT NULL
+    checks without blocking writes.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        for table, column, compact, check in [
+            ("session_system_device", "type", "type_code", "device_type_code_not_null"),
+            (
+                "session_system_session",
+                "status",
+                "status_code",
+                "session_status_code_not_null",
+            ),
+        ]:
+            sql = BACKFILL_SQL.format(table=table, column=column, compact=compact)
+            last_uuid = uuid.UUID(int=0)
+            while last_uuid is not None:
+                cursor.execute(sql, [last_uuid, BACKFILL_BATCH_SIZE])
+                row = cursor.fetchone()
+                last_uuid = row and row[0]
+            cursor.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}")
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        # Indexes of partitioned tables can't be built concurrently
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table "
+            "WHERE partrelid = 'session_system_session'::regclass"
+        )
+        partitioned = cursor.fetchone() is not None
+        for sql in INDEXES_SQL:
+            is_session = "session_system_session" in sql
+            concurrently = "" if partitioned and is_session else "CONCURRENTLY"
+            cursor.execute(sql.format(concurrently=concurrently))
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for index in [
+            "device_user_type_vendor_uniq_compact",
+            "session_alive_idx_compact",
+            "session_expiry_idx_compact",
+        ]:
+            cursor.execute(f"DROP INDEX IF EXISTS {index}")
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('session_system', '0007_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.RunSQL(EXPAND_SQL, SHRINK_SQL),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import session_system.fields
+
+
+# Swap the compact columns filled since 0008 with the old ones, in one short
+# transaction: the NOT NULL checks are validated and the indexes built
+# already.
+SWAP_SQL = [
+    "LOCK TABLE session_system_device, session_system_session IN ACCESS EXCLUSIVE MODE",
+    "DROP TRIGGER session_system_device_compact ON session_system_device",
+    "DROP FUNCTION session_system_device_compact()",
+    "ALTER TABLE session_system_device DROP CONSTRAINT device_user_type_vendor_uniq",
+    "ALTER TABLE session_system_device DROP COLUMN type",
+    "ALTER TABLE session_system_device RENAME COLUMN type_code TO type",
+    "ALTER TABLE session_system_device ALTER COLUMN type SET NOT NULL",
+    "ALTER TABLE session_system_device DROP CONSTRAINT device_type_code_not_null",
+    """
+    ALTER TABLE session_system_device ADD CONSTRAINT device_user_type_vendor_uniq
+    UNIQUE USING INDEX device_user_type_vendor_uniq_compact
+    """,
+    "DROP TRIGGER session_system_session_compact ON session_system_session",
+    "DROP FUNCTION session_system_session_compact()",
+    "DROP INDEX session_alive_idx",
+    "DROP INDEX session_expiry_idx",
+    """
+    ALTER TABLE session_system_session
+        DROP COLUMN status,
+        DROP COLUMN is_new_user,
+        DROP COLUMN is_new_device,
+        DROP COLUMN otp_code
+    """,
+    "ALTER TABLE session_system_session RENAME COLUMN status_code TO status",
+    "ALTER TABLE session_system_session RENAME COLUMN otp_code_int TO otp_code",
+    "ALTER TABLE session_system_session ALTER COLUMN status SET NOT NULL",
+    "ALTER TABLE session_system_session DROP CONSTRAINT session_status_code_not_null",
+    "ALTER INDEX session_alive_idx_compact RENAME TO session_alive_idx",
+    "ALTER INDEX session_expiry_idx_compact RENAME TO session_expiry_idx",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('session_system', '0008_compact_layout_expand'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(SWAP_SQL)],
+            state_operations=[
+                migrations.RemoveField(
+                    model_name='session',
+                    name='is_new_device',
+                ),
+                migrations.RemoveField(
+                    model_name='session',
+                    name='is_new_user',
+                ),
+                migrations.AddField(
+                    model_name='session',
+                    name='flags',
+                    field=models.PositiveSmallIntegerField(default=0),
+                ),
+                migrations.AlterField(
+                    model_name='device',
+                    name='type',
+                    field=session_system.fields.EnumField(choices=[('mobi', 'Mobile'), ('othr', 'Other')], codes={'mobi': 1, 'othr': 2}),
+                ),
+                migrations.AlterField(
+                    model_name='session',
+                    name='otp_code',
+                    field=session_system.fields.OtpCodeField(blank=True, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='session',
+                    name='status',
+                    field=session_system.fields.EnumField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('expired', 'Expired')], codes={'confirmed': 2, 'expired': 3, 'pending': 1}, default='pending'),
+                ),
+            ],
+        ),
+    ]
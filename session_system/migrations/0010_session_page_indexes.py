@@ -0,0 +1,69 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from session_system.operations import AddIndexOnline, add_index, remove_index
+
+
+# Named as Django named the foreign key indexes
+FOREIGN_KEY_INDEXES = [
+    models.Index(fields=['device'], name='session_system_session_device_id_6af29da9'),
+    models.Index(fields=['user'], name='session_system_session_user_id_b631213d'),
+]
+
+
+def drop_foreign_key_indexes(apps, schema_editor):
+    Session = apps.get_model("session_system", "Session")
+    for index in FOREIGN_KEY_INDEXES:
+        remove_index(schema_editor, Session, index)
+
+
+def create_foreign_key_indexes(apps, schema_editor):
+    Session = apps.get_model("session_system", "Session")
+    for index in FOREIGN_KEY_INDEXES:
+        add_index(schema_editor, Session, index)
+
+
+class Migration(migrations.Migration):
+
+    # The page indexes are built without blocking writes, then replace the
+    # foreign key indexes they start with, on each partition of a partitioned
+    # table
+    atomic = False
+
+    dependencies = [
+        ('session_system', '0009_compact_layout_swap'),
+    ]
+
+    operations = [
+        AddIndexOnline(
+            model_name='session',
+            index=models.Index(fields=['user', '-created_at', '-uuid'], include=('device', 'status', 'flags'), name='session_user_page_idx'),
+        ),
+        AddIndexOnline(
+            model_name='session',
+            index=models.Index(fields=['device', '-created_at', '-uuid'], include=('user', 'status', 'flags'), name='session_device_page_idx'),
+        ),
+        # Dropping the indexes through AlterField would drop and validate
+        # the foreign keys again
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    drop_foreign_key_indexes, create_foreign_key_indexes
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='session',
+                    name='device',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='session_system.device'),
+                ),
+                migrations.AlterField(
+                    model_name='session',
+                    name='user',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='session_system.user'),
+                ),
+            ],
+        ),
+    ]
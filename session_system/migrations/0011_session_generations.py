@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+# Columns with a constant default and no CHECK are added without rewriting nor
+# scanning the tables
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('session_system', '0010_session_page_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='session_generation',
+            field=models.IntegerField(db_default=0, default=0),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='generation',
+            field=models.IntegerField(db_default=0, default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='session_generation',
+            field=models.IntegerField(db_default=0, default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('session_system', '0011_session_generations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='sealed_token',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -1,8 +1,61 @@
-from django.db import models
+from django.contrib.postgres.indexes import HashIndex
+from django.db import connections, models
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
+import hashlib
 import uuid
 import random
 import secrets
 
+from .fields import EnumField, OtpCodeField
+from .response_cache import invalidate_session
+from .sharding import token_prefix
+from .token_cache import token_cache, SESSION_RECORD_FIELDS
+
+
+# Codes of the EnumFields, raw SQL compares the columns to them
+DEVICE_TYPE_CODES = {"mobi": 1, "othr": 2}
+STATUS_CODES = {"pending": 1, "confirmed": 2, "expired": 3}
+
+# Bits of Session.flags
+NEW_USER = 1
+NEW_DEVICE = 2
+
+# How long a non-mobile session stays alive, depending on its status
+PENDING_SESSION_LIFETIME = timedelta(minutes=5)
+CONFIRMED_SESSION_LIFETIME = timedelta(hours=2)
+
+
+def compute_expires_at(device_type, status, created_at):
+    if device_type == "mobi":
+        return None
+    if status == "confirmed":
+        return created_at + CONFIRMED_SESSION_LIFETIME
+    return created_at + PENDING_SESSION_LIFETIME
+
+
+def generate_token(email):
+    # The prefix routes the token to the shard of the user
+    return token_prefix(email) + secrets.token_urlsafe(20)
+
+
+def hash_token(token):
+    """Digest stored in place of a session token"""
+    return hashlib.sha256(token.encode()).digest()
+
+
+def from_db_row(model, using, field_names, values):
+    """Model.from_db for the rows of raw cursors, which skip from_db_value()"""
+    connection = connections[using]
+    values = [
+        field.from_db_value(value, None, connection)
+        if hasattr(field, "from_db_value")
+        else value
+        for field, value in zip(map(model._meta.get_field, field_names), values)
+    ]
+    return model.from_db(using, field_names, values)
+
 
 def deconstruct_uuid(prefixed_uuid):
     prefix, uuid = prefixed_uuid.split("-", 1)
@@ -12,6 +65,8 @@ def deconstruct_uuid(prefixed_uuid):
 class User(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, primary_key=True)
     email = models.EmailField(unique=True)
+    # Bumped to revoke the sessions of the user, see revocation.py
+    session_generation = models.IntegerField(default=0, db_default=0)
 
     def __str__(self):
         return f"usr-{self.uuid}"
@@ -21,10 +76,23 @@ class Device(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     vendor_uuid = models.UUIDField(null=True, blank=True)
-    type = models.CharField(
-        max_length=10,
+    type = EnumField(
+        codes=DEVICE_TYPE_CODES,
         choices=[("mobi", "Mobile"), ("othr", "Other")],
     )
+    # Bumped to revoke the sessions of the device, see revocation.py
+    session_generation = models.IntegerField(default=0, db_default=0)
+
+    class Meta:
+        constraints = [
+            # Target of the device upsert of create_session, a NULL vendor_uuid
+            # is a value like any other
+            models.UniqueConstraint(
+                fields=["user", "type", "vendor_uuid"],
+                nulls_distinct=False,
+                name="device_user_type_vendor_uniq",
+            ),
+        ]
 
     def __str__(self):
         return f"dev-{self.uuid}"
@@ -32,12 +100,14 @@ class Device(models.Model):
 
 class Session(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, primary_key=True)
-    token = models.CharField(max_length=40, unique=True, blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    device = models.ForeignKey(Device, on_delete=models.CASCADE)
-    status = models.CharField(
-        max_length=10,
+    # SHA-256 digest of the token, the token itself is never stored
+    token_hash = models.BinaryField(max_length=32, null=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Indexed by session_user_page_idx and session_device_page_idx
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, db_index=False)
+    status = EnumField(
+        codes=STATUS_CODES,
         choices=[
             ("pending", "Pending"),
             ("confirmed", "Confirmed"),
@@ -45,20 +115,130 @@ class Session(models.Model):
         ],
         default="pending",
     )
-    is_new_user = models.BooleanField(default=False)
-    is_new_device = models.BooleanField(default=False)
-    otp_code = models.CharField(max_length=6, blank=True)
+    # NEW_USER | NEW_DEVICE, read through is_new_user and is_new_device
+    flags = models.PositiveSmallIntegerField(default=0)
+    otp_code = OtpCodeField(null=True, blank=True)
+    # Materialized from the device type and status on every save, NULL means
+    # the session never expires (mobile devices)
+    expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Session generations of the user and device added up at creation, the
+    # session is revoked once they moved on
+    generation = models.IntegerField(default=0, db_default=0)
+
+    # Plaintext token, only known by the instance that generated it
+    token = None
+
+    class Meta:
+        indexes = [
+            # Lookup of the token of every authenticated request, a hash index
+            # holds 4-byte hash codes instead of the digests
+            HashIndex(fields=["token_hash"], name="session_token_hash_idx"),
+            # Lookup of the latest alive session of a user on a device
+            models.Index(
+                fields=["user", "device", "-created_at"],
+                condition=~Q(status="expired"),
+                name="session_alive_idx",
+            ),
+            # Walk of the stale sessions by the sweeper
+            models.Index(
+                fields=["expires_at", "uuid"],
+                condition=Q(expires_at__isnull=False) & ~Q(status="expired"),
+                name="session_expiry_idx",
+            ),
+            # Keyset pagination of the sessions of a user or a device, the
+            # session columns of the listings are read from the index alone
+            models.Index(
+                fields=["user", "-created_at", "-uuid"],
+                include=["device", "status", "flags"],
+                name="session_user_page_idx",
+            ),
+            models.Index(
+                fields=["device", "-created_at", "-uuid"],
+                include=["user", "status", "flags"],
+                name="session_device_page_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"ses-{self.uuid}"
 
-    def generate_token(self):
-        return secrets.token_urlsafe(20)
+    def set_flag(self, flag, value):
+        self.flags = self.flags | flag if value else self.flags & ~flag
 
-    def save(self, *args, **kwargs):
-        if not self.token:
-            self.token = self.generate_token()
+    @property
+    def is_new_user(self):
+        return bool(self.flags & NEW_USER)
+
+    @is_new_user.setter
+    def is_new_user(self, value):
+        self.set_flag(NEW_USER, value)
+
+    @property
+    def is_new_device(self):
+        return bool(self.flags & NEW_DEVICE)
+
+    @is_new_device.setter
+    def is_new_device(self, value):
+        self.set_flag(NEW_DEVICE, value)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the token cache may hold for this row
+        instance._cached_state = {
+            name: value
+            for name, value in zip(field_names, values)
+            if name == "token_hash" or name in SESSION_RECORD_FIELDS
+        }
+        return instance
+
+    def _invalidate_cached_token(self):
+        cached_state = getattr(self, "_cached_state", None)
+        if not cached_state:
+            return
+        if any(getattr(self, name) != value for name, value in cached_state.items()):
+            token_hash = cached_state.get("token_hash", self.token_hash)
+            token_cache.invalidate(token_hash and bytes(token_hash))
+        self._cached_state = {name: getattr(self, name) for name in cached_state}
+
+    def set_token(self, token=None):
+        """Give the session a new token, the previous one stops working"""
+        self.token = token or generate_token(self.user.email)
+        self.token_hash = hash_token(self.token)
+
+    def compute_expires_at(self):
+        return compute_expires_at(self.device.type, self.status, self.created_at)
+
+    def fill_generated_fields(self):
+        """Fill the fields computed on save, bulk_create doesn't call save()"""
+        if self._state.adding:
+            self.generation = (
+                self.user.session_generation + self.device.session_generation
+            )
+        if not self.token_hash:
+            self.set_token()
         if not self.otp_code:
             # Generate a 6-digit random number as a string
             self.otp_code = "".join([str(random.randint(0, 9)) for _ in range(6)])
+        self.expires_at = self.compute_expires_at()
+
+    def save(self, *args, **kwargs):
+        self.fill_generated_fields()
         super().save(*args, **kwargs)
+        self._invalidate_cached_token()
+        invalidate_session(self.uuid)
+
+
+class IdempotencyRecord(models.Model):
+    """Response replayed to the retries of a request, see idempotency.py"""
+
+    # SHA-256 of the path and Idempotency-Key header of the request
+    key = models.CharField(max_length=64, primary_key=True)
+    # SHA-256 of the request body
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField()
+    content_type = models.CharField(max_length=100)
+    # The response without its session token, which is kept sealed apart
+    body = models.BinaryField()
+    sealed_token = models.BinaryField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
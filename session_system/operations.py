@@ -0,0 +1,79 @@
+"""
+Migration operations building the Session indexes without blocking writes,
+whether or not partition_sessions --convert partitioned the table.
+
+Postgres can't build the index of a partitioned table concurrently. The index
+is created empty ON ONLY the partitioned table, then built concurrently on
+each partition and attached to it; it becomes valid once every partition's
+index is attached. Partitions created afterwards get the index from the
+partitioned table.
+"""
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db.backends.utils import truncate_name
+
+
+def is_partitioned(schema_editor, model):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [model._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions(schema_editor, model):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            ORDER BY child.relname
+            """,
+            [model._meta.db_table],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+def add_index(schema_editor, model, index):
+    """Build `index` concurrently, on each partition of a partitioned table"""
+    if not is_partitioned(schema_editor, model):
+        schema_editor.add_index(model, index, concurrently=True)
+        return
+    quote_name = schema_editor.quote_name
+    statement = index.create_sql(model, schema_editor)
+    statement.parts["table"] = f"ONLY {quote_name(model._meta.db_table)}"
+    schema_editor.execute(statement)
+    max_length = schema_editor.connection.ops.max_name_length()
+    for partition in list_partitions(schema_editor, model):
+        name = truncate_name(f"{partition}_{index.name}", max_length)
+        statement = index.create_sql(model, schema_editor, concurrently=True)
+        statement.parts["table"] = quote_name(partition)
+        statement.parts["name"] = quote_name(name)
+        schema_editor.execute(statement)
+        schema_editor.execute(
+            f"ALTER INDEX {quote_name(index.name)} ATTACH PARTITION {quote_name(name)}"
+        )
+
+
+def remove_index(schema_editor, model, index):
+    """Drop `index` concurrently, or with its partitions' indexes"""
+    schema_editor.remove_index(
+        model, index, concurrently=not is_partitioned(schema_editor, model)
+    )
+
+
+class AddIndexOnline(AddIndexConcurrently):
+    """AddIndexConcurrently also building the index of a partitioned table"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._ensure_not_in_transaction(schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            add_index(schema_editor, model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._ensure_not_in_transaction(schema_editor)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            remove_index(schema_editor, model, self.index)
@@ -0,0 +1,277 @@
+"""
+Range partitioning of the Session table by created_at on Postgres.
+
+`convert_to_partitioned` turns the existing table into the first partition
+(covering everything up to the next interval) of a partitioned table with the
+same name, `create_partitions` adds the partitions ahead of time and
+`drop_partitions` detaches, archives and drops the partitions past the
+retention. Partitions are named after the day they start on, e.g.
+session_system_session_p20231218.
+
+The range of a partition is read from the catalog rather than from its name,
+so changing the interval doesn't change the range of the existing partitions.
+
+Postgres requires the partition key in every unique constraint, so on the
+partitioned table the primary key is (uuid, created_at): the uuid of a
+session is no longer unique on its own, only the pair is. Sessions get random
+uuid4s so they don't collide in practice, but nothing stops a row from reusing
+the uuid of a row created at another time.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.db import connection, transaction
+from django.utils import timezone
+import os
+import re
+
+from .models import Session, STATUS_CODES
+
+
+PARTITION_INTERVALS = {
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+
+
+def get_table():
+    return Session._meta.db_table
+
+
+def partition_start(date, interval):
+    """Start of the partition holding `date`, weeks start on monday"""
+    if interval == "week":
+        date -= timedelta(days=date.weekday())
+    return datetime.combine(date, time.min, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start):
+    return f"{get_table()}_p{start:%Y%m%d}"
+
+
+PARTITION_BOUND_RE = re.compile(r"FOR VALUES FROM \((.+)\) TO \((.+)\)")
+
+
+def parse_bound(bound):
+    """Datetime of a partition bound, None for MINVALUE and MAXVALUE"""
+    if bound in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(bound.strip("'"))
+
+
+def partition_ranges():
+    """
+    Return the (partition, start, end) of every partition, as attached to the
+    partitioned table. Open bounds, and those of a default partition, are None.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            ORDER BY child.relname
+            """,
+            [get_table()],
+        )
+        rows = cursor.fetchall()
+    ranges = []
+    for name, bounds in rows:
+        match = PARTITION_BOUND_RE.fullmatch(bounds)
+        start, end = map(parse_bound, match.groups()) if match else (None, None)
+        ranges.append((name, start, end))
+    return ranges
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [get_table()],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            ORDER BY child.relname
+            """,
+            [get_table()],
+        )
+        return [name for name, in cursor.fetchall()]
+
+
+@transaction.atomic
+def convert_to_partitioned(interval, now=None):
+    """
+    Swap the Session table for a partitioned one. The current table is kept as
+    the partition of every row created before the start of the next interval.
+    A validated CHECK constraint spares the scan of the partition bounds but
+    the (uuid, created_at) primary key index is built on the current table
+    while it is locked, run it during a quiet period.
+    """
+    table = get_table()
+    legacy = f"{table}_legacy"
+    now = now or timezone.now()
+    boundary = partition_start(now.date(), interval) + PARTITION_INTERVALS[interval]
+
+    with connection.cursor() as cursor:
+        # Deferred foreign key checks would block the ALTER TABLE statements
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        # Free the index names for the partitioned table
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s", [table]
+        )
+        for index, in cursor.fetchall():
+            cursor.execute(f'ALTER INDEX "{index}" RENAME TO "{index[:56]}_legacy"')
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+
+        cursor.execute(
+            f"""
+            CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS)
+            PARTITION BY RANGE (created_at)
+            """
+        )
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (uuid, created_at)")
+        for field in ("user", "device"):
+            remote = Session._meta.get_field(field).related_model._meta.db_table
+            cursor.execute(
+                f"""
+                ALTER TABLE {table} ADD FOREIGN KEY ({field}_id)
+                REFERENCES {remote} (uuid) DEFERRABLE INITIALLY DEFERRED
+                """
+            )
+
+        cursor.execute(
+            f"""
+            ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_created_at_check
+            CHECK (created_at < %s) NOT VALID
+            """,
+            [boundary],
+        )
+        cursor.execute(f"ALTER TABLE {legacy} VALIDATE CONSTRAINT {legacy}_created_at_check")
+        cursor.execute(f"COMMENT ON TABLE {legacy} IS %s", [boundary.isoformat()])
+        # Replaced by the (uuid, created_at) primary key of the partitioned table
+        cursor.execute(
+            """
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'p'
+            """,
+            [legacy],
+        )
+        primary_key, = cursor.fetchone()
+        cursor.execute(f'ALTER TABLE {legacy} DROP CONSTRAINT "{primary_key}"')
+        cursor.execute(
+            f"""
+            ALTER TABLE {table} ATTACH PARTITION {legacy}
+            FOR VALUES FROM (MINVALUE) TO (%s)
+            """,
+            [boundary],
+        )
+
+    # Indexes created on the partitioned table adopt the legacy ones
+    with connection.schema_editor() as editor:
+        for field in ("user", "device"):
+            editor.execute(
+                editor._create_index_sql(Session, fields=[Session._meta.get_field(field)])
+            )
+        for index in Session._meta.indexes:
+            editor.add_index(Session, index)
+    return boundary
+
+
+def get_legacy_boundary():
+    """End of the range of the legacy partition, None when there is none"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT obj_description(to_regclass(%s), 'pg_class')",
+            [f"{get_table()}_legacy"],
+        )
+        boundary, = cursor.fetchone()
+    return boundary and datetime.fromisoformat(boundary)
+
+
+def create_partitions(interval, ahead, now=None):
+    """
+    Create the partitions of the current and next `ahead` intervals, from the
+    end of the existing ones (the legacy one, or those of another interval)
+    """
+    now = now or timezone.now()
+    step = PARTITION_INTERVALS[interval]
+    start = partition_start(now.date(), interval)
+    end = start + step * (ahead + 1)
+    start = max([start, *(bound for _, _, bound in partition_ranges() if bound)])
+    created = []
+    with connection.cursor() as cursor:
+        while start < end:
+            name = partition_name(start)
+            cursor.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {name} PARTITION OF {get_table()}
+                FOR VALUES FROM (%s) TO (%s)
+                """,
+                [start, start + step],
+            )
+            created.append(name)
+            start += step
+    return created
+
+
+def has_alive_sessions(partition):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT 1 FROM {partition} WHERE status <> %s
+            AND (expires_at IS NULL OR expires_at > now()) LIMIT 1
+            """,
+            [STATUS_CODES["expired"]],
+        )
+        return cursor.fetchone() is not None
+
+
+def archive_partition(partition, archive_dir):
+    """Export a partition as CSV, return the path of the file"""
+    path = os.path.join(archive_dir, f"{partition}.csv")
+    sql = f"COPY {partition} TO STDOUT WITH (FORMAT csv, HEADER)"
+    with connection.cursor() as cursor, open(path, "wb") as archive:
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2
+            cursor.copy_expert(sql, archive)
+        else:
+            with cursor.copy(sql) as copy:
+                for data in copy:
+                    archive.write(data)
+    return path
+
+
+def drop_partitions(retention, archive_dir=None, force=False, now=None):
+    """
+    Detach and drop the partitions whose range ended more than `retention`
+    ago, the legacy one included, after exporting them to `archive_dir` when
+    set. Partitions still holding alive sessions (mobile sessions never
+    expire) are kept unless `force` is set.
+
+    Return the list of (partition, archive path or None, dropped) tuples.
+    """
+    cutoff = (now or timezone.now()) - retention
+    results = []
+    for partition, _, end in partition_ranges():
+        if end is None or end > cutoff:
+            continue
+        if not force and has_alive_sessions(partition):
+            results.append((partition, None, False))
+            continue
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                cursor.execute(f"ALTER TABLE {get_table()} DETACH PARTITION {partition}")
+            path = archive_dir and archive_partition(partition, archive_dir)
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE {partition}")
+        results.append((partition, path, True))
+    return results
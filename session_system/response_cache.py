@@ -0,0 +1,63 @@
+"""
+Ready-to-send JSON bodies of the session responses. A session only changes
+through its status (bulk updates included) or Session.save, so bodies are
+cached per (uuid, status) and dropped by Session.save. The token differs from
+a response to the other (it is rotated when a session is reused), it is
+inserted in the cached body.
+"""
+from django.conf import settings
+import json
+
+from .token_cache import TokenCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+SESSION_STATUSES = ("pending", "confirmed", "expired")
+
+# Stands for the token in the cached bodies
+TOKEN_PLACEHOLDER = "\x00token\x00"
+
+_encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False)
+
+
+def dumps(data):
+    """Encode to compact JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return _encoder.encode(data).encode()
+
+
+def build_response_cache():
+    options = getattr(settings, "SESSION_RESPONSE_CACHE", {})
+    return TokenCache(
+        max_size=options.get("MAX_SIZE", 10000),
+        ttl=options.get("TTL", 300),
+    )
+
+
+response_cache = build_response_cache()
+
+
+def invalidate_session(session_uuid):
+    for status in SESSION_STATUSES:
+        response_cache.invalidate((session_uuid, status))
+
+
+def session_body(session, serializer):
+    """
+    Return `serializer(session)` as JSON bytes, serialized once per session
+    uuid and status.
+    """
+    key = (session.uuid, session.status)
+    parts = response_cache.get(key)
+    if parts is None:
+        body = dumps({**serializer(session), "token": TOKEN_PLACEHOLDER})
+        # The token comes before the user's email, the only free text
+        parts = body.split(dumps(TOKEN_PLACEHOLDER), 1)
+        response_cache.set(key, parts)
+    before, after = parts
+    return before + dumps(session.token) + after
@@ -0,0 +1,112 @@
+"""
+Revocation of every session of a user or of a device at once.
+
+Users and devices hold a session_generation counter that a revocation bumps,
+and a session the sum of the counters of its user and device when it was
+created. The token middleware rejects a session whose generation is behind
+the current sum, read from the SESSION_REVOCATION["CACHE"] cache in one
+round-trip: the sessions held by the token cache or the session store stop
+working without the caches being scanned. The revocation also flags the
+sessions as expired in a single UPDATE.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.db.models import F
+
+from .models import User, Device, Session
+
+
+# Model -> (prefix of its uuid, Session field pointing to it)
+REVOCATION_SCOPES = {User: ("usr", "user_id"), Device: ("dev", "device_id")}
+
+
+def generations_cache():
+    options = getattr(settings, "SESSION_REVOCATION", {})
+    return caches[options.get("CACHE", "sessions")]
+
+
+def generations_timeout():
+    return getattr(settings, "SESSION_REVOCATION", {}).get("TTL", 300)
+
+
+def generation_key(prefix, uuid):
+    return f"session-generation:{prefix}:{uuid}"
+
+
+def current_generation(user_id, device_id):
+    """
+    Generation of the sessions of a user on a device that aren't revoked,
+    None when the counters aren't cached.
+    """
+    keys = [generation_key("usr", user_id), generation_key("dev", device_id)]
+    generations = generations_cache().get_many(keys)
+    if len(generations) < len(keys):
+        return None
+    return sum(generations.values())
+
+
+def remember_generations(
+    user_id, device_id, user_generation, device_generation, refresh=False
+):
+    """
+    Cache counters read from the database, unless a revocation set them.
+    `refresh` replaces cached counters found behind a session, left by a
+    revocation made in another process with a per-process cache.
+    """
+    cache = generations_cache()
+    generations = {
+        generation_key("usr", user_id): user_generation,
+        generation_key("dev", device_id): device_generation,
+    }
+    if refresh:
+        cache.set_many(generations, generations_timeout())
+        return
+    for key, generation in generations.items():
+        cache.add(key, generation, generations_timeout())
+
+
+def revoke_sessions(model, uuid, user_id=None, using=None):
+    """
+    Expire the sessions of a User or Device and bump its session generation.
+    A device must belong to `user_id` when given. Return the number of
+    sessions expired, None when there is no such user or device.
+    """
+    using = using or router.db_for_write(Session)
+    lookup = {"uuid": uuid}
+    if user_id is not None:
+        lookup["user_id"] = user_id
+    prefix, session_field = REVOCATION_SCOPES[model]
+    with transaction.atomic(using=using):
+        generation = (
+            model.objects.using(using)
+            .select_for_update()
+            .filter(**lookup)
+            .values_list("session_generation", flat=True)
+            .first()
+        )
+        if generation is None:
+            return None
+        model.objects.using(using).filter(uuid=uuid).update(
+            session_generation=F("session_generation") + 1
+        )
+        revoked = (
+            Session.objects.using(using)
+            .filter(**{session_field: uuid})
+            .exclude(status="expired")
+            .update(status="expired")
+        )
+    # Only once committed, a rollback would leave the cache ahead of the
+    # database and reject the sessions that are still valid
+    generations_cache().set(
+        generation_key(prefix, uuid), generation + 1, generations_timeout()
+    )
+    return revoked
+
+
+def revoke_user_sessions(user_id, using=None):
+    return revoke_sessions(User, user_id, using=using)
+
+
+def revoke_device_sessions(device_id, user_id=None, using=None):
+    return revoke_sessions(Device, device_id, user_id=user_id, using=using)
@@ -0,0 +1,286 @@
+"""
+Optional store of the hot state of the sessions (token digest -> uuid,
+status, OTP code...) in a Django cache, Redis in production. The token middleware and
+update_session read it before the database. Status transitions are written
+to the Session table right away (write-through) or in batches by a
+background thread (write-behind), see SESSION_STORE in the settings.
+
+With write-behind the database lags behind the store by up to FLUSH_INTERVAL
+seconds, and the transitions still queued when a process is killed are lost.
+"""
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+import atexit
+import logging
+import queue
+import threading
+
+from .models import Session, STATUS_CODES, compute_expires_at, hash_token
+from .sharding import shard_for_token
+from .token_cache import SessionRecord, token_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+# `data` is the session_serializer() payload without the token,
+# update_session answers from it. States stored before device_id and
+# generation were added have None instead
+SessionState = namedtuple(
+    "SessionState",
+    [
+        "uuid",
+        "user_id",
+        "status",
+        "otp_code",
+        "created_at",
+        "expires_at",
+        "data",
+        "device_id",
+        "generation",
+    ],
+    defaults=[None, None],
+)
+
+
+def session_state(session, data):
+    return SessionState(
+        session.uuid,
+        session.user_id,
+        session.status,
+        session.otp_code,
+        session.created_at,
+        session.expires_at,
+        data,
+        session.device_id,
+        session.generation,
+    )
+
+
+def session_record(state):
+    return SessionRecord(
+        state.uuid,
+        state.user_id,
+        state.status,
+        state.created_at,
+        state.expires_at,
+        state.device_id,
+        state.generation,
+    )
+
+
+WRITE_STATES_SQL = """
+UPDATE {session} session SET status = v.status, expires_at = v.expires_at
+FROM (VALUES {values}) v(uuid, created_at, status, expires_at)
+WHERE session.uuid = v.uuid AND session.created_at = v.created_at
+AND session.status <> {expired}
+"""
+
+
+def write_states(states, using=None):
+    """Persist the status of the session states in a single UPDATE"""
+    # The last transition of a session wins
+    states = list({state.uuid: state for state in states}.values())
+    if not states:
+        return 0
+    sql = WRITE_STATES_SQL.format(
+        session=Session._meta.db_table,
+        values=", ".join(
+            ["(%s::uuid, %s::timestamptz, %s::smallint, %s::timestamptz)"]
+            * len(states)
+        ),
+        expired=STATUS_CODES["expired"],
+    )
+    params = [
+        value
+        for state in states
+        for value in (
+            state.uuid,
+            state.created_at,
+            STATUS_CODES[state.status],
+            state.expires_at,
+        )
+    ]
+    using = using or router.db_for_write(Session)
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+class SessionStoreWriter(threading.Thread):
+    """Background thread writing the queued transitions every `interval` seconds"""
+
+    def __init__(self, interval=1, batch_size=500):
+        super().__init__(name="session-store-writer", daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.stopped = threading.Event()
+
+    def enqueue(self, using, state):
+        self.queue.put((using, state))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+
+    def flush(self):
+        while True:
+            states = []
+            while len(states) < self.batch_size:
+                try:
+                    states.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not states:
+                return
+            shard_states = {}
+            for using, state in states:
+                shard_states.setdefault(using, []).append(state)
+            for using, states in shard_states.items():
+                try:
+                    write_states(states, using=using)
+                except Exception:
+                    logger.exception("Lost %s session transitions", len(states))
+
+    def stop(self):
+        self.stopped.set()
+        self.flush()
+
+
+class SessionStore:
+    """
+    Session states keyed by token digest in the SESSION_STORE["CACHE"] cache.
+    The settings are read on every call so they can be overridden in tests.
+    """
+
+    key_prefix = "session-store:"
+
+    def __init__(self):
+        self.writer = None
+        self._lock = threading.Lock()
+
+    @property
+    def options(self):
+        return settings.SESSION_STORE
+
+    @property
+    def enabled(self):
+        return self.options.get("ENABLED", False)
+
+    @property
+    def cache(self):
+        return caches[self.options.get("CACHE", "default")]
+
+    def key(self, token_hash):
+        return f"{self.key_prefix}{token_hash.hex()}"
+
+    def timeout(self, state):
+        """Keep a state until its session expires, TIMEOUT seconds at most"""
+        timeout = self.options.get("TIMEOUT", 86400)
+        if state.expires_at is None:
+            return timeout
+        remaining = (state.expires_at - timezone.now()).total_seconds()
+        return max(1, min(timeout, int(remaining)))
+
+    def get(self, token_hash):
+        return self.cache.get(self.key(token_hash))
+
+    def put(self, token_hash, state):
+        self.cache.set(self.key(token_hash), state, self.timeout(state))
+
+    def put_many(self, states):
+        """Store a {token digest: state} dict in one round-trip"""
+        self.cache.set_many(
+            {self.key(token_hash): state for token_hash, state in states.items()},
+            self.options.get("TIMEOUT", 86400),
+        )
+
+    def delete(self, token_hash):
+        self.cache.delete(self.key(token_hash))
+
+    def transition(self, token, state, status):
+        """Move a session to `status` in the store then in the database"""
+        state = state._replace(
+            status=status,
+            expires_at=compute_expires_at(
+                state.data["device"]["type"], status, state.created_at
+            ),
+        )
+        self.put(hash_token(token), state)
+        using = shard_for_token(token)
+        if self.options.get("WRITE_MODE", "through") == "behind":
+            self.get_writer().enqueue(using, state)
+        else:
+            write_states([state], using=using)
+        return state
+
+    def get_writer(self):
+        with self._lock:
+            if self.writer is None:
+                self.writer = SessionStoreWriter(
+                    interval=self.options.get("FLUSH_INTERVAL", 1),
+                    batch_size=self.options.get("BATCH_SIZE", 500),
+                )
+                self.writer.start()
+                atexit.register(self.writer.stop)
+            return self.writer
+
+    def flush(self):
+        """Write the queued transitions now"""
+        if self.writer is not None:
+            self.writer.flush()
+
+
+session_store = SessionStore()
+
+
+def forget_token(token_hash):
+    """Stop serving a token that was replaced from the caches"""
+    token_cache.invalidate(token_hash)
+    if session_store.enabled:
+        session_store.delete(token_hash)
+
+
+EXPIRE_STALE_SESSIONS_SQL = """
+UPDATE {session} SET status = {expired}
+WHERE device_id = ANY(%s::uuid[]) AND status <> {expired} AND expires_at <= %s
+RETURNING token_hash
+"""
+
+
+def expire_stale_sessions(device_ids, now, using=None):
+    """
+    Flag the sessions of the devices past their expires_at as expired in a
+    single statement, and stop serving their tokens from the caches
+    """
+    sql = EXPIRE_STALE_SESSIONS_SQL.format(
+        session=Session._meta.db_table, expired=STATUS_CODES["expired"]
+    )
+    using = using or router.db_for_write(Session)
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [list(device_ids), now])
+        token_hashes = [token_hash for token_hash, in cursor.fetchall()]
+    for token_hash in token_hashes:
+        if token_hash is not None:
+            forget_token(bytes(token_hash))
+    return len(token_hashes)
+
+
+@receiver(post_save, sender=Session)
+def drop_saved_session(sender, instance, **kwargs):
+    # The store is filled again from the views or rebuild_session_store
+    if not session_store.enabled:
+        return
+    # The token the session had when it was loaded, if it was rotated since
+    previous = getattr(instance, "_cached_state", {}).get("token_hash")
+    for token_hash in {bytes(h) for h in (instance.token_hash, previous) if h}:
+        session_store.delete(token_hash)
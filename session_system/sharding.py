@@ -0,0 +1,148 @@
+"""
+Horizontal sharding of the users with their devices and sessions.
+
+An email hashes to one of SESSION_SHARDING["BUCKETS"] buckets and the shard
+map assigns the buckets to the shards, the "default" database and the
+DATABASES aliases starting with "shard". Session tokens start with the bucket
+of their user so a token is routed without a global lookup, and they stay
+valid when their bucket moves to another shard (reshard_sessions).
+
+With the default database only, every query goes there.
+"""
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+import hashlib
+
+from .db_router import RoutingState, current_routing
+
+
+TOKEN_SEPARATOR = "."
+
+# Postgres counterpart of email_bucket(), takes the bucket count as parameter
+EMAIL_BUCKET_SQL = "(('x' || substr(md5({email}), 1, 8))::bit(32)::bigint %% %s)"
+
+
+def bucket_count():
+    return getattr(settings, "SESSION_SHARDING", {}).get("BUCKETS", 1024)
+
+
+def shard_aliases():
+    return [DEFAULT_DB_ALIAS] + sorted(
+        alias for alias in settings.DATABASES if alias.startswith("shard")
+    )
+
+
+def is_sharded():
+    return len(shard_aliases()) > 1
+
+
+def build_shard_map():
+    """
+    Return the shard of each bucket, from SESSION_SHARDING["MAP"] ({alias:
+    [[first, last], ...]} inclusive bucket ranges) or split evenly between the
+    shards.
+    """
+    buckets = bucket_count()
+    configured = getattr(settings, "SESSION_SHARDING", {}).get("MAP")
+    if not configured:
+        aliases = shard_aliases()
+        return [aliases[bucket * len(aliases) // buckets] for bucket in range(buckets)]
+    shard_map = [None] * buckets
+    for alias, ranges in configured.items():
+        for first, last in ranges:
+            for bucket in range(first, last + 1):
+                shard_map[bucket] = alias
+    missing = [bucket for bucket, alias in enumerate(shard_map) if alias is None]
+    if missing:
+        raise ValueError(f"Buckets without a shard: {missing[:10]}...")
+    return shard_map
+
+
+_shard_map = {}
+
+
+def shard_map():
+    key = (bucket_count(), repr(getattr(settings, "SESSION_SHARDING", {}).get("MAP")))
+    if key not in _shard_map:
+        _shard_map.clear()
+        _shard_map[key] = build_shard_map()
+    return _shard_map[key]
+
+
+def email_bucket(email):
+    return int(hashlib.md5(email.encode()).hexdigest()[:8], 16) % bucket_count()
+
+
+def shard_for_email(email):
+    return shard_map()[email_bucket(email)]
+
+
+def token_prefix(email):
+    return f"{email_bucket(email):x}{TOKEN_SEPARATOR}"
+
+
+def shard_for_token(token):
+    """Shard of a session token, tokens without a bucket predate sharding"""
+    bucket, separator, _ = token.partition(TOKEN_SEPARATOR)
+    try:
+        return shard_map()[int(bucket, 16)] if separator else DEFAULT_DB_ALIAS
+    except (ValueError, IndexError):
+        return DEFAULT_DB_ALIAS
+
+
+def route_to_shard(alias):
+    """Send the queries of the rest of the current request to a shard"""
+    routing = current_routing.get()
+    if routing is not None:
+        routing.shard = alias
+
+
+@contextmanager
+def use_shard(alias):
+    """Send the queries of the block to a shard"""
+    reset_token = current_routing.set(RoutingState(shard=alias))
+    try:
+        yield alias
+    finally:
+        current_routing.reset(reset_token)
+
+
+def for_each_shard():
+    """Run the body of a for loop on every shard in turn"""
+    for alias in shard_aliases():
+        with use_shard(alias):
+            yield alias
+
+
+class ShardRouter:
+    """
+    Route the models of this app to the shard of the current request, or to
+    the database of the instance they relate to. Stays out of the way (None)
+    without shards.
+    """
+
+    def __init__(self):
+        self.shards = shard_aliases()
+
+    def db_for_model(self, model, instance=None):
+        if len(self.shards) < 2 or model._meta.app_label != "session_system":
+            return None
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        routing = current_routing.get()
+        return routing.shard if routing is not None else None
+
+    def db_for_read(self, model, **hints):
+        return self.db_for_model(model, hints.get("instance"))
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_model(model, hints.get("instance"))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if len(self.shards) < 2:
+            return None
+        return obj1._state.db == obj2._state.db
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True if db in self.shards else None
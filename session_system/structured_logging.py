@@ -0,0 +1,143 @@
+"""
+Logging pipeline of the request path, configured by settings.LOGGING: the
+records are queued by the request thread and formatted as JSON lines and
+written by a background QueueListener thread, so a slow stdout never blocks a
+worker.
+"""
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import weakref
+
+
+# QueueHandlers created by dictConfig, their listeners are started by
+# start_queue_listeners()
+queue_handlers = weakref.WeakSet()
+
+# Id of the request being handled, set by RequestMetricsMiddleware
+current_request_id = ContextVar("current_request_id", default=None)
+
+# Attributes of every LogRecord, the others come from `extra`
+RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord("", 0, "", 0, "", None, None)).keys()
+) | {"message", "asctime", "request_id", "event"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Tag the records with the id of the current request"""
+
+    def filter(self, record):
+        record.request_id = current_request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a share of the records of high-volume events, `rates` maps the
+    `event` of a record (logger.info(..., extra={"event": name})) to the share
+    kept, between 0 and 1. Records without a rate are all kept.
+    """
+
+    def __init__(self, rates=None, random=random.random):
+        super().__init__()
+        self.rates = rates or {}
+        self.random = random
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, "event", None))
+        return rate is None or self.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, `extra` fields included"""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "event", None):
+            data["event"] = record.event
+        if getattr(record, "request_id", None):
+            data["request_id"] = record.request_id
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                data[name] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """QueueListener that knows whether it was started"""
+
+    started = False
+
+    def start(self):
+        if not self.started:
+            super().start()
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            super().stop()
+            self.started = False
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueue the records unformatted: merging the message with its arguments
+    is left to the listener thread. The listener thread doesn't survive a
+    fork (gunicorn preload), children start their own.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        queue_handlers.add(self)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.restart_listener)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            # Tracebacks reference the frames of the request, render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def restart_listener(self):
+        if self.listener is None or not self.listener.started:
+            return
+        # The parent's queue lock may have been held by its listener thread
+        self.queue = queue.Queue()
+        self.listener = QueueListener(
+            self.queue,
+            *self.listener.handlers,
+            respect_handler_level=self.listener.respect_handler_level,
+        )
+        self.listener.start()
+
+    def start_listener(self):
+        if self.listener is not None:
+            self.listener.start()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+        super().close()
+
+
+def start_queue_listeners():
+    """dictConfig doesn't start the listeners before Python 3.13"""
+    for handler in list(queue_handlers):
+        handler.start_listener()
@@ -0,0 +1,120 @@
+from collections import namedtuple
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+import logging
+import threading
+import time
+
+from .idempotency import purge_idempotency_records
+from .models import Session
+from .sharding import for_each_shard
+
+
+logger = logging.getLogger(__name__)
+
+
+class SweepResult(namedtuple("SweepResult", ["rows", "batches", "elapsed"])):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def sweep_expired_sessions(batch_size=1000, throttle=0, now=None):
+    """
+    Flag as expired every session whose expires_at is past, on every shard,
+    `batch_size` rows per UPDATE. Batches are walked by keyset on
+    (expires_at, uuid) and each one commits on its own so no lock is held for
+    long, `throttle` seconds are slept between two batches.
+    """
+    now = now or timezone.now()
+    started_at = time.monotonic()
+    rows = batches = 0
+    for _ in for_each_shard():
+        shard_rows, shard_batches = sweep_shard(batch_size, throttle, now)
+        rows += shard_rows
+        batches += shard_batches
+    return SweepResult(rows, batches, time.monotonic() - started_at)
+
+
+def sweep_shard(batch_size, throttle, now):
+    rows = batches = 0
+    last_key = None
+    while True:
+        stale_sessions = Session.objects.filter(expires_at__lte=now).exclude(
+            status="expired"
+        )
+        if last_key is not None:
+            last_expires_at, last_uuid = last_key
+            stale_sessions = stale_sessions.filter(
+                Q(expires_at__gt=last_expires_at)
+                | Q(expires_at=last_expires_at, uuid__gt=last_uuid)
+            )
+        keys = list(
+            stale_sessions.order_by("expires_at", "uuid").values_list(
+                "expires_at", "uuid"
+            )[:batch_size]
+        )
+        if not keys:
+            break
+
+        rows += (
+            Session.objects.filter(uuid__in=[uuid for _, uuid in keys])
+            .exclude(status="expired")
+            .update(status="expired")
+        )
+        batches += 1
+        last_key = keys[-1]
+        if len(keys) < batch_size:
+            break
+        if throttle:
+            time.sleep(throttle)
+    return rows, batches
+
+
+class SessionSweeper(threading.Thread):
+    """Background thread running sweep_expired_sessions every `interval` seconds"""
+
+    def __init__(self, interval=60, batch_size=1000, throttle=0):
+        super().__init__(name="session-sweeper", daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.throttle = throttle
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                result = sweep_expired_sessions(self.batch_size, self.throttle)
+                logger.info(
+                    "Expired %s sessions in %.2fs (%.0f rows/s)",
+                    result.rows,
+                    result.elapsed,
+                    result.rows_per_second,
+                )
+                purge_idempotency_records()
+            except Exception:
+                logger.exception("Session sweep failed")
+            finally:
+                connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_sweeper():
+    """
+    Start a SessionSweeper when SESSION_SWEEPER["ENABLED"], called by each
+    gunicorn worker once it's ready. Return it, None when disabled.
+    """
+    options = settings.SESSION_SWEEPER
+    if not options.get("ENABLED"):
+        return None
+    sweeper = SessionSweeper(
+        interval=options.get("INTERVAL", 60),
+        batch_size=options.get("BATCH_SIZE", 1000),
+        throttle=options.get("THROTTLE", 0),
+    )
+    sweeper.start()
+    return sweeper
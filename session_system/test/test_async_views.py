@@ -0,0 +1,92 @@
+from django.test import TestCase, override_settings
+from ..models import User, Device, Session
+
+
+@override_settings(ROOT_URLCONF="session_system.async_urls")
+class AsyncSessionViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+
+    async def test_post_session(self):
+        data = {"user": {"email": self.user.email}, "device": {"type": "othr"}}
+        response = await self.async_client.post(
+            "/session/", data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = await self.async_client.post(
+            "/session/", data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        session = await Session.objects.aget(user=self.user, device=self.device)
+        self.assertEqual(response.json()["uuid"], str(session))
+        self.assertEqual(response.json()["user"]["email"], "test@example.com")
+
+    async def test_patch_session(self):
+        session = await Session.objects.acreate(
+            user=self.user, device=self.device, otp_code="123456"
+        )
+        auth_header = {"Authorization": f"Bearer {session.token}"}
+
+        response = await self.async_client.patch(
+            f"/session/{session}/",
+            {"otp_code": "123455"},
+            content_type="application/json",
+            headers=auth_header,
+        )
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.patch(
+            f"/session/{session}/",
+            {"otp_code": "123456"},
+            content_type="application/json",
+            headers=auth_header,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "confirmed")
+
+    async def test_patch_session__no_headers(self):
+        session = await Session.objects.acreate(user=self.user, device=self.device)
+
+        response = await self.async_client.patch(
+            f"/session/{session}/",
+            {"otp_code": session.otp_code},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 401)
+
+    async def test_post_session__server_timing(self):
+        data = {"user": {"email": self.user.email}, "device": {"type": "othr"}}
+        response = await self.async_client.post(
+            "/session/", data, content_type="application/json"
+        )
+
+        self.assertNotIn('desc="0 queries"', response["Server-Timing"])
+
+    async def test_post_session__queries(self):
+        data = {"user": {"email": "new@example.com"}, "device": {"type": "othr"}}
+
+        # User, device and session upserted in one statement
+        response = await self.async_client.post(
+            "/session/", data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()["is_new_user"])
+        self.assertIn('desc="2 queries"', response["Server-Timing"])
+
+        response = await self.async_client.post(
+            "/session/", data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+
+    @override_settings(SESSION_UPSERT_FAST_PATH=False)
+    async def test_post_session__orm_path(self):
+        data = {"user": {"email": self.user.email}, "device": {"type": "othr"}}
+        response = await self.async_client.post(
+            "/session/", data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.json()["is_new_user"])
+        self.assertFalse(response.json()["is_new_device"])
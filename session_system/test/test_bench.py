@@ -0,0 +1,26 @@
+from django.core.management import call_command
+from django.test import TestCase
+from io import StringIO
+import json
+
+
+class BenchSessionsTestCase(TestCase):
+    def test_bench_sessions(self):
+        out = StringIO()
+        call_command(
+            "bench_sessions",
+            "--requests", "20",
+            "--users", "5",
+            "--repeat-ratio", "1",
+            "--json",
+            stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        create = report["endpoints"]["session-create"]
+        update = report["endpoints"]["update-session"]
+        self.assertEqual(create["requests"], 40)
+        self.assertEqual(set(create["statuses"]), {"200", "201"})
+        self.assertEqual(update["requests"], 20)
+        self.assertEqual(set(update["statuses"]), {"200"})
+        self.assertGreater(update["queries_per_request"], 0)
@@ -0,0 +1,129 @@
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from unittest import skipUnless
+
+from ..checks import check_replica_cache
+from ..db_router import (
+    PrimaryReplicaRouter,
+    ReplicaMonitor,
+    current_routing,
+    is_token_pinned,
+    start_routing,
+    use_primary,
+)
+from ..models import User, Device, Session
+
+
+class FakeMonitor:
+    def __init__(self, lags):
+        self.lags = lags
+
+    def healthy(self, max_lag):
+        return [alias for alias, lag in self.lags.items() if lag <= max_lag]
+
+
+class PrimaryReplicaRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.routing_token = start_routing()
+
+    def tearDown(self):
+        current_routing.reset(self.routing_token)
+
+    def make_router(self, **lags):
+        return PrimaryReplicaRouter(replicas=list(lags), monitor=FakeMonitor(lags))
+
+    def test_db_for_read__replica(self):
+        router = self.make_router(replica=0.5)
+
+        self.assertEqual(router.db_for_read(Session), "replica")
+        self.assertEqual(router.db_for_write(Session), "default")
+
+    def test_db_for_read__lagging_replica(self):
+        router = self.make_router(replica=5, replica_1=0)
+
+        self.assertEqual(router.db_for_read(Session), "replica_1")
+
+    def test_db_for_read__no_healthy_replica(self):
+        router = self.make_router(replica=5)
+
+        self.assertEqual(router.db_for_read(Session), "default")
+
+    def test_db_for_read__after_write(self):
+        router = self.make_router(replica=0)
+        router.db_for_write(Session)
+
+        self.assertEqual(router.db_for_read(Session), "default")
+
+    def test_db_for_read__pinned(self):
+        router = self.make_router(replica=0)
+        use_primary()
+
+        self.assertEqual(router.db_for_read(Session), "default")
+
+    def test_db_for_read__no_replica(self):
+        router = PrimaryReplicaRouter(replicas=[])
+
+        self.assertEqual(router.db_for_read(Session), "default")
+
+    def test_monitor__interval(self):
+        now = [0]
+        monitor = ReplicaMonitor(["replica"], interval=1, clock=lambda: now[0])
+        measures = iter([0.1, 3])
+        monitor.measure = lambda alias: next(measures)
+
+        self.assertEqual(monitor.healthy(2), ["replica"])
+        now[0] = 0.5
+        self.assertEqual(monitor.healthy(2), ["replica"])
+        now[0] = 1
+        self.assertEqual(monitor.healthy(2), [])
+
+
+class ReplicaCacheCheckTestCase(SimpleTestCase):
+    @skipUnless("replica" not in settings.DATABASES, "Replica configured")
+    def test_no_replica(self):
+        self.assertEqual(check_replica_cache(), [])
+
+    @skipUnless("replica" in settings.DATABASES, "No replica configured")
+    def test_local_cache(self):
+        local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        with override_settings(CACHES={"default": local, "sessions": local}):
+            errors = check_replica_cache()
+
+        self.assertEqual([error.id for error in errors], ["session_system.W001"])
+
+    @skipUnless("replica" in settings.DATABASES, "No replica configured")
+    def test_shared_cache(self):
+        shared = {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": "/tmp/sessions",
+        }
+        with override_settings(CACHES={**settings.CACHES, "sessions": shared}):
+            self.assertEqual(check_replica_cache(), [])
+
+
+# Run with DATABASE_REPLICA_URLS pointing at a second database, or at the
+# primary itself
+@skipUnless("replica" in settings.DATABASES, "No replica configured")
+class ReplicaRoutingTestCase(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.session = Session.objects.create(
+            user=self.user, device=self.device, otp_code="123456"
+        )
+
+    def test_save__pins_token(self):
+        self.assertTrue(is_token_pinned(self.session.token_hash))
+
+    @override_settings(SESSION_REPLICAS={"MAX_LAG": 2, "STICKY_SECONDS": 0})
+    def test_patch_session__read_from_replica(self):
+        response = self.client.patch(
+            f"/session/{self.session}/",
+            {"otp_code": "123456"},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.session.token}",
+        )
+
+        self.assertEqual(response.status_code, 200)
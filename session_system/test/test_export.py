@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from io import StringIO
+from unittest import skipIf, skipUnless
+import csv
+import datetime
+import json
+from ..models import User, Device, Session
+
+
+class ExportSessionsTestCase(TestCase):
+    # Every shard is exported
+    databases = "__all__"
+
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(
+            user=self.user,
+            type="mobi",
+            vendor_uuid="20354d7a-e4fe-47af-8ff6-187bca92f3f9",
+        )
+        self.old_session = Session.objects.create(
+            user=self.user,
+            device=self.device,
+            created_at=timezone.make_aware(datetime.datetime(2023, 12, 19)),
+            status="confirmed",
+        )
+        self.session = Session.objects.create(
+            user=self.user, device=self.device, is_new_user=True
+        )
+
+    def export(self, *args):
+        out = StringIO()
+        call_command("export_sessions", *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_export__ndjson(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+
+        self.assertEqual(len(rows), 2)
+        row = next(row for row in rows if row["uuid"] == f"ses-{self.session.uuid}")
+        self.assertEqual(row["status"], "pending")
+        self.assertTrue(row["is_new_user"])
+        self.assertFalse(row["is_new_device"])
+        self.assertEqual(row["user_email"], "test@example.com")
+        self.assertEqual(row["device_type"], "mobi")
+        self.assertEqual(
+            row["device_vendor_uuid"], "20354d7a-e4fe-47af-8ff6-187bca92f3f9"
+        )
+        self.assertIsNone(row["expires_at"])
+
+    def test_export__csv_filters(self):
+        output = self.export(
+            "--format",
+            "csv",
+            "--created-before",
+            "2024-01-01",
+            "--status",
+            "confirmed",
+        )
+
+        header, *rows = list(csv.reader(StringIO(output)))
+        self.assertEqual(header[:2], ["uuid", "status"])
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][:2], [f"ses-{self.old_session.uuid}", "confirmed"])
+        self.assertEqual(
+            self.export("--created-after", "2024-01-01", "--status", "confirmed"), ""
+        )
+
+    def test_export__invalid_status(self):
+        with self.assertRaisesMessage(Exception, "Unknown status: valid"):
+            self.export("--status", "valid")
+
+    @skipUnless(settings.ADMIN_ENABLED, "The admin is not loaded")
+    @override_settings(SESSION_EXPORT={"ENDPOINT": True})
+    def test_export_endpoint__staff_only(self):
+        staff = get_user_model().objects.create_user("staff", is_staff=True)
+        url = reverse("session-export")
+
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(staff)
+        response = self.client.get(url, {"format": "csv", "status": "pending"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(f"ses-{self.session.uuid}", lines[1])
+        self.assertEqual(
+            self.client.get(url, {"created_after": "yesterday"}).status_code, 400
+        )
+
+    def test_export_endpoint__disabled(self):
+        self.assertEqual(self.client.get(reverse("session-export")).status_code, 404)
+
+    @skipIf(settings.ADMIN_ENABLED, "The admin is loaded")
+    @override_settings(SESSION_EXPORT={"ENDPOINT": True})
+    def test_export_endpoint__without_admin(self):
+        response = self.client.get(reverse("session-export"))
+
+        self.assertEqual(response.status_code, 403)
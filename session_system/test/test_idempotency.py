@@ -0,0 +1,120 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from datetime import timedelta
+import threading
+
+from ..idempotency import idempotency_store, purge_idempotency_records
+from ..models import Device, IdempotencyRecord, Session
+
+
+IDEMPOTENCY = {
+    "ENABLED": True,
+    "CACHE": "sessions",
+    "TTL": 3600,
+    "LOCK_TIMEOUT": 30,
+    "WAIT": 1,
+    "POLL_INTERVAL": 0.01,
+}
+
+
+@override_settings(SESSION_IDEMPOTENCY=IDEMPOTENCY)
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        idempotency_store.cache.clear()
+        self.data = {"user": {"email": "test@example.com"}, "device": {"type": "othr"}}
+
+    def post_session(self, data=None, key="retry-1"):
+        return self.client.post(
+            "/session/",
+            data or self.data,
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_post_session__replayed(self):
+        first = self.post_session()
+
+        with self.assertNumQueries(0):
+            retry = self.post_session()
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Session.objects.count(), 1)
+
+    def test_post_session__other_key(self):
+        self.post_session()
+        response = self.post_session(key="retry-2")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", response)
+
+    def test_post_session__database_fallback(self):
+        first = self.post_session()
+        idempotency_store.cache.clear()
+
+        with self.assertNumQueries(1):
+            retry = self.post_session()
+
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(IdempotencyRecord.objects.count(), 1)
+
+    def test_post_session__token_not_stored(self):
+        token = self.post_session().json()["token"].encode()
+
+        for record in IdempotencyRecord.objects.all():
+            self.assertNotIn(token, bytes(record.body))
+            self.assertNotIn(token, bytes(record.sealed_token))
+
+    def test_post_session__other_payload(self):
+        self.post_session()
+        data = {"user": {"email": "other@example.com"}, "device": {"type": "othr"}}
+
+        response = self.post_session(data)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Device.objects.count(), 1)
+
+    def test_post_session__invalid_key(self):
+        response = self.post_session(key="x" * 256)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_session__waits_for_first_request(self):
+        first = self.post_session()
+        key, stored = next(
+            (record.key, idempotency_store.get(record.key))
+            for record in IdempotencyRecord.objects.all()
+        )
+        # The first request is still being handled
+        idempotency_store.cache.clear()
+        IdempotencyRecord.objects.all().delete()
+        idempotency_store.acquire(key)
+        # Stored in the cache by the first request when it completes
+        cache_key = f"{idempotency_store.key_prefix}{key}"
+        threading.Timer(0.1, idempotency_store.cache.set, [cache_key, stored]).start()
+
+        retry = self.post_session()
+
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(Session.objects.count(), 1)
+
+    @override_settings(SESSION_IDEMPOTENCY={**IDEMPOTENCY, "WAIT": 0})
+    def test_post_session__in_progress(self):
+        self.post_session()
+        key = IdempotencyRecord.objects.get().key
+        idempotency_store.cache.clear()
+        IdempotencyRecord.objects.all().delete()
+        idempotency_store.acquire(key)
+
+        response = self.post_session()
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_purge_idempotency_records(self):
+        self.post_session()
+        IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(1))
+
+        self.assertEqual(purge_idempotency_records(), 1)
+        self.assertFalse(IdempotencyRecord.objects.exists())
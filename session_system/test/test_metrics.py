@@ -0,0 +1,83 @@
+from django.test import TestCase, SimpleTestCase, override_settings
+from ..models import User, Device, Session
+from ..metrics import Histogram
+
+
+class HistogramTestCase(SimpleTestCase):
+    def test_collect(self):
+        histogram = Histogram("test_seconds", "Test.", ("view",), buckets=(1, 5))
+        histogram.observe(0.5, "a")
+        histogram.observe(5, "a")
+        histogram.observe(7, "a")
+
+        self.assertEqual(
+            list(histogram.collect())[2:],
+            [
+                'test_seconds_bucket{view="a",le="1"} 1',
+                'test_seconds_bucket{view="a",le="5"} 2',
+                'test_seconds_bucket{view="a",le="+Inf"} 3',
+                'test_seconds_sum{view="a"} 12.5',
+                'test_seconds_count{view="a"} 3',
+            ],
+        )
+
+
+class RequestMetricsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+
+    def test_server_timing(self):
+        data = {"user": {"email": self.user.email}, "device": {"type": "othr"}}
+        response = self.client.post("/session/", data, content_type="application/json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$',
+        )
+
+    def test_metrics(self):
+        data = {"user": {"email": self.user.email}, "device": {"type": "othr"}}
+        self.client.post("/session/", data, content_type="application/json")
+        session = Session.objects.get(user=self.user)
+        self.client.patch(
+            f"/session/{session}/",
+            {"otp_code": session.otp_code},
+            content_type="application/json",
+        )
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertRegex(
+            metrics,
+            r'session_http_requests_total\{view="session-create",method="POST",'
+            r'status="201",outcome="created"\} \d+',
+        )
+        self.assertRegex(
+            metrics,
+            r'session_http_requests_total\{view="update-session",method="PATCH",'
+            r'status="401",outcome="unauthorized"\} \d+',
+        )
+        self.assertIn('session_http_request_queries_bucket{view="session-create"', metrics)
+
+    def test_metrics__forbidden(self):
+        response = self.client.get("/metrics", REMOTE_ADDR="203.0.113.7")
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics__allowed_network(self):
+        options = {"ENDPOINT": True, "ALLOWED_NETWORKS": ["10.0.0.0/8"]}
+        with override_settings(SESSION_METRICS=options):
+            allowed = self.client.get("/metrics", REMOTE_ADDR="10.1.2.3")
+            forbidden = self.client.get("/metrics")
+
+        self.assertEqual(allowed.status_code, 200)
+        self.assertEqual(forbidden.status_code, 403)
+
+    @override_settings(SESSION_METRICS={"ENDPOINT": False})
+    def test_metrics__disabled(self):
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 404)
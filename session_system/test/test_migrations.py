@@ -0,0 +1,110 @@
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, override_settings
+
+
+# What partition_sessions --convert did to the table of 0004, the legacy
+# partition keeps its indexes
+PARTITION_SQL = [
+    "ALTER TABLE session_system_session RENAME TO session_system_session_legacy",
+    """
+    ALTER TABLE session_system_session_legacy
+    DROP CONSTRAINT session_system_session_pkey
+    """,
+    """
+    CREATE TABLE session_system_session
+    (LIKE session_system_session_legacy INCLUDING DEFAULTS)
+    PARTITION BY RANGE (created_at)
+    """,
+    "ALTER TABLE session_system_session ADD PRIMARY KEY (uuid, created_at)",
+    """
+    ALTER TABLE session_system_session ATTACH PARTITION session_system_session_legacy
+    FOR VALUES FROM (MINVALUE) TO ('2026-10-19')
+    """,
+    """
+    CREATE TABLE session_system_session_p20261019 PARTITION OF session_system_session
+    FOR VALUES FROM ('2026-10-19') TO ('2026-10-26')
+    """,
+]
+
+
+@override_settings(DATABASE_ROUTERS=[])
+class PartitionedMigrationsTestCase(SimpleTestCase):
+    """Migrations applied after the Session table was partitioned"""
+
+    databases = {"default"}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        name = f"{connection.settings_dict['NAME']}_partitioned"
+        with connection._nodb_cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {name}")
+            cursor.execute(f"CREATE DATABASE {name}")
+        # Left out of the DATABASES setting, the test runner would create
+        # a test database for it
+        cls.connection = type(connections["default"])(
+            {**connection.settings_dict, "NAME": name}, alias="partitioned"
+        )
+        connections["partitioned"] = cls.connection
+        cls.addClassCleanup(cls.drop_database, name)
+
+    @classmethod
+    def drop_database(cls, name):
+        cls.connection.close()
+        del connections["partitioned"]
+        with connection._nodb_cursor() as cursor:
+            cursor.execute(f"DROP DATABASE {name}")
+
+    def migrate(self, target):
+        executor = MigrationExecutor(self.connection)
+        executor.migrate([("session_system", target)])
+
+    def get_index(self, index):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [index])
+            return cursor.fetchone()[0]
+
+    def get_indexes(self, index):
+        """Return the (table, valid) of `index` and of its partition indexes"""
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT tables.relname, pg_index.indisvalid
+                FROM pg_partition_tree(%s::regclass) tree
+                JOIN pg_index ON pg_index.indexrelid = tree.relid
+                JOIN pg_class tables ON tables.oid = pg_index.indrelid
+                ORDER BY tables.relname
+                """,
+                [index],
+            )
+            return cursor.fetchall()
+
+    def assertIndexBuilt(self, index):
+        self.assertEqual(
+            self.get_indexes(index),
+            [
+                ("session_system_session", True),
+                ("session_system_session_legacy", True),
+                ("session_system_session_p20261019", True),
+            ],
+        )
+
+    def test_migrate(self):
+        self.migrate("0004_device_user_type_vendor_uniq")
+        with self.connection.cursor() as cursor:
+            for sql in PARTITION_SQL:
+                cursor.execute(sql)
+
+        self.migrate("0005_session_token_hash")
+        self.assertIndexBuilt("session_token_hash_idx")
+
+        self.migrate("0010_session_page_indexes")
+        self.assertIndexBuilt("session_user_page_idx")
+        self.assertIndexBuilt("session_device_page_idx")
+        self.assertIsNone(self.get_index("session_system_session_user_id_b631213d"))
+
+        self.migrate("0009_compact_layout_swap")
+        self.assertIsNone(self.get_index("session_user_page_idx"))
+        self.assertIndexBuilt("session_system_session_user_id_b631213d")
+        self.assertIndexBuilt("session_system_session_device_id_6af29da9")
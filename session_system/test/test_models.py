@@ -0,0 +1,71 @@
+from django.test import TestCase
+from django.utils import timezone
+import datetime
+from ..models import User, Device, Session
+
+
+class SessionExpiresAtTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.created_at = timezone.make_aware(datetime.datetime(2023, 12, 19))
+
+    def test_expires_at__othr_pending(self):
+        device = Device.objects.create(user=self.user, type="othr")
+        session = Session(user=self.user, device=device, created_at=self.created_at)
+        session.save()
+
+        self.assertEqual(
+            session.expires_at, self.created_at + datetime.timedelta(minutes=5)
+        )
+
+    def test_expires_at__othr_confirmed(self):
+        device = Device.objects.create(user=self.user, type="othr")
+        session = Session.objects.create(
+            user=self.user, device=device, created_at=self.created_at
+        )
+        session.status = "confirmed"
+        session.save()
+
+        self.assertEqual(
+            session.expires_at, self.created_at + datetime.timedelta(hours=2)
+        )
+
+    def test_expires_at__mobi(self):
+        device = Device.objects.create(
+            user=self.user,
+            type="mobi",
+            vendor_uuid="20354d7a-e4fe-47af-8ff6-187bca92f3f9",
+        )
+        session = Session.objects.create(
+            user=self.user, device=device, created_at=self.created_at
+        )
+
+        self.assertIsNone(session.expires_at)
+
+
+class CompactFieldsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+
+    def test_status_and_type__stored_as_codes(self):
+        session = Session.objects.create(
+            user=self.user, device=self.device, status="confirmed"
+        )
+
+        stored = Session.objects.values_list("status", "device__type").get()
+        self.assertEqual(stored, ("confirmed", "othr"))
+        self.assertEqual(Session.objects.filter(status=2).get(), session)
+
+    def test_flags(self):
+        Session.objects.create(user=self.user, device=self.device, is_new_device=True)
+
+        session = Session.objects.get()
+        self.assertEqual(session.flags, 2)
+        self.assertFalse(session.is_new_user)
+        self.assertTrue(session.is_new_device)
+
+    def test_otp_code__zero_padded(self):
+        Session.objects.create(user=self.user, device=self.device, otp_code="000042")
+
+        self.assertEqual(Session.objects.get().otp_code, "000042")
@@ -0,0 +1,142 @@
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase
+from django.utils import timezone
+from io import StringIO
+import datetime
+from ..models import User, Device, Session
+from .. import partitioning
+
+
+class PartitionNamingTestCase(SimpleTestCase):
+    def test_partition_start(self):
+        date = datetime.date(2023, 12, 20)
+
+        self.assertEqual(
+            partitioning.partition_start(date, "day"),
+            datetime.datetime(2023, 12, 20, tzinfo=datetime.timezone.utc),
+        )
+        self.assertEqual(
+            partitioning.partition_start(date, "week"),
+            datetime.datetime(2023, 12, 18, tzinfo=datetime.timezone.utc),
+        )
+
+    def test_partition_name(self):
+        start = partitioning.partition_start(datetime.date(2023, 12, 20), "week")
+
+        self.assertEqual(
+            partitioning.partition_name(start), "session_system_session_p20231218"
+        )
+
+
+class PartitionSessionsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.session = Session.objects.create(user=self.user, device=self.device)
+
+    def test_convert_and_create_partitions(self):
+        out = StringIO()
+        call_command(
+            "partition_sessions", "--convert", "--interval", "day", "--ahead", "2",
+            stdout=out,
+        )
+
+        self.assertTrue(partitioning.is_partitioned())
+        partitions = partitioning.list_partitions()
+        self.assertEqual(len(partitions), 3)
+        self.assertIn("session_system_session_legacy", partitions)
+
+        # Sessions of the next days land in their partition
+        tomorrow = timezone.now() + datetime.timedelta(days=1)
+        session = Session.objects.create(
+            user=self.user, device=self.device, created_at=tomorrow
+        )
+        for session in (session, self.session):
+            self.assertEqual(Session.objects.get(token_hash=session.token_hash), session)
+
+    def test_drop_partitions(self):
+        now = timezone.now()
+        Session.objects.filter(pk=self.session.pk).update(
+            created_at=now - datetime.timedelta(days=20)
+        )
+        partitioning.convert_to_partitioned("day", now=now - datetime.timedelta(days=10))
+        partitioning.create_partitions("day", 10, now=now - datetime.timedelta(days=10))
+        old = now - datetime.timedelta(days=8)
+        Session.objects.create(user=self.user, device=self.device, created_at=old)
+
+        results = partitioning.drop_partitions(datetime.timedelta(days=5), now=now)
+
+        dropped = [partition for partition, _, dropped in results if dropped]
+        self.assertEqual(len(dropped), 4)
+        self.assertFalse(
+            Session.objects.filter(created_at__lt=now - datetime.timedelta(days=6))
+            .exclude(pk=self.session.pk)
+            .exists()
+        )
+
+    def test_partition_ranges(self):
+        converted_at = datetime.datetime(2023, 12, 20, tzinfo=datetime.timezone.utc)
+        Session.objects.filter(pk=self.session.pk).update(created_at=converted_at)
+        partitioning.convert_to_partitioned("week", now=converted_at)
+        partitioning.create_partitions("week", 1, now=converted_at)
+
+        self.assertEqual(
+            partitioning.partition_ranges(),
+            [
+                (
+                    "session_system_session_legacy",
+                    None,
+                    datetime.datetime(2023, 12, 25, tzinfo=datetime.timezone.utc),
+                ),
+                (
+                    "session_system_session_p20231225",
+                    datetime.datetime(2023, 12, 25, tzinfo=datetime.timezone.utc),
+                    datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+                ),
+            ],
+        )
+
+    def test_drop_partitions__interval_changed(self):
+        now = timezone.now()
+        converted_at = now - datetime.timedelta(days=21)
+        Session.objects.filter(pk=self.session.pk).update(created_at=converted_at)
+        partitioning.convert_to_partitioned("week", now=converted_at)
+        partitioning.create_partitions("week", 3, now=converted_at)
+        weekly = partitioning.partition_ranges()
+
+        # The daily partitions start after the weekly ones
+        created = partitioning.create_partitions("day", 30, now=now)
+        end = weekly[-1][2]
+        self.assertEqual(
+            partitioning.partition_ranges()[len(weekly)],
+            (created[0], end, end + datetime.timedelta(days=1)),
+        )
+        results = partitioning.drop_partitions(datetime.timedelta(days=10), now=now)
+
+        # Weekly partitions are kept until their week is past the retention
+        cutoff = now - datetime.timedelta(days=10)
+        self.assertEqual(
+            [partition for partition, _, _ in results],
+            [partition for partition, _, end in weekly if end <= cutoff],
+        )
+
+    def test_drop_partitions__legacy(self):
+        now = timezone.now()
+        Session.objects.filter(pk=self.session.pk).update(
+            created_at=now - datetime.timedelta(days=20),
+            expires_at=now - datetime.timedelta(days=19),
+        )
+        converted_at = now - datetime.timedelta(days=10)
+        partitioning.convert_to_partitioned("day", now=converted_at)
+        partitioning.create_partitions("day", 1, now=now)
+        legacy = "session_system_session_legacy"
+
+        drop = partitioning.drop_partitions
+        kept = drop(datetime.timedelta(days=15), now=now)
+        results = drop(datetime.timedelta(days=5), now=now)
+
+        self.assertEqual(kept, [])
+        self.assertEqual(results, [(legacy, None, True)])
+        self.assertNotIn(legacy, partitioning.list_partitions())
+        self.assertFalse(Session.objects.filter(pk=self.session.pk).exists())
+        self.assertIsNone(partitioning.get_legacy_boundary())
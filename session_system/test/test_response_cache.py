@@ -0,0 +1,57 @@
+from django.test import TestCase, SimpleTestCase
+import json
+
+from ..models import User, Device, Session
+from ..response_cache import dumps, response_cache
+
+
+class DumpsTestCase(SimpleTestCase):
+    def test_dumps__compact_bytes(self):
+        body = dumps({"uuid": "ses-1", "device": {"type": "othr"}})
+
+        self.assertIsInstance(body, bytes)
+        self.assertEqual(json.loads(body), {"uuid": "ses-1", "device": {"type": "othr"}})
+        self.assertNotIn(b", ", body)
+
+
+class SessionResponseCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.session = Session.objects.create(user=self.user, device=self.device)
+        self.data = {"user": {"email": "test@example.com"}, "device": {"type": "othr"}}
+
+    def post_session(self):
+        return self.client.post("/session/", self.data, content_type="application/json")
+
+    def test_post_session__cached_body(self):
+        first = self.post_session()
+        second = self.post_session()
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(
+            {**first.json(), "token": None}, {**second.json(), "token": None}
+        )
+        self.assertNotEqual(first.json()["token"], second.json()["token"])
+        self.assertEqual(second.json()["uuid"], str(self.session))
+        self.assertIsNotNone(response_cache.get((self.session.uuid, "pending")))
+
+    def test_post_session__invalidated_on_save(self):
+        self.post_session()
+        self.session.is_new_user = True
+        self.session.save()
+
+        self.assertIsNone(response_cache.get((self.session.uuid, "pending")))
+        self.assertTrue(self.post_session().json()["is_new_user"])
+
+    def test_patch_session__status_in_key(self):
+        token = self.post_session().json()["token"]
+        response = self.client.patch(
+            f"/session/{self.session}/",
+            {"otp_code": self.session.otp_code},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+
+        self.assertEqual(response.json()["status"], "confirmed")
+        self.assertEqual(self.post_session().json()["status"], "confirmed")
@@ -0,0 +1,136 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from io import StringIO
+from ..checks import check_revocation_cache
+from ..models import User, Device, Session
+from ..revocation import generation_key, generations_cache
+from ..token_cache import token_cache
+
+
+class RevokeSessionsTestCase(TestCase):
+    def setUp(self):
+        generations_cache().clear()
+        token_cache.clear()
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.other_device = Device.objects.create(
+            user=self.user,
+            type="mobi",
+            vendor_uuid="20354d7a-e4fe-47af-8ff6-187bca92f3f9",
+        )
+        self.session = Session.objects.create(user=self.user, device=self.device)
+        self.other_session = Session.objects.create(
+            user=self.user, device=self.other_device
+        )
+
+    def list_sessions(self, session):
+        return self.client.get(
+            f"/user/usr-{self.user.uuid}/sessions/",
+            HTTP_AUTHORIZATION=f"Bearer {session.token}",
+        )
+
+    def revoke(self, url, session):
+        return self.client.post(url, HTTP_AUTHORIZATION=f"Bearer {session.token}")
+
+    def test_revoke_user_sessions(self):
+        # Both tokens are now cached by the middleware
+        self.assertEqual(self.list_sessions(self.session).status_code, 200)
+        self.assertEqual(self.list_sessions(self.other_session).status_code, 200)
+
+        response = self.revoke(
+            f"/user/usr-{self.user.uuid}/sessions/revoke/", self.session
+        )
+
+        self.assertEqual(response.json(), {"revoked": 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.list_sessions(self.other_session).status_code, 401)
+        self.assertEqual(self.list_sessions(self.session).status_code, 401)
+        self.assertEqual(Session.objects.exclude(status="expired").count(), 0)
+
+    def test_revoke_device_sessions(self):
+        self.list_sessions(self.session)
+
+        response = self.revoke(
+            f"/device/dev-{self.device.uuid}/sessions/revoke/", self.other_session
+        )
+
+        self.assertEqual(response.json(), {"revoked": 1})
+        self.assertEqual(self.list_sessions(self.session).status_code, 401)
+        self.assertEqual(self.list_sessions(self.other_session).status_code, 200)
+
+    def test_revoke__new_session_after_revocation(self):
+        self.revoke(f"/user/usr-{self.user.uuid}/sessions/revoke/", self.session)
+
+        response = self.client.post(
+            "/session/",
+            {"user": {"email": self.user.email}, "device": {"type": "othr"}},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        session = Session.objects.exclude(status="expired").get()
+        session.token = response.json()["token"]
+        self.assertEqual(session.generation, 1)
+        self.assertEqual(self.list_sessions(session).status_code, 200)
+
+    def test_revoke__stale_counters(self):
+        self.revoke(f"/user/usr-{self.user.uuid}/sessions/revoke/", self.session)
+        # Counters cached by a process that didn't see the revocation
+        generations_cache().set(generation_key("usr", self.user.uuid), 0)
+
+        response = self.client.post(
+            "/session/",
+            {"user": {"email": self.user.email}, "device": {"type": "othr"}},
+            content_type="application/json",
+        )
+        session = Session.objects.exclude(status="expired").get()
+        session.token = response.json()["token"]
+
+        for _ in range(3):
+            self.assertEqual(self.list_sessions(session).status_code, 200)
+        self.assertEqual(
+            generations_cache().get(generation_key("usr", self.user.uuid)), 1
+        )
+
+    def test_revoke__other_user(self):
+        other = User.objects.create(email="other@example.com")
+        other_device = Device.objects.create(user=other, type="othr")
+
+        response = self.revoke(
+            f"/device/dev-{other_device.uuid}/sessions/revoke/", self.session
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Session.objects.filter(status="expired").count(), 0)
+
+    def test_revoke_sessions_command(self):
+        out = StringIO()
+        call_command("revoke_sessions", "--device", str(self.device), stdout=out)
+        call_command("revoke_sessions", "--email", self.user.email, stdout=out)
+
+        self.assertEqual(
+            out.getvalue(),
+            f"Revoked 1 sessions of {self.device}\n"
+            f"Revoked 1 sessions of {self.user.email}\n",
+        )
+        with self.assertRaisesMessage(CommandError, "not found"):
+            call_command("revoke_sessions", "--email", "nobody@example.com")
+
+
+class RevocationCacheCheckTestCase(SimpleTestCase):
+    def test_local_cache(self):
+        local = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        with override_settings(CACHES={"default": local, "sessions": local}):
+            errors = check_revocation_cache()
+
+        self.assertEqual([error.id for error in errors], ["session_system.W002"])
+
+    def test_shared_cache(self):
+        shared = {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": "/tmp/sessions",
+        }
+        with override_settings(CACHES={**settings.CACHES, "sessions": shared}):
+            self.assertEqual(check_revocation_cache(), [])
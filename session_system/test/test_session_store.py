@@ -0,0 +1,112 @@
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from io import StringIO
+
+from ..models import User, Device, Session, CONFIRMED_SESSION_LIFETIME, hash_token
+from ..session_store import session_store
+from ..token_cache import token_cache
+
+
+STORE = {
+    "ENABLED": True,
+    "CACHE": "sessions",
+    "WRITE_MODE": "through",
+    "TIMEOUT": 86400,
+    "FLUSH_INTERVAL": 3600,
+    "BATCH_SIZE": 500,
+}
+
+
+@override_settings(SESSION_STORE=STORE)
+class SessionStoreTestCase(TestCase):
+    def setUp(self):
+        session_store.cache.clear()
+        token_cache.clear()
+        self.data = {"user": {"email": "test@example.com"}, "device": {"type": "othr"}}
+        self.session = self.post_session()
+
+    def post_session(self):
+        return self.client.post(
+            "/session/", self.data, content_type="application/json"
+        ).json()
+
+    def patch_session(self, otp_code):
+        return self.client.patch(
+            f"/session/{self.session['uuid']}/",
+            {"otp_code": otp_code},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {self.session['token']}",
+        )
+
+    def stored_session(self):
+        return session_store.get(hash_token(self.session["token"]))
+
+    def stored_row(self):
+        return Session.objects.get(token_hash=hash_token(self.session["token"]))
+
+    def otp_code(self):
+        return self.stored_session().otp_code
+
+    def test_post_session__stored(self):
+        state = self.stored_session()
+
+        self.assertEqual(f"ses-{state.uuid}", self.session["uuid"])
+        self.assertEqual(state.status, "pending")
+        self.assertIsNone(state.data["token"])
+
+    def test_post_session__rotated_token(self):
+        previous = self.session
+        self.session = self.post_session()
+
+        self.assertEqual(self.session["uuid"], previous["uuid"])
+        self.assertIsNone(session_store.get(hash_token(previous["token"])))
+        self.assertEqual(self.stored_session().status, "pending")
+
+    def test_patch_session__write_through(self):
+        with self.assertNumQueries(1):
+            response = self.patch_session(self.otp_code())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "confirmed")
+        self.assertEqual(response.json()["token"], self.session["token"])
+        self.assertEqual(self.stored_session().status, "confirmed")
+        session = self.stored_row()
+        self.assertEqual(session.status, "confirmed")
+        self.assertEqual(
+            session.expires_at, session.created_at + CONFIRMED_SESSION_LIFETIME
+        )
+
+    @override_settings(SESSION_STORE={**STORE, "WRITE_MODE": "behind"})
+    def test_patch_session__write_behind(self):
+        with self.assertNumQueries(0):
+            response = self.patch_session(self.otp_code())
+
+        self.assertEqual(response.json()["status"], "confirmed")
+        self.assertEqual(self.stored_row().status, "pending")
+        session_store.flush()
+        self.assertEqual(self.stored_row().status, "confirmed")
+
+    def test_patch_session__invalid_otp_code(self):
+        with self.assertNumQueries(0):
+            response = self.patch_session("invalid")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_save__drops_state(self):
+        session = self.stored_row()
+        session.status = "confirmed"
+        session.save()
+
+        self.assertIsNone(self.stored_session())
+
+    def test_rebuild_session_store(self):
+        session_store.cache.clear()
+        user = User.objects.create(email="other@example.com")
+        device = Device.objects.create(user=user, type="othr")
+        Session.objects.create(user=user, device=device, status="expired")
+        out = StringIO()
+
+        call_command("rebuild_session_store", stdout=out)
+
+        self.assertIn("Stored 1 sessions", out.getvalue())
+        self.assertEqual(self.stored_session().status, "pending")
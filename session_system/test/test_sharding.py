@@ -0,0 +1,162 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from io import StringIO
+from unittest import skipUnless
+
+from ..management.commands.bench_sessions import InProcessClient
+from ..models import User, Device, Session, hash_token
+from ..sharding import (
+    build_shard_map,
+    email_bucket,
+    shard_aliases,
+    shard_for_email,
+    shard_for_token,
+    token_prefix,
+)
+
+
+class ShardMapTestCase(SimpleTestCase):
+    def test_email_bucket__stable(self):
+        self.assertEqual(email_bucket("test@example.com"), 832)
+        self.assertTrue(0 <= email_bucket("other@example.com") < 1024)
+
+    @override_settings(SESSION_SHARDING={"BUCKETS": 1024, "MAP": None})
+    def test_build_shard_map__even_split(self):
+        shard_map = build_shard_map()
+
+        self.assertEqual(sorted(set(shard_map)), shard_aliases())
+        for alias in shard_aliases():
+            self.assertEqual(shard_map.count(alias), 1024 // len(shard_aliases()))
+
+    @override_settings(
+        SESSION_SHARDING={
+            "BUCKETS": 4,
+            "MAP": {"default": [[0, 0], [3, 3]], "shard_1": [[1, 2]]},
+        }
+    )
+    def test_build_shard_map__configured(self):
+        self.assertEqual(
+            build_shard_map(), ["default", "shard_1", "shard_1", "default"]
+        )
+
+    @override_settings(SESSION_SHARDING={"BUCKETS": 4, "MAP": {"default": [[0, 2]]}})
+    def test_build_shard_map__missing_bucket(self):
+        with self.assertRaises(ValueError):
+            build_shard_map()
+
+    @override_settings(
+        SESSION_SHARDING={
+            "BUCKETS": 1024,
+            "MAP": {"default": [[0, 511]], "shard_1": [[512, 1023]]},
+        }
+    )
+    def test_shard_for_token(self):
+        self.assertEqual(shard_for_token("200.abc"), "shard_1")
+        self.assertEqual(shard_for_token("1ff.abc"), "default")
+        # Tokens predating sharding
+        self.assertEqual(shard_for_token("abc-def"), "default")
+        self.assertEqual(shard_for_token("zz.abc"), "default")
+
+    def test_token_prefix(self):
+        self.assertEqual(token_prefix("test@example.com"), "340.")
+
+
+# Run with DATABASE_SHARD_URLS pointing at another local database
+@skipUnless("shard_1" in settings.DATABASES, "No shard configured")
+class ShardingTestCase(TestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        # An email of each shard
+        self.emails = {}
+        for index in range(100):
+            email = f"user{index}@example.com"
+            self.emails.setdefault(shard_for_email(email), email)
+
+    def post_session(self, email):
+        data = {"user": {"email": email}, "device": {"type": "othr"}}
+        return self.client.post("/session/", data, content_type="application/json")
+
+    def test_post_session__on_user_shard(self):
+        for alias, email in self.emails.items():
+            session = self.post_session(email).json()
+
+            self.assertEqual(shard_for_token(session["token"]), alias)
+            token_hash = hash_token(session["token"])
+            for other in self.emails:
+                sessions = Session.objects.using(other).filter(token_hash=token_hash)
+                self.assertEqual(sessions.exists(), other == alias)
+
+    def test_patch_session__routed_by_token(self):
+        session = self.post_session(self.emails["shard_1"]).json()
+        otp_code = (
+            Session.objects.using("shard_1")
+            .values_list("otp_code", flat=True)
+            .get(token_hash=hash_token(session["token"]))
+        )
+
+        response = self.client.patch(
+            f"/session/{session['uuid']}/",
+            {"otp_code": otp_code},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {session['token']}",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "confirmed")
+
+    def test_reshard_sessions(self):
+        email = self.emails["default"]
+        self.post_session(email)
+        bucket = email_bucket(email)
+        buckets = f"{bucket}-{bucket}"
+        out = StringIO()
+
+        call_command(
+            "reshard_sessions",
+            "--source=default",
+            "--target=shard_1",
+            f"--buckets={buckets}",
+            stdout=out,
+        )
+        self.assertIn("Copied 1 users, 1 devices and 1 sessions", out.getvalue())
+        self.assertTrue(User.objects.using("shard_1").filter(email=email).exists())
+
+        # Switch the bucket to shard_1
+        shard_map = {"default": [], "shard_1": [[bucket, bucket]]}
+        if bucket > 0:
+            shard_map["default"].append([0, bucket - 1])
+        if bucket < 1023:
+            shard_map["default"].append([bucket + 1, 1023])
+        with override_settings(SESSION_SHARDING={"BUCKETS": 1024, "MAP": shard_map}):
+            call_command(
+                "reshard_sessions",
+                "--source=default",
+                "--target=shard_1",
+                f"--buckets={buckets}",
+                "--delete",
+                stdout=out,
+            )
+        self.assertFalse(User.objects.filter(email=email).exists())
+        self.assertEqual(Device.objects.using("shard_1").count(), 1)
+
+    def test_revoke_sessions__found_on_shard(self):
+        self.post_session(self.emails["shard_1"])
+        user = User.objects.using("shard_1").get(email=self.emails["shard_1"])
+        out = StringIO()
+
+        call_command("revoke_sessions", "--user", str(user), stdout=out)
+
+        self.assertEqual(out.getvalue(), f"Revoked 1 sessions of {user}\n")
+        self.assertEqual(
+            Session.objects.using("shard_1").get(user=user).status, "expired"
+        )
+
+    def test_bench_client__counts_shard_queries(self):
+        data = {"user": {"email": self.emails["shard_1"]}, "device": {"type": "othr"}}
+
+        status, _, queries = InProcessClient().request("POST", "/session/", data)
+
+        self.assertEqual(status, 201)
+        self.assertGreater(queries, 0)
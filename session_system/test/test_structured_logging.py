@@ -0,0 +1,94 @@
+from django.test import TestCase, SimpleTestCase
+import io
+import json
+import logging
+import queue
+
+from ..structured_logging import (
+    JsonFormatter,
+    QueueHandler,
+    QueueListener,
+    RequestIdFilter,
+    SamplingFilter,
+    current_request_id,
+)
+
+
+def make_record(msg="OTP CODE: %s", args=("123456",), **extra):
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+class StructuredLoggingTestCase(SimpleTestCase):
+    def test_json_formatter(self):
+        record = make_record(event="otp_code", request_id="abc", view="create")
+
+        data = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual(data["message"], "OTP CODE: 123456")
+        self.assertEqual(data["level"], "INFO")
+        self.assertEqual(data["event"], "otp_code")
+        self.assertEqual(data["request_id"], "abc")
+        self.assertEqual(data["view"], "create")
+
+    def test_sampling_filter(self):
+        sampling = SamplingFilter({"otp_code": 0.5}, random=iter([0.1, 0.9]).__next__)
+
+        self.assertTrue(sampling.filter(make_record(event="otp_code")))
+        self.assertFalse(sampling.filter(make_record(event="otp_code")))
+        self.assertTrue(sampling.filter(make_record(event="other")))
+
+    def test_request_id_filter(self):
+        token = current_request_id.set("abc")
+        try:
+            record = make_record()
+            RequestIdFilter().filter(record)
+        finally:
+            current_request_id.reset(token)
+
+        self.assertEqual(record.request_id, "abc")
+
+    def test_queue_handler__lazy_formatting(self):
+        handler = QueueHandler(queue.Queue())
+        handler.enqueue = handler.queue.put
+
+        handler.emit(make_record())
+        record = handler.queue.get_nowait()
+
+        self.assertEqual(record.msg, "OTP CODE: %s")
+        self.assertEqual(record.args, ("123456",))
+
+    def test_queue_handler__restart_listener(self):
+        stream = io.StringIO()
+        handler = QueueHandler(queue.Queue())
+        handler.listener = QueueListener(handler.queue, logging.StreamHandler(stream))
+        handler.start_listener()
+        parent_listener = handler.listener
+
+        # As in a child forked while the listener was running
+        handler.restart_listener()
+        try:
+            self.assertIsNot(handler.listener, parent_listener)
+            self.assertTrue(handler.listener.started)
+            handler.handle(make_record())
+        finally:
+            handler.close()
+            parent_listener.stop()
+
+        self.assertEqual(stream.getvalue(), "OTP CODE: 123456\n")
+
+
+class RequestIdTestCase(TestCase):
+    def test_request_id(self):
+        response = self.client.get("/metrics", HTTP_X_REQUEST_ID="abc")
+
+        self.assertEqual(response["X-Request-ID"], "abc")
+
+    def test_request_id__generated(self):
+        with self.assertLogs("session_system.access") as logs:
+            response = self.client.get("/metrics")
+
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+        self.assertEqual(logs.records[0].event, "request")
+        self.assertEqual(logs.records[0].view, "metrics")
@@ -0,0 +1,62 @@
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from io import StringIO
+import datetime
+from ..models import User, Device, Session
+from ..sweeper import start_sweeper, sweep_expired_sessions
+
+
+class SweepExpiredSessionsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        expired_date = timezone.make_aware(datetime.datetime(2023, 12, 19))
+        self.stale_sessions = [
+            Session.objects.create(
+                user=self.user, device=self.device, created_at=expired_date
+            )
+            for _ in range(5)
+        ]
+        self.alive_session = Session.objects.create(user=self.user, device=self.device)
+        mobi_device = Device.objects.create(
+            user=self.user,
+            type="mobi",
+            vendor_uuid="20354d7a-e4fe-47af-8ff6-187bca92f3f9",
+        )
+        self.mobi_session = Session.objects.create(
+            user=self.user, device=mobi_device, created_at=expired_date
+        )
+
+    def test_sweep_expired_sessions(self):
+        result = sweep_expired_sessions(batch_size=2)
+
+        self.assertEqual(result.rows, 5)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(Session.objects.filter(status="expired").count(), 5)
+        self.alive_session.refresh_from_db()
+        self.assertEqual(self.alive_session.status, "pending")
+        self.mobi_session.refresh_from_db()
+        self.assertEqual(self.mobi_session.status, "pending")
+
+    def test_sweep_sessions_command(self):
+        out = StringIO()
+        call_command("sweep_sessions", "--batch-size", "10", stdout=out)
+
+        self.assertIn("Expired 5 sessions in 1 batches", out.getvalue())
+        self.assertEqual(sweep_expired_sessions().rows, 0)
+
+
+class StartSweeperTestCase(SimpleTestCase):
+    def test_disabled(self):
+        with override_settings(SESSION_SWEEPER={"ENABLED": False}):
+            self.assertIsNone(start_sweeper())
+
+    def test_enabled(self):
+        with override_settings(SESSION_SWEEPER={"ENABLED": True, "INTERVAL": 3600}):
+            sweeper = start_sweeper()
+
+        self.assertTrue(sweeper.is_alive())
+        sweeper.stop()
+        sweeper.join(timeout=1)
+        self.assertFalse(sweeper.is_alive())
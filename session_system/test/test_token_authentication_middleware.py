@@ -0,0 +1,90 @@
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from ..models import User, Device, Session
+from ..token_authentication_middleware import (
+    TokenAuthenticationMiddleware,
+    optional_token_auth,
+    token_auth,
+)
+
+
+def public_view(request):
+    return HttpResponse()
+
+
+@token_auth
+def private_view(request):
+    return HttpResponse()
+
+
+@optional_token_auth
+def optional_view(request):
+    return HttpResponse()
+
+
+async def async_get_response(request):
+    return HttpResponse()
+
+
+class TokenAuthenticationMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.session = Session.objects.create(
+            user=self.user, device=self.device, otp_code="123456"
+        )
+        self.middleware = TokenAuthenticationMiddleware(lambda request: HttpResponse())
+
+    def request(self, token=None):
+        headers = {} if token is None else {"Authorization": f"Bearer {token}"}
+        return RequestFactory().get("/", headers=headers)
+
+    def process_view(self, request, view):
+        return self.middleware.process_view(request, view, (), {})
+
+    def test_no_policy__skipped(self):
+        request = self.request("invalid")
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.process_view(request, public_view))
+        self.assertFalse(hasattr(request, "session_token"))
+
+    def test_required(self):
+        request = self.request(self.session.token)
+
+        self.assertIsNone(self.process_view(request, private_view))
+        self.assertEqual(request.session.uuid, self.session.uuid)
+        self.assertEqual(request.session_token, self.session.token)
+
+    def test_required__no_token(self):
+        response = self.process_view(self.request(), private_view)
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_optional__no_token(self):
+        request = self.request()
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.process_view(request, optional_view))
+        self.assertIsNone(request.session)
+        self.assertIsNone(request.session_token)
+
+    def test_optional__invalid_token(self):
+        response = self.process_view(self.request("invalid"), optional_view)
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_optional__valid_token(self):
+        request = self.request(self.session.token)
+
+        self.assertIsNone(self.process_view(request, optional_view))
+        self.assertEqual(request.session.uuid, self.session.uuid)
+
+    async def test_async(self):
+        middleware = TokenAuthenticationMiddleware(async_get_response)
+        request = self.request(self.session.token)
+
+        self.assertIsNone(await middleware.process_view(request, private_view, (), {}))
+        self.assertEqual(request.session.uuid, self.session.uuid)
+        response = await middleware.process_view(self.request(), private_view, (), {})
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,80 @@
+from django.test import TestCase, SimpleTestCase
+from ..models import User, Device, Session, hash_token
+from ..token_cache import TokenCache, token_cache
+
+
+class TokenCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = TokenCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_get__hit_and_miss(self):
+        self.cache.set("a", "record-a")
+
+        self.assertEqual(self.cache.get("a"), "record-a")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_get__expired_entry(self):
+        self.cache.set("a", "record-a")
+        self.now = 10
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_set__evicts_least_recently_used(self):
+        self.cache.set("a", "record-a")
+        self.cache.set("b", "record-b")
+        self.cache.get("a")
+        self.cache.set("c", "record-c")
+
+        self.assertEqual(self.cache.get("a"), "record-a")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), "record-c")
+
+
+class TokenAuthenticationCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.session = Session.objects.create(
+            user=self.user, device=self.device, otp_code="123456"
+        )
+        self.auth_header = {"HTTP_AUTHORIZATION": f"Bearer {self.session.token}"}
+
+    def patch_session(self, otp_code):
+        return self.client.patch(
+            f"/session/ses-{self.session.uuid}/",
+            {"otp_code": otp_code},
+            content_type="application/json",
+            **self.auth_header,
+        )
+
+    def test_patch_session__cached_token(self):
+        self.patch_session("123455")
+
+        with self.assertNumQueries(1):
+            response = self.patch_session("123456")
+        self.assertEqual(response.status_code, 200)
+
+    def test_patch_session__invalidated_on_confirm(self):
+        self.patch_session("123455")
+        self.assertIsNotNone(token_cache.get(self.session.token_hash))
+
+        response = self.patch_session("123456")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(token_cache.get(self.session.token_hash))
+
+    def test_post_session__invalidated_on_reuse(self):
+        self.session.status = "confirmed"
+        self.session.save()
+        self.patch_session("123456")
+        self.assertIsNotNone(token_cache.get(hash_token(self.session.token)))
+
+        data = {"user": {"email": "test@example.com"}, "device": {"type": "othr"}}
+        response = self.client.post("/session/", data, content_type="application/json")
+
+        self.assertNotEqual(response.json()["token"], self.session.token)
+        self.assertIsNone(token_cache.get(hash_token(self.session.token)))
+        self.assertEqual(self.patch_session("123456").status_code, 401)
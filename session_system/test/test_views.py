@@ -1,7 +1,8 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 import datetime
-from ..models import User, Device, Session
+from ..models import User, Device, Session, hash_token
+from ..token_cache import token_cache
 
 
 class CreateSessionViewTestCase(TestCase):
@@ -15,12 +16,14 @@ class CreateSessionViewTestCase(TestCase):
         response = self.client.post("/session/", data, content_type="application/json")
 
         session = Session.objects.filter(user=self.user, device=self.device).first()
+        token = response.json()["token"]
         self.assertEqual(response.status_code, 201)
+        self.assertEqual(bytes(session.token_hash), hash_token(token))
         self.assertDictEqual(
             response.json(),
             {
                 "uuid": f"ses-{session.uuid}",
-                "token": session.token,
+                "token": token,
                 "status": "pending",
                 "is_new_user": False,
                 "is_new_device": False,
@@ -46,17 +49,22 @@ class CreateSessionViewTestCase(TestCase):
 
         response = self.client.post("/session/", data, content_type="application/json")
         self.assertEqual(response.status_code, 201)
+        first_token = response.json()["token"]
 
         response = self.client.post("/session/", data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         session = Session.objects.filter(
             user__email="test@example.com", device__type="mobi"
         ).first()
+        # The session is reused with a new token
+        token = response.json()["token"]
+        self.assertNotEqual(token, first_token)
+        self.assertEqual(bytes(session.token_hash), hash_token(token))
         self.assertDictEqual(
             response.json(),
             {
                 "uuid": f"ses-{session.uuid}",
-                "token": session.token,
+                "token": token,
                 "status": "pending",
                 "is_new_user": False,
                 "is_new_device": True,
@@ -86,6 +94,33 @@ class CreateSessionViewTestCase(TestCase):
         self.assertTrue(response.json()["uuid"] != str(expired_session))
         self.assertEqual(response.json()["status"], "pending")
 
+    def test_post_session__expired_token_uncached(self):
+        data = {"user": {"email": self.user.email}, "device": {"type": "othr"}}
+        for url, payload, fast_path in [
+            ("/session/", data, True),
+            ("/session/", data, False),
+            ("/session/batch/", [data], True),
+        ]:
+            with self.subTest(url=url, fast_path=fast_path), override_settings(
+                SESSION_UPSERT_FAST_PATH=fast_path
+            ):
+                session = Session.objects.create(user=self.user, device=self.device)
+                # Cached by the token middleware
+                self.client.get(
+                    f"/user/usr-{self.user.uuid}/sessions/",
+                    HTTP_AUTHORIZATION=f"Bearer {session.token}",
+                )
+                self.assertIsNotNone(token_cache.get(hash_token(session.token)))
+                Session.objects.update(
+                    expires_at=timezone.now() - datetime.timedelta(minutes=1)
+                )
+
+                self.client.post(url, payload, content_type="application/json")
+
+                self.assertIsNone(token_cache.get(hash_token(session.token)))
+                session.refresh_from_db()
+                self.assertEqual(session.status, "expired")
+
     def test_post_session__mobi_no_vendor(self):
         data = {
             "user": {"email": self.user.email},
@@ -277,3 +312,241 @@ class UpdateSessionViewTestCase(TestCase):
         response = self.client.post("/session/", data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()['status'], 'confirmed')
+
+
+class BatchCreateSessionViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.session = Session.objects.create(user=self.user, device=self.device)
+
+    def test_post_batch(self):
+        data = [
+            {"user": {"email": self.user.email}, "device": {"type": "othr"}},
+            {"user": {"email": "new@example.com"}, "device": {"type": "othr"}},
+            {
+                "user": {"email": self.user.email},
+                "device": {
+                    "type": "mobi",
+                    "vendor_uuid": "20354d7a-e4fe-47af-8ff6-187bca92f3f9",
+                },
+            },
+            {"user": {"email": self.user.email}, "device": {"type": "mobi"}},
+            {"user": {"email": "new@example.com"}, "device": {"type": "othr"}},
+        ]
+        response = self.client.post(
+            "/session/batch/", data, content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(
+            [result["status"] for result in results], [200, 201, 201, 400, 200]
+        )
+        self.assertEqual(results[0]["session"]["uuid"], str(self.session))
+        self.assertTrue(results[1]["session"]["is_new_user"])
+        self.assertEqual(results[1]["session"], results[4]["session"])
+        self.assertFalse(results[2]["session"]["is_new_user"])
+        self.assertTrue(results[2]["session"]["is_new_device"])
+        self.assertEqual(
+            results[2]["session"]["device"]["vendor_uuid"],
+            "20354d7a-e4fe-47af-8ff6-187bca92f3f9",
+        )
+        self.assertEqual(Session.objects.count(), 3)
+
+    def test_post_batch__constant_queries(self):
+        data = [
+            {"user": {"email": f"user{i}@example.com"}, "device": {"type": "othr"}}
+            for i in range(50)
+        ]
+        data.append({"user": {"email": self.user.email}, "device": {"type": "othr"}})
+
+        # One more to issue a new token to the reused session
+        with self.assertNumQueries(12):
+            response = self.client.post(
+                "/session/batch/", data, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Session.objects.count(), 51)
+
+    def test_post_batch__invalid_data(self):
+        response = self.client.post(
+            "/session/batch/",
+            {"user": {"email": self.user.email}},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class CreateSessionQueriesTestCase(TestCase):
+    def setUp(self):
+        self.data = {"user": {"email": "test@example.com"}, "device": {"type": "othr"}}
+
+    def test_post_session__queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                "/session/", self.data, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.json()["is_new_user"])
+        self.assertTrue(response.json()["is_new_device"])
+
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                "/session/", self.data, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SESSION_UPSERT_FAST_PATH=False)
+    def test_post_session__orm_path(self):
+        response = self.client.post("/session/", self.data, content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+
+        # User, device, alive session and new token, nothing lazy loaded
+        with self.assertNumQueries(4):
+            response = self.client.post(
+                "/session/", self.data, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Device.objects.count(), 1)
+
+
+class ConfirmSessionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.session = Session.objects.create(
+            user=self.user, device=self.device, otp_code="123456"
+        )
+        self.auth_header = {"HTTP_AUTHORIZATION": f"Bearer {self.session.token}"}
+
+    def patch_session(self, otp_code):
+        return self.client.patch(
+            f"/session/{self.session}/",
+            {"otp_code": otp_code},
+            content_type="application/json",
+            **self.auth_header,
+        )
+
+    def test_patch_session__expires_at(self):
+        response = self.patch_session("123456")
+
+        self.assertEqual(response.status_code, 200)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.status, "confirmed")
+        self.assertEqual(
+            self.session.expires_at,
+            self.session.created_at + datetime.timedelta(hours=2),
+        )
+
+    def test_patch_session__already_confirmed(self):
+        self.patch_session("123456")
+        response = self.patch_session("123456")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "confirmed")
+
+    def test_patch_session__expired_status(self):
+        self.session.status = "expired"
+        self.session.save()
+        response = self.patch_session("123456")
+
+        self.assertEqual(response.status_code, 401)
+
+    def test_patch_session__integer_otp_code(self):
+        response = self.patch_session(123456)
+
+        self.assertEqual(response.status_code, 400)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.status, "pending")
+
+
+@override_settings(SESSION_LISTING={"PAGE_SIZE": 2, "MAX_PAGE_SIZE": 10})
+class ListSessionsViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com")
+        self.device = Device.objects.create(user=self.user, type="othr")
+        self.other_device = Device.objects.create(
+            user=self.user,
+            type="mobi",
+            vendor_uuid="20354d7a-e4fe-47af-8ff6-187bca92f3f9",
+        )
+        created_at = timezone.make_aware(datetime.datetime(2023, 12, 19))
+        # Two sessions share a created_at, the uuid breaks the tie
+        self.sessions = [
+            Session.objects.create(
+                user=self.user,
+                device=self.device if i % 2 else self.other_device,
+                created_at=created_at + datetime.timedelta(minutes=min(i, 3)),
+            )
+            for i in range(5)
+        ]
+        self.session = Session.objects.create(user=self.user, device=self.device)
+        self.auth_header = {"HTTP_AUTHORIZATION": f"Bearer {self.session.token}"}
+
+    def list_all(self, url):
+        uuids = []
+        cursor = None
+        while True:
+            params = {"cursor": cursor} if cursor else {}
+            response = self.client.get(url, params, **self.auth_header)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), 2)
+            uuids.extend(session["uuid"] for session in page["results"])
+            cursor = page["next"]
+            if cursor is None:
+                return uuids
+
+    def expected(self, sessions):
+        ordered = sorted(
+            sessions, key=lambda session: (session.created_at, session.uuid)
+        )
+        return [f"ses-{session.uuid}" for session in reversed(ordered)]
+
+    def test_list_user_sessions(self):
+        uuids = self.list_all(f"/user/usr-{self.user.uuid}/sessions/")
+
+        self.assertEqual(uuids, self.expected([*self.sessions, self.session]))
+
+    def test_list_device_sessions(self):
+        uuids = self.list_all(f"/device/dev-{self.device.uuid}/sessions/")
+
+        self.assertEqual(
+            uuids,
+            self.expected(
+                [s for s in [*self.sessions, self.session] if s.device == self.device]
+            ),
+        )
+
+    def test_list_sessions__serialized_without_queries_per_row(self):
+        # The token lookup and the page
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f"/user/usr-{self.user.uuid}/sessions/",
+                {"limit": 10},
+                **self.auth_header,
+            )
+
+        session = response.json()["results"][0]
+        self.assertNotIn("token", session)
+        self.assertEqual(session["user"]["email"], "test@example.com")
+        self.assertEqual(session["device"]["type"], "othr")
+
+    def test_list_sessions__other_user(self):
+        other = User.objects.create(email="other@example.com")
+
+        response = self.client.get(
+            f"/user/usr-{other.uuid}/sessions/", **self.auth_header
+        )
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_sessions__invalid_cursor(self):
+        response = self.client.get(
+            f"/user/usr-{self.user.uuid}/sessions/",
+            {"cursor": "nope"},
+            **self.auth_header,
+        )
+
+        self.assertEqual(response.status_code, 400)
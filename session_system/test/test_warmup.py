@@ -0,0 +1,23 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from technical_test.warmup import log_cache_checks, warm_up
+
+
+class WarmUpTestCase(TestCase):
+    def test_warm_up(self):
+        with self.assertNumQueries(1):
+            warm_up()
+        self.assertIsNotNone(connection.connection)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "sessions": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        }
+    )
+    def test_log_cache_checks(self):
+        with self.assertLogs("technical_test.warmup", "WARNING") as logs:
+            log_cache_checks()
+
+        self.assertIn("session_system.W002", logs.output[0])
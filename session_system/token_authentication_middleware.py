@@ -1,34 +1,258 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import DEFAULT_DB_ALIAS
 from django.http import JsonResponse
-from django.urls import resolve
-from .models import Session
+from .db_router import (
+    current_routing,
+    is_pinned,
+    is_token_pinned,
+    is_user_pinned,
+    replica_aliases,
+    start_routing,
+    use_primary,
+)
+from .metrics import with_outcome
+from .models import Session, hash_token
+from .revocation import current_generation, remember_generations
+from .session_store import session_store, session_record
+from .sharding import is_sharded, route_to_shard, shard_for_token
+from .token_cache import token_cache, SessionRecord, SESSION_RECORD_FIELDS
 import logging
 
 
-def token_auth(view_func):
-    view_func.token_auth = True
-    return view_func
+# A session record followed by the current generations of its user and device
+SESSION_ROW_FIELDS = [
+    *SESSION_RECORD_FIELDS,
+    "user__session_generation",
+    "device__session_generation",
+]
+
+def row_generations(row):
+    """(user_id, device_id, user generation, device generation) of a row"""
+    session = SessionRecord(*row[:-2])
+    return session.user_id, session.device_id, *row[-2:]
+
+
+# Sessions whose user or device was revoked since they were cached
+REVOKED = object()
+# Sessions ahead of the cached counters of their user and device, left behind
+# by a revocation made in another process
+STALE = object()
+
+
+# Authentication policies of the views, AUTH_NONE when not decorated
+AUTH_REQUIRED = "required"  # a valid bearer token, 401 otherwise
+AUTH_OPTIONAL = "optional"  # a valid bearer token when one is given
+AUTH_NONE = "none"  # the token middleware doesn't look at the request
+
+
+def auth_policy(policy):
+    def decorator(view_func):
+        view_func.auth_policy = policy
+        return view_func
+
+    return decorator
+
+
+token_auth = auth_policy(AUTH_REQUIRED)
+optional_token_auth = auth_policy(AUTH_OPTIONAL)
 
 
 logger = logging.getLogger(__name__)
 
 class TokenAuthenticationMiddleware:
+    """
+    Authenticate the bearer token of the views decorated with token_auth or
+    optional_token_auth. The check runs in process_view, on the view Django
+    resolved for the dispatch, so the URL is resolved once per request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.replicated = bool(replica_aliases())
+        self.sharded = is_sharded()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+            # Awaited by Django without a hop to a thread
+            self.process_view = self.aprocess_view
 
     def __call__(self, request):
-        # Check if the view is marked to bypass token authentication
-        view = resolve(request.path_info).func
-        if not getattr(view, "token_auth", False):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        routing_token = start_routing()
+        try:
             return self.get_response(request)
+        finally:
+            current_routing.reset(routing_token)
 
+    async def __acall__(self, request):
+        routing_token = start_routing()
+        try:
+            return await self.get_response(request)
+        finally:
+            current_routing.reset(routing_token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        policy = getattr(view_func, "auth_policy", AUTH_NONE)
+        if policy == AUTH_NONE:
+            return None
+        token = self.get_token(request)
+        if token is None and policy == AUTH_OPTIONAL:
+            request.session = request.session_token = None
+            return None
+        if token and self.sharded:
+            route_to_shard(shard_for_token(token))
+
+        session = token and self.get_session(token)
+        return self.authenticate(request, token, session)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        policy = getattr(view_func, "auth_policy", AUTH_NONE)
+        if policy == AUTH_NONE:
+            return None
+        token = self.get_token(request)
+        if token is None and policy == AUTH_OPTIONAL:
+            request.session = request.session_token = None
+            return None
+        if token and self.sharded:
+            route_to_shard(shard_for_token(token))
+
+        session = token and await self.aget_session(token)
+        return self.authenticate(request, token, session)
+
+    def authenticate(self, request, token, session):
+        """Let the view run with the session of the token, 401 when invalid"""
+        if session and session.user_id:
+            request.session = session
+            request.session_token = token
+            return None
+        return self.unauthorized()
+
+    def get_token(self, request):
+        """
+        Return the bearer token of the request, None when it has no
+        Authorization header and "" when the header is malformed.
+        """
         authorization_header = request.headers.get("Authorization")
-        if authorization_header:
-            # Split the header to extract the token
-            parts = authorization_header.split()
-            if len(parts) == 2 and parts[0] == "Bearer":
-                token = parts[1]
-                session = Session.objects.filter(token=token).first()
-                if session and session.user:
-                    request.session = session
-                    return self.get_response(request)
-        return JsonResponse({"error": "Unauthorized"}, status=401)
+        if authorization_header is None:
+            return None
+        # Split the header to extract the token
+        parts = authorization_header.split()
+        if len(parts) == 2 and parts[0] == "Bearer":
+            return parts[1]
+        return ""
+
+    def unauthorized(self):
+        return with_outcome(
+            JsonResponse({"error": "Unauthorized"}, status=401), "unauthorized"
+        )
+
+    def get_stored_session(self, token_hash):
+        if not session_store.enabled:
+            return None
+        state = session_store.get(token_hash)
+        if state is None:
+            return None
+        session = session_record(state)
+        token_cache.set(token_hash, session)
+        return session
+
+    def pin_reads(self, token_hash, session=None):
+        """Read from the primary what was written in the last seconds"""
+        if not self.replicated:
+            return
+        if session is None:
+            if is_token_pinned(token_hash):
+                use_primary()
+        elif is_user_pinned(session.user_id):
+            use_primary()
+
+    def get_session(self, token):
+        token_hash = hash_token(token)
+        self.pin_reads(token_hash)
+        session = token_cache.get(token_hash) or self.get_stored_session(token_hash)
+        stale = False
+        if session is not None:
+            generation = current_generation(session.user_id, session.device_id)
+            session = self.check_generation(session, generation)
+            if session is REVOKED:
+                return None
+            stale = session is STALE
+        if session is None or stale:
+            sessions = Session.objects.filter(token_hash=token_hash).values_list(
+                *SESSION_ROW_FIELDS
+            )
+            row = sessions.first()
+            if row is None and self.replicated and not is_pinned():
+                # The session may not have reached the replica yet
+                row = sessions.using(DEFAULT_DB_ALIAS).first()
+            session = self.cache_session(token_hash, row)
+            if row is not None:
+                remember_generations(*row_generations(row), refresh=stale)
+        if session is not None:
+            self.pin_reads(token_hash, session)
+        return session
+
+    async def aget_session(self, token):
+        token_hash = hash_token(token)
+        if self.replicated:
+            await sync_to_async(self.pin_reads)(token_hash)
+        session = token_cache.get(token_hash)
+        stale = False
+        if session is None and session_store.enabled:
+            session = await sync_to_async(self.get_stored_session)(token_hash)
+        if session is not None:
+            generation = await sync_to_async(current_generation)(
+                session.user_id, session.device_id
+            )
+            session = self.check_generation(session, generation)
+            if session is REVOKED:
+                return None
+            stale = session is STALE
+        if session is None or stale:
+            sessions = Session.objects.filter(token_hash=token_hash).values_list(
+                *SESSION_ROW_FIELDS
+            )
+            row = await sessions.afirst()
+            if row is None and self.replicated and not is_pinned():
+                # The session may not have reached the replica yet
+                row = await sessions.using(DEFAULT_DB_ALIAS).afirst()
+            session = self.cache_session(token_hash, row)
+            if row is not None:
+                await sync_to_async(remember_generations)(
+                    *row_generations(row), refresh=stale
+                )
+        if session is not None and self.replicated:
+            await sync_to_async(self.pin_reads)(token_hash, session)
+        return session
+
+    def check_generation(self, session, generation):
+        """
+        Return a cached session, None to read it from the database when the
+        current generation isn't known, REVOKED when the session is behind it
+        and STALE when ahead of it.
+        """
+        if generation is None or session.generation is None:
+            return None
+        if session.generation < generation:
+            return REVOKED
+        if session.generation > generation:
+            return STALE
+        return session
+
+    def cache_session(self, token_hash, row):
+        """
+        Cache the SessionRecord of a row of SESSION_ROW_FIELDS, return it
+        unless revoked
+        """
+        if not row:
+            return None
+        *values, user_generation, device_generation = row
+        session = SessionRecord(*values)
+        token_cache.set(token_hash, session)
+        if session.generation != user_generation + device_generation:
+            return None
+        return session
@@ -0,0 +1,90 @@
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+import threading
+import time
+
+
+# Lightweight view of a Session row, enough to authenticate a request
+SessionRecord = namedtuple(
+    "SessionRecord",
+    [
+        "uuid",
+        "user_id",
+        "status",
+        "created_at",
+        "expires_at",
+        "device_id",
+        "generation",
+    ],
+)
+
+SESSION_RECORD_FIELDS = SessionRecord._fields
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of token digest -> SessionRecord where entries live at
+    most `ttl` seconds (also holds the serialized responses of
+    response_cache). The cache is local to the process, entries are dropped by
+    Session.save when the row changes so only bulk updates can be served stale
+    and only until the entry expires.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                record, stored_at = entry
+                if self.clock() - stored_at < self.ttl:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return record
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def set(self, token, record):
+        with self._lock:
+            self._entries[token] = (record, self.clock())
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+def build_token_cache():
+    options = getattr(settings, "SESSION_TOKEN_CACHE", {})
+    return TokenCache(
+        max_size=options.get("MAX_SIZE", 10000),
+        ttl=options.get("TTL", 60),
+    )
+
+
+token_cache = build_token_cache()
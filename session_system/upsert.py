@@ -0,0 +1,159 @@
+"""
+Fast path of create_session on Postgres: the user and device are upserted and
+the alive session looked up and given a new token in a single statement, a
+new session costs one more INSERT.
+"""
+from django.db import connections, router
+from django.utils import timezone
+import uuid
+
+from .models import (
+    User,
+    Device,
+    Session,
+    CONFIRMED_SESSION_LIFETIME,
+    DEVICE_TYPE_CODES,
+    STATUS_CODES,
+    from_db_row,
+    generate_token,
+    hash_token,
+)
+from .session_store import forget_token
+
+
+SESSION_FIELDS = [field.attname for field in Session._meta.concrete_fields]
+
+RESOLVE_SESSION_SQL = """
+WITH new_user AS (
+    INSERT INTO {user} (uuid, email) VALUES (%(user_uuid)s, %(email)s)
+    ON CONFLICT (email) DO NOTHING
+    RETURNING uuid, session_generation
+), usr AS (
+    SELECT uuid, session_generation, true AS created FROM new_user
+    UNION ALL
+    SELECT uuid, session_generation, false FROM {user} WHERE email = %(email)s
+), new_device AS (
+    INSERT INTO {device} (uuid, user_id, type, vendor_uuid)
+    SELECT %(device_uuid)s, usr.uuid, %(type)s, %(vendor_uuid)s::uuid FROM usr
+    ON CONFLICT ON CONSTRAINT device_user_type_vendor_uniq DO NOTHING
+    RETURNING uuid, vendor_uuid, session_generation
+), dev AS (
+    SELECT uuid, vendor_uuid, session_generation, true AS created FROM new_device
+    UNION ALL
+    SELECT device.uuid, device.vendor_uuid, device.session_generation, false
+    FROM {device} device, usr
+    WHERE device.user_id = usr.uuid AND device.type = %(type)s
+    AND (device.vendor_uuid = %(vendor_uuid)s::uuid
+         OR (device.vendor_uuid IS NULL AND %(vendor_uuid)s IS NULL))
+), stale AS (
+    UPDATE {session} SET status = {expired}
+    WHERE user_id = (SELECT uuid FROM usr) AND device_id = (SELECT uuid FROM dev)
+    AND status <> {expired} AND expires_at <= %(now)s
+    RETURNING token_hash
+), latest AS (
+    SELECT session.uuid, session.created_at, session.token_hash
+    FROM {session} session
+    WHERE session.user_id = (SELECT uuid FROM usr)
+    AND session.device_id = (SELECT uuid FROM dev)
+    AND session.status <> {expired}
+    AND (session.expires_at IS NULL OR session.expires_at > %(now)s)
+    AND (%(type)s = {mobi} OR session.created_at > %(alive_since)s)
+    -- Not revoked
+    AND session.generation = (SELECT session_generation FROM usr)
+        + (SELECT session_generation FROM dev)
+    ORDER BY session.created_at DESC
+    LIMIT 1
+), alive AS (
+    -- Only the digest of the current token is known, issue a new one
+    UPDATE {session} session SET token_hash = %(token_hash)s FROM latest
+    WHERE session.uuid = latest.uuid AND session.created_at = latest.created_at
+    RETURNING {session_fields}, latest.token_hash AS previous_token_hash
+)
+SELECT usr.uuid, usr.session_generation, usr.created, dev.uuid, dev.vendor_uuid,
+    dev.session_generation, dev.created, {alive_fields}, alive.previous_token_hash,
+    ARRAY(SELECT token_hash FROM stale) AS stale_token_hashes
+FROM usr CROSS JOIN dev LEFT JOIN alive ON true
+"""
+
+
+def get_or_create_session(user_email, device_type, device_vendor):
+    """
+    Return a (session, created) tuple with the user and device of the session
+    already loaded, or None when a concurrent transaction created the user or
+    the device first and the caller should take the ORM path.
+    """
+    using = router.db_for_write(Session)
+    now = timezone.now()
+    # Token of the session, reused or created
+    token = generate_token(user_email)
+    sql = RESOLVE_SESSION_SQL.format(
+        user=User._meta.db_table,
+        device=Device._meta.db_table,
+        session=Session._meta.db_table,
+        session_fields=", ".join(f"session.{field}" for field in SESSION_FIELDS),
+        alive_fields=", ".join(f"alive.{field}" for field in SESSION_FIELDS),
+        expired=STATUS_CODES["expired"],
+        mobi=DEVICE_TYPE_CODES["mobi"],
+    )
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            sql,
+            {
+                "user_uuid": uuid.uuid4(),
+                "email": user_email,
+                "device_uuid": uuid.uuid4(),
+                "type": DEVICE_TYPE_CODES[device_type],
+                "vendor_uuid": device_vendor,
+                "now": now,
+                "alive_since": now - CONFIRMED_SESSION_LIFETIME,
+                "token_hash": hash_token(token),
+            },
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+
+    (
+        user_uuid,
+        user_generation,
+        user_created,
+        device_uuid,
+        device_vendor,
+        device_generation,
+        device_created,
+        *session_values,
+        previous_token_hash,
+        stale_token_hashes,
+    ) = row
+    # Expired by the statement, stop serving them from the caches
+    for token_hash in stale_token_hashes:
+        if token_hash is not None:
+            forget_token(bytes(token_hash))
+    user = User.from_db(
+        using,
+        ["uuid", "email", "session_generation"],
+        [user_uuid, user_email, user_generation],
+    )
+    device = Device.from_db(
+        using,
+        ["uuid", "user_id", "vendor_uuid", "type", "session_generation"],
+        [device_uuid, user_uuid, device_vendor, device_type, device_generation],
+    )
+    device.user = user
+    if session_values[0] is not None:
+        forget_token(bytes(previous_token_hash))
+        session = from_db_row(Session, using, SESSION_FIELDS, session_values)
+        session.token = token
+        session.user = user
+        session.device = device
+        return session, False
+
+    session = Session(
+        user=user,
+        device=device,
+        is_new_user=user_created,
+        is_new_device=device_created,
+    )
+    session.set_token(token)
+    session.save(force_insert=True, using=using)
+    return session, True
@@ -1,9 +1,16 @@
 # login_system/urls.py
 from django.urls import path
-from . import views
+from . import metrics, views
 
 urlpatterns = [
     # Define your URL patterns here
     path('session/', views.create_session, name='session-create'),
+    path('session/batch/', views.create_sessions_batch, name='session-batch-create'),
+    path('session/export/', views.export_sessions, name='session-export'),
     path('session/<str:prefixed_uuid>/', views.update_session, name='update-session'),
+    path('user/<str:prefixed_uuid>/sessions/', views.list_user_sessions, name='user-sessions'),
+    path('device/<str:prefixed_uuid>/sessions/', views.list_device_sessions, name='device-sessions'),
+    path('user/<str:prefixed_uuid>/sessions/revoke/', views.revoke_user_sessions, name='user-sessions-revoke'),
+    path('device/<str:prefixed_uuid>/sessions/revoke/', views.revoke_device_sessions, name='device-sessions-revoke'),
+    path('metrics', metrics.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,21 +1,60 @@
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
-from datetime import timedelta
+from datetime import datetime, timedelta
+import base64
+import binascii
 import json
 import logging
+import uuid
 
 from session_system.token_authentication_middleware import token_auth
-from .models import User, Device, Session, deconstruct_uuid
+from . import export, revocation, upsert
+from .confirmation import confirm_session
+from .export import EXPORT_FORMATS, parse_bound, parse_statuses
+from .idempotency import idempotent
+from .metrics import with_outcome
+from .response_cache import dumps, session_body
+from .revocation import remember_generations
+from .session_store import (
+    expire_stale_sessions,
+    forget_token,
+    session_store,
+    session_state,
+)
+from .sharding import route_to_shard, shard_for_email, use_shard
+from .models import (
+    User,
+    Device,
+    Session,
+    CONFIRMED_SESSION_LIFETIME,
+    DEVICE_TYPE_CODES,
+    deconstruct_uuid,
+    hash_token,
+)
 
 
 logger = logging.getLogger(__name__)
 
+# What session_serializer reads, for the listings
+SESSION_LISTING_FIELDS = [
+    "uuid",
+    "created_at",
+    "status",
+    "flags",
+    "user__email",
+    "device__type",
+    "device__vendor_uuid",
+]
+
 
 def session_serializer(session):
     device_data = {
-        "uuid": str(session.device),
+        "uuid": f"dev-{session.device_id}",
         "type": session.device.type,
     }
 
@@ -24,63 +63,166 @@ def session_serializer(session):
         device_data["vendor_uuid"] = str(session.device.vendor_uuid)
 
     return {
-        "uuid": str(session),
+        "uuid": f"ses-{session.uuid}",
         "token": session.token,
         "status": session.status,
         "is_new_user": session.is_new_user,
         "is_new_device": session.is_new_device,
         "user": {
-            "uuid": str(session.user),
+            "uuid": f"usr-{session.user_id}",
             "email": session.user.email,
         },
         "device": device_data,
     }
 
 
+def session_response(session, status=200):
+    return HttpResponse(
+        session_body(session, session_serializer),
+        status=status,
+        content_type="application/json",
+    )
+
+
+def log_otp_code(session):
+    # Sampled with LOG_SAMPLING_RATES["otp_code"]
+    logger.info("OTP CODE: %s", session.otp_code, extra={"event": "otp_code"})
+
+
+def store_session(session):
+    """Put the state of a session in the session store when it is enabled"""
+    if session_store.enabled:
+        # Only the digest of the token is stored
+        data = {**session_serializer(session), "token": None}
+        session_store.put(session.token_hash, session_state(session, data))
+        # Lets the token middleware check the state is not revoked
+        remember_generations(
+            session.user_id,
+            session.device_id,
+            session.user.session_generation,
+            session.device.session_generation,
+        )
+
+
+def update_stored_session(token, uuid, otp_code):
+    """
+    update_session served from the session store, None when the session isn't
+    stored.
+    """
+    if not session_store.enabled:
+        return None
+    state = session_store.get(hash_token(token))
+    if state is None or str(state.uuid) != uuid:
+        return None
+
+    if state.status == "expired" or is_created_after(state.created_at, minutes=5):
+        if state.status != "expired":
+            session_store.transition(token, state, "expired")
+        return with_outcome(
+            JsonResponse({"error": "Session expired"}, status=401), "expired"
+        )
+    if state.otp_code != otp_code:
+        return with_outcome(
+            JsonResponse({"error": "Invalid OTP code"}, status=400), "otp_mismatch"
+        )
+    if state.status == "pending":
+        state = session_store.transition(token, state, "confirmed")
+    return with_outcome(
+        HttpResponse(
+            dumps({**state.data, "token": token, "status": state.status}),
+            status=200,
+            content_type="application/json",
+        ),
+        "confirmed",
+    )
+
+
+def parse_session_data(data):
+    user_email = data.get("user", {}).get("email")
+    device_type = data.get("device", {}).get("type")
+    device_vendor = data.get("device", {}).get("vendor_uuid")
+
+    if (
+        not user_email
+        or device_type not in DEVICE_TYPE_CODES
+        or (device_type == "mobi" and not device_vendor)
+    ):
+        raise ValueError("Invalid data")
+    return user_email, device_type, device_vendor
+
+
 def is_created_after(date, **kwargs):
     return timezone.now() - date > timedelta(**kwargs)
 
 
 def get_alive_session(user, device):
-    session = Session.objects.filter(user=user, device=device).latest("created_at")
-    if session.status == "expired":
-        raise Session.DoesNotExist
-    if device.type == "mobi":
-        return session
-    if is_created_after(session.created_at, hours=2) or (
-        session.status == "pending" and is_created_after(session.created_at, minutes=5)
-    ):
-        session.status = "expired"
-        session.save()
-        raise Session.DoesNotExist
+    now = timezone.now()
+    sessions = Session.objects.filter(user=user, device=device).exclude(
+        status="expired"
+    )
+    alive_sessions = sessions.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        generation=user.session_generation + device.session_generation,
+    )
+    if device.type != "mobi":
+        # Lets Postgres prune the partitions that can't hold an alive session
+        alive_sessions = alive_sessions.filter(
+            created_at__gt=now - CONFIRMED_SESSION_LIFETIME
+        )
+    try:
+        session = alive_sessions.latest("created_at")
+    except Session.DoesNotExist:
+        # Flag the stale sessions left behind in a single statement
+        expire_stale_sessions([device.uuid], now)
+        raise
+    # Spares set_token() and the serializer lazy loading them
+    session.user = user
+    session.device = device
     return session
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@idempotent
 def create_session(request, *args, **kwargs):
     try:
         data = json.loads(request.body)
-        user_email = data.get("user", {}).get("email")
-        device_type = data.get("device", {}).get("type")
-        device_vendor = data.get("device", {}).get("vendor_uuid")
-
-        if (
-            not user_email
-            or not device_type
-            or (device_type == "mobi" and not device_vendor)
-        ):
+        try:
+            user_email, device_type, device_vendor = parse_session_data(data)
+        except ValueError:
             return JsonResponse({"error": "Invalid data"}, status=400)
+        route_to_shard(shard_for_email(user_email))
+        if settings.SESSION_UPSERT_FAST_PATH:
+            result = upsert.get_or_create_session(
+                user_email, device_type, device_vendor
+            )
+            if result is not None:
+                session, created = result
+                store_session(session)
+                log_otp_code(session)
+                return with_outcome(
+                    session_response(session, status=201 if created else 200),
+                    "created" if created else "reused",
+                )
+
         user, user_created = User.objects.get_or_create(email=user_email)
         device, device_created = Device.objects.get_or_create(
             user=user, type=device_type, vendor_uuid=device_vendor
         )
 
-        # Create a new Session
+        # Create a new Session, a brand new device has no session to reuse
         try:
+            if device_created:
+                raise Session.DoesNotExist
             session = get_alive_session(user, device)
-            logger.info(f"OTP CODE: {session.otp_code}")
-            return JsonResponse(session_serializer(session), status=200)
+            # Only the digest of the current token is known, issue a new one
+            session.set_token()
+            session.save(update_fields=["token_hash"])
+            store_session(session)
+            log_otp_code(session)
+            return with_outcome(
+                session_response(session, status=200), "reused"
+            )
         except Session.DoesNotExist:
             session = Session.objects.create(
                 user=user,
@@ -88,12 +230,174 @@ def create_session(request, *args, **kwargs):
                 is_new_user=user_created,
                 is_new_device=device_created,
             )
-            logger.info(f"OTP CODE: {session.otp_code}")
-            return JsonResponse(session_serializer(session), status=201)
+            store_session(session)
+            log_otp_code(session)
+            return with_outcome(
+                session_response(session, status=201), "created"
+            )
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
 
 
+def get_or_create_sessions(payloads):
+    """
+    Set-based equivalent of create_session for a list of
+    (user_email, device_type, device_vendor) payloads.
+
+    Return a (session, status) tuple per payload, status being 200 when an
+    alive session is reused and 201 when a new one is created. The number of
+    queries doesn't depend on the number of payloads.
+    """
+    # Users
+    emails = {email for email, _, _ in payloads}
+    users = {user.email: user for user in User.objects.filter(email__in=emails)}
+    new_users = [User(email=email) for email in emails - users.keys()]
+    if new_users:
+        # Users created concurrently are skipped here and fetched below
+        User.objects.bulk_create(new_users, ignore_conflicts=True)
+        new_user_uuids = {user.uuid for user in new_users}
+        users.update(
+            (user.email, user)
+            for user in User.objects.filter(email__in=[u.email for u in new_users])
+        )
+    else:
+        new_user_uuids = set()
+
+    # Devices
+    def device_key(user, device_type, device_vendor):
+        return user.uuid, device_type, device_vendor and str(device_vendor)
+
+    devices = {}
+    for device in Device.objects.filter(user__in=users.values()).select_related(
+        "user"
+    ):
+        devices.setdefault(
+            device_key(device.user, device.type, device.vendor_uuid), device
+        )
+    new_devices = {}
+    for email, device_type, device_vendor in payloads:
+        key = device_key(users[email], device_type, device_vendor)
+        if key not in devices and key not in new_devices:
+            new_devices[key] = Device(
+                user=users[email], type=device_type, vendor_uuid=device_vendor
+            )
+    if new_devices:
+        # Devices created concurrently are skipped here and fetched below
+        Device.objects.bulk_create(new_devices.values(), ignore_conflicts=True)
+        new_device_uuids = {device.uuid for device in new_devices.values()}
+        for device in Device.objects.filter(
+            user__in={device.user for device in new_devices.values()}
+        ).select_related("user"):
+            key = device_key(device.user, device.type, device.vendor_uuid)
+            if key in new_devices:
+                devices[key] = device
+        new_devices = {
+            key: device
+            for key, device in new_devices.items()
+            if devices[key].uuid in new_device_uuids
+        }
+
+    # Alive sessions of the devices that already existed
+    now = timezone.now()
+    old_devices = [device for key, device in devices.items() if key not in new_devices]
+    sessions = {}
+    if old_devices:
+        alive_sessions = (
+            Session.objects.filter(device__in=old_devices)
+            .exclude(status="expired")
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+            .filter(
+                generation=F("user__session_generation")
+                + F("device__session_generation")
+            )
+            .order_by("user", "device", "-created_at")
+            .distinct("user", "device")
+        )
+        sessions = {
+            (session.user_id, session.device_id): session
+            for session in alive_sessions
+        }
+        # Flag the stale sessions left behind in a single statement
+        expire_stale_sessions([device.uuid for device in old_devices], now)
+
+    # New sessions for the devices without an alive one
+    results = []
+    new_sessions = []
+    reused_sessions = []
+    for email, device_type, device_vendor in payloads:
+        user = users[email]
+        device = devices[device_key(user, device_type, device_vendor)]
+        session = sessions.get((user.uuid, device.uuid))
+        if session is None:
+            session = Session(
+                user=user,
+                device=device,
+                is_new_user=user.uuid in new_user_uuids,
+                is_new_device=device_key(user, device_type, device_vendor)
+                in new_devices,
+            )
+            session.fill_generated_fields()
+            sessions[(user.uuid, device.uuid)] = session
+            new_sessions.append(session)
+            results.append((session, 201))
+        else:
+            session.user = user
+            session.device = device
+            if session.token is None:
+                # Only the digest of the current token is known, issue a new one
+                forget_token(bytes(session.token_hash))
+                session.set_token()
+                reused_sessions.append(session)
+            results.append((session, 200))
+    Session.objects.bulk_create(new_sessions)
+    Session.objects.bulk_update(reused_sessions, ["token_hash"])
+    return results
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def create_sessions_batch(request, *args, **kwargs):
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not isinstance(data, list) or len(data) > settings.SESSION_BATCH_MAX_SIZE:
+        return JsonResponse({"error": "Invalid data"}, status=400)
+
+    payloads = []
+    for item in data:
+        try:
+            user_email, device_type, device_vendor = parse_session_data(item)
+            if device_vendor:
+                device_vendor = uuid.UUID(device_vendor)
+        except (AttributeError, TypeError, ValueError):
+            payloads.append(None)
+        else:
+            payloads.append((user_email, device_type, device_vendor))
+
+    # One transaction per shard
+    shard_payloads = {}
+    for payload in payloads:
+        if payload is not None:
+            shard_payloads.setdefault(shard_for_email(payload[0]), []).append(payload)
+    sessions = {}
+    for shard, items in shard_payloads.items():
+        with use_shard(shard), transaction.atomic(using=shard):
+            sessions[shard] = iter(get_or_create_sessions(items))
+
+    results = []
+    for payload in payloads:
+        if payload is None:
+            results.append({"status": 400, "error": "Invalid data"})
+            continue
+        session, status = next(sessions[shard_for_email(payload[0])])
+        log_otp_code(session)
+        results.append({"status": status, "session": session_serializer(session)})
+    return HttpResponse(
+        dumps({"results": results}), status=200, content_type="application/json"
+    )
+
+
 @csrf_exempt
 @require_http_methods(["PATCH", "PUT"])
 @token_auth
@@ -102,26 +406,211 @@ def update_session(request, prefixed_uuid):
         data = json.loads(request.body)
         otp_code = data.get("otp_code")
         _, uuid = deconstruct_uuid(prefixed_uuid)
-        session = Session.objects.get(uuid=uuid)
 
-        if request.session != session:
-          raise Session.DoesNotExist
+        # The authenticated session is the only one the token can update
+        if str(request.session.uuid) != uuid:
+            raise Session.DoesNotExist
+
+        response = update_stored_session(request.session_token, uuid, otp_code)
+        if response is not None:
+            return response
+
+        if isinstance(otp_code, str):
+            session = confirm_session(uuid, request.session_token, otp_code)
+            if session is not None:
+                return with_outcome(
+                    session_response(session, status=200), "confirmed"
+                )
+
+        # Nothing confirmed, find out why
+        session = Session.objects.select_related("user", "device").get(uuid=uuid)
+        session.token = request.session_token
 
         # Check if the request is made within 5 minutes of session creation
-        if is_created_after(session.created_at, minutes=5):
-            session.status = "expired"
-            session.save()
-            return JsonResponse({"error": "Session expired"}, status=401)
+        if session.status == "expired" or is_created_after(
+            session.created_at, minutes=5
+        ):
+            if session.status != "expired":
+                session.status = "expired"
+                session.save(update_fields=["status", "expires_at"])
+            return with_outcome(
+                JsonResponse({"error": "Session expired"}, status=401), "expired"
+            )
 
         # Verify OTP code
         if session.otp_code == otp_code:
-            session.status = "confirmed"
-            session.save()
-            return JsonResponse(session_serializer(session), status=200)
+            # Already confirmed by a previous request
+            return with_outcome(
+                session_response(session, status=200), "confirmed"
+            )
         else:
-            return JsonResponse({"error": "Invalid OTP code"}, status=400)
+            return with_outcome(
+                JsonResponse({"error": "Invalid OTP code"}, status=400), "otp_mismatch"
+            )
 
     except Session.DoesNotExist:
-        return JsonResponse({"error": "Session not found"}, status=404)
+        return with_outcome(
+            JsonResponse({"error": "Session not found"}, status=404), "not_found"
+        )
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+
+@require_http_methods(["GET"])
+def export_sessions(request):
+    """
+    Stream the sessions as NDJSON (?format=ndjson) or CSV (?format=csv),
+    filtered by ?created_after, ?created_before and ?status. Staff only, and
+    only when SESSION_EXPORT["ENDPOINT"] is set. Staff users log in through
+    the admin, so nobody is allowed without DJANGO_ADMIN=1.
+    """
+    if not settings.SESSION_EXPORT.get("ENDPOINT", False):
+        raise Http404
+    user = getattr(request, "user", None)
+    if not (user and user.is_active and user.is_staff):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    export_format = request.GET.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({"error": "Invalid format"}, status=400)
+    try:
+        filters = {
+            "created_after": parse_bound(request.GET.get("created_after")),
+            "created_before": parse_bound(request.GET.get("created_before")),
+            "statuses": parse_statuses(request.GET.get("status")),
+        }
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    response = StreamingHttpResponse(
+        export.export_sessions(export_format, **filters),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="sessions.{export_format}"'
+    )
+    return with_outcome(response, "exported")
+
+
+def encode_cursor(session):
+    """Opaque position of a session in a listing"""
+    position = f"{session.created_at.isoformat()}|{session.uuid}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the (created_at, uuid) of a cursor, raise ValueError when invalid"""
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, session_uuid = position.split("|")
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, UnicodeError, binascii.Error) as error:
+        raise ValueError(str(error))
+    return created_at, uuid.UUID(session_uuid)
+
+
+def page_size(request):
+    options = settings.SESSION_LISTING
+    try:
+        size = int(request.GET.get("limit", options["PAGE_SIZE"]))
+    except ValueError:
+        raise ValueError("Invalid limit")
+    if not 1 <= size <= options["MAX_PAGE_SIZE"]:
+        raise ValueError("Invalid limit")
+    return size
+
+
+def list_sessions(request, **filters):
+    """
+    A page of sessions, newest first, as {"results": [...], "next": cursor}.
+    The page after `?cursor` is found through the (created_at, uuid) of its
+    last session (keyset pagination), as fast as the first page.
+    """
+    try:
+        size = page_size(request)
+        cursor = request.GET.get("cursor")
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    sessions = (
+        Session.objects.filter(**filters)
+        .select_related("user", "device")
+        .only(*SESSION_LISTING_FIELDS)
+        .order_by("-created_at", "-uuid")
+    )
+    if position is not None:
+        created_at, session_uuid = position
+        sessions = sessions.filter(created_at__lte=created_at).exclude(
+            created_at=created_at, uuid__gte=session_uuid
+        )
+    sessions = list(sessions[: size + 1])
+    results = []
+    for session in sessions[:size]:
+        data = session_serializer(session)
+        # Only the digest of the tokens is known
+        del data["token"]
+        data["created_at"] = session.created_at.isoformat()
+        results.append(data)
+    next_cursor = encode_cursor(sessions[size - 1]) if len(sessions) > size else None
+    return HttpResponse(
+        dumps({"results": results, "next": next_cursor}),
+        status=200,
+        content_type="application/json",
+    )
+
+
+def parse_prefixed_uuid(prefixed_uuid, expected_prefix):
+    """Return the uuid of a prefixed uuid, None when invalid"""
+    try:
+        prefix, value = deconstruct_uuid(prefixed_uuid)
+        return uuid.UUID(value) if prefix == expected_prefix else None
+    except ValueError:
+        return None
+
+
+@require_http_methods(["GET"])
+@token_auth
+def list_user_sessions(request, prefixed_uuid):
+    """The sessions of the user of the token"""
+    user_uuid = parse_prefixed_uuid(prefixed_uuid, "usr")
+    if user_uuid is None or user_uuid != request.session.user_id:
+        return JsonResponse({"error": "User not found"}, status=404)
+    return list_sessions(request, user_id=user_uuid)
+
+
+@require_http_methods(["GET"])
+@token_auth
+def list_device_sessions(request, prefixed_uuid):
+    """The sessions of a device of the user of the token"""
+    device_uuid = parse_prefixed_uuid(prefixed_uuid, "dev")
+    if device_uuid is None:
+        return JsonResponse({"error": "Device not found"}, status=404)
+    return list_sessions(
+        request, device_id=device_uuid, user_id=request.session.user_id
+    )
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@token_auth
+def revoke_user_sessions(request, prefixed_uuid):
+    """Revoke every session of the user of the token, this one included"""
+    user_uuid = parse_prefixed_uuid(prefixed_uuid, "usr")
+    if user_uuid is None or user_uuid != request.session.user_id:
+        return JsonResponse({"error": "User not found"}, status=404)
+    revoked = revocation.revoke_user_sessions(user_uuid)
+    if revoked is None:
+        return JsonResponse({"error": "User not found"}, status=404)
+    return with_outcome(JsonResponse({"revoked": revoked}), "revoked")
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@token_auth
+def revoke_device_sessions(request, prefixed_uuid):
+    """Revoke every session of a device of the user of the token"""
+    device_uuid = parse_prefixed_uuid(prefixed_uuid, "dev")
+    revoked = device_uuid and revocation.revoke_device_sessions(
+        device_uuid, user_id=request.session.user_id
+    )
+    if revoked is None:
+        return JsonResponse({"error": "Device not found"}, status=404)
+    return with_outcome(JsonResponse({"revoked": revoked}), "revoked")
@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import json
+import os
+import sys
 from pathlib import Path
 
+from .database import database_from_env, replicas_from_env, shards_from_env
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,41 +35,111 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
+# The service is a JSON API authenticated by bearer tokens: it only needs
+# session_system. DJANGO_ADMIN=1 loads the Django admin with the apps and the
+# browser middleware (sessions, CSRF, messages...) it depends on
+ADMIN_ENABLED = os.environ.get('DJANGO_ADMIN', '0') == '1'
+
 INSTALLED_APPS = [
-    'django.contrib.admin',
-    'django.contrib.auth',
-    'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
     'session_system',
 ]
 
 MIDDLEWARE = [
+    'session_system.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
     'session_system.token_authentication_middleware.TokenAuthenticationMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if ADMIN_ENABLED:
+    INSTALLED_APPS = [
+        'django.contrib.admin',
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+        *INSTALLED_APPS,
+    ]
+
+    MIDDLEWARE = [
+        'session_system.metrics.RequestMetricsMiddleware',
+        'django.middleware.security.SecurityMiddleware',
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'session_system.token_authentication_middleware.TokenAuthenticationMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ]
+
+# Share of the records kept per high-volume `event`, see
+# session_system/structured_logging.py
+LOG_SAMPLING_RATES = {
+    'otp_code': float(os.environ.get('LOG_OTP_CODE_RATE', 1)),
+    'request': float(os.environ.get('LOG_REQUEST_RATE', 1)),
+}
+
+# manage.py test doesn't write the records (access logs, OTP codes...), they
+# still reach the loggers for assertLogs
+TESTING = sys.argv[1:2] == ['test']
+
+# Records are queued by the request threads and written by a QueueListener
+# thread, as JSON lines (LOG_FORMAT=json) or plain text
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "filters": {
+        "request_id": {
+            "()": "session_system.structured_logging.RequestIdFilter",
+        },
+        "sampling": {
+            "()": "session_system.structured_logging.SamplingFilter",
+            "rates": LOG_SAMPLING_RATES,
+        },
+    },
+    "formatters": {
+        "json": {
+            "()": "session_system.structured_logging.JsonFormatter",
+        },
+        "text": {
+            "format": "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s",
+        },
+    },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
+            "formatter": os.environ.get('LOG_FORMAT', 'json'),
+        },
+        "queue": {
+            "class": "session_system.structured_logging.QueueHandler",
+            "handlers": ["console"],
+            "listener": "session_system.structured_logging.QueueListener",
+            "filters": ["request_id", "sampling"],
         },
     },
     "root": {
-        "handlers": ["console"],
+        "handlers": [] if TESTING else ["queue"],
         "level": "INFO",
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['SESSION_STORE_CACHE_URL'],
+    }
+    if 'SESSION_STORE_CACHE_URL' in os.environ
+    else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+    },
+}
+
 ROOT_URLCONF = 'technical_test.urls'
 
 TEMPLATES = [
@@ -76,8 +151,14 @@ TEMPLATES = [
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
+                *(
+                    [
+                        'django.contrib.auth.context_processors.auth',
+                        'django.contrib.messages.context_processors.messages',
+                    ]
+                    if ADMIN_ENABLED
+                    else []
+                ),
             ],
         },
     },
@@ -89,17 +170,22 @@ WSGI_APPLICATION = 'technical_test.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Built from DATABASE_URL, DATABASE_REPLICA_URLS and DATABASE_SHARD_URLS, see
+# technical_test/database.py for the connection persistence and pooling
+# variables
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'technical_test',  # Database name
-        'USER': 'postgres',  # Database user (default)
-        'PASSWORD': 'postgres',  # The password you used earlier
-        'HOST': 'db',  # Set to Docker's IP if not running locally
-        'PORT': '5432',
-    }
+    'default': database_from_env(os.environ),
+    **replicas_from_env(os.environ),
+    **shards_from_env(os.environ),
 }
 
+# Users are spread over the shards when there are some (SESSION_SHARDING),
+# reads go to the replicas otherwise (SESSION_REPLICAS)
+DATABASE_ROUTERS = [
+    'session_system.sharding.ShardRouter',
+    'session_system.db_router.PrimaryReplicaRouter',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -141,3 +227,126 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Session system
+
+# Serve the native async views, enabled by default by technical_test.asgi
+SESSION_SYSTEM_ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS', '0') == '1'
+
+# Resolve user, device and alive session of POST /session/ in one statement
+# with INSERT ... ON CONFLICT upserts (Postgres only)
+SESSION_UPSERT_FAST_PATH = True
+
+# Maximum number of items accepted by POST /session/batch/
+SESSION_BATCH_MAX_SIZE = 5000
+
+# In-process cache of bearer token -> session used by the token middleware
+SESSION_TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,  # seconds
+}
+
+# Per process cache of the serialized session responses, keyed by session
+# uuid and status
+SESSION_RESPONSE_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,  # seconds
+}
+
+# Replicas lagging more than MAX_LAG seconds behind the primary aren't read,
+# a session is read from the primary for STICKY_SECONDS after it was written.
+# The pins are kept in CACHE, which must be shared by the web processes
+# (SESSION_STORE_CACHE_URL) for a session written by one process to be read
+# from the primary by the others
+SESSION_REPLICAS = {
+    'MAX_LAG': 2,  # seconds
+    'LAG_CHECK_INTERVAL': 1,  # seconds
+    'STICKY_SECONDS': 5,
+    'CACHE': 'sessions',  # shared by the web processes with Redis
+}
+
+# Emails hash to BUCKETS buckets, MAP assigns them to the shards as
+# {"alias": [[first, last], ...]}, split evenly between the shards when unset
+SESSION_SHARDING = {
+    'BUCKETS': 1024,
+    'MAP': json.loads(os.environ.get('SESSION_SHARD_MAP', 'null')),
+}
+
+# Retries of POST /session/ with the same Idempotency-Key header get the
+# first response replayed for TTL seconds, from the CACHE or the database.
+# A retry arriving while the first request is handled waits up to WAIT
+# seconds for its response
+SESSION_IDEMPOTENCY = {
+    'ENABLED': True,
+    'CACHE': 'sessions',  # shared by the web processes with Redis
+    'TTL': 3600,  # seconds
+    'LOCK_TIMEOUT': 30,  # seconds a request may take
+    'WAIT': 5,  # seconds
+    'POLL_INTERVAL': 0.05,  # seconds
+}
+
+# Sessions per page of GET /user/<uuid>/sessions/ and
+# GET /device/<uuid>/sessions/, the client asks for up to MAX_PAGE_SIZE
+SESSION_LISTING = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+}
+
+# Revocations bump session generation counters of the users and devices, kept
+# in CACHE for TTL seconds for the token middleware to reject the revoked
+# sessions it cached. Without a shared CACHE (SESSION_STORE_CACHE_URL) the
+# other processes only see a revocation once their token cache expires,
+# check --deploy and gunicorn warn about it when they start
+SESSION_REVOCATION = {
+    'CACHE': 'sessions',  # shared by the web processes with Redis
+    'TTL': 300,  # seconds
+}
+
+# Prometheus metrics of GET /metrics, only served to the clients (REMOTE_ADDR)
+# of ALLOWED_NETWORKS: scrape the workers directly, not through the public
+# proxy
+SESSION_METRICS = {
+    'ENDPOINT': os.environ.get('SESSION_METRICS_ENDPOINT', '1') == '1',
+    'ALLOWED_NETWORKS': os.environ.get(
+        'SESSION_METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128'
+    ).split(','),
+}
+
+# Staff-only GET /session/export/ streaming the sessions as NDJSON or CSV,
+# read from the database CHUNK_SIZE rows at a time (export_sessions command)
+SESSION_EXPORT = {
+    'ENDPOINT': os.environ.get('SESSION_EXPORT_ENDPOINT', '0') == '1',
+    'CHUNK_SIZE': 2000,
+}
+
+# Optional store of the hot session state in the sessions cache, Redis when
+# SESSION_STORE_CACHE_URL is set. Transitions are written to the database
+# right away ('through') or in batches every FLUSH_INTERVAL ('behind')
+SESSION_STORE = {
+    'ENABLED': os.environ.get('SESSION_STORE_ENABLED', '0') == '1',
+    'CACHE': 'sessions',
+    'WRITE_MODE': os.environ.get('SESSION_STORE_WRITE_MODE', 'through'),
+    'TIMEOUT': 86400,  # seconds a state is kept at most
+    'FLUSH_INTERVAL': 1,  # seconds between two write-behind batches
+    'BATCH_SIZE': 500,
+}
+
+# Background thread of each gunicorn worker flagging the stale sessions as
+# expired, the sweep_sessions command does the same from outside the web
+# processes
+SESSION_SWEEPER = {
+    'ENABLED': os.environ.get('SESSION_SWEEPER_ENABLED', '0') == '1',
+    'INTERVAL': 60,  # seconds between two sweeps
+    'BATCH_SIZE': 1000,
+    'THROTTLE': 0,  # seconds between two batches
+}
+
+# Range partitioning of the Session table by created_at, managed by the
+# partition_sessions command
+SESSION_PARTITIONING = {
+    'INTERVAL': 'week',  # or 'day'
+    'AHEAD': 4,  # partitions created in advance
+    'RETENTION_DAYS': 0,  # partitions older than this are dropped, 0 keeps all
+    'ARCHIVE_DIR': None,  # where dropped partitions are exported as CSV
+}
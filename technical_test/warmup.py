@@ -0,0 +1,53 @@
+"""
+Warm up a freshly started process before it accepts traffic, so the first
+requests don't pay for lazy initialization.
+"""
+from django.core import checks
+from django.db import connections
+from django.urls import resolve
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_urls():
+    """Import the URLconf and its views, and build the resolver"""
+    resolve("/session/")
+
+
+def warm_up():
+    """
+    Populate the URL resolver, open the database connections and run a first
+    query through the ORM paths of the session endpoints.
+    """
+    from session_system.models import Session, hash_token
+    from session_system.token_cache import SESSION_RECORD_FIELDS
+
+    load_urls()
+
+    for connection in connections.all():
+        connection.ensure_connection()
+    sessions = Session.objects.filter(token_hash=hash_token(""))
+    sessions.values_list(*SESSION_RECORD_FIELDS).first()
+    logger.info("Warmed up")
+
+
+def close_connections():
+    """Drop the connections a parent process must not share with its children"""
+    for connection in connections.all():
+        connection.close()
+        if getattr(connection, "pool", None):
+            connection.close_pool()
+
+
+def log_cache_checks():
+    """
+    Log the issues of the cache checks, deployment ones included: the web
+    processes must share the caches checked there.
+    """
+    issues = checks.run_checks(
+        tags=[checks.Tags.caches], include_deployment_checks=True
+    )
+    for issue in issues:
+        logger.warning("%s", issue)